@@ -10,11 +10,19 @@ from .company import *
 from .payroll import *
 from .attendance import *
 from .configuration import *
+from .document import *
+from .payment import *
+from .profiling import *
+from .feed import *
+from .ical import *
+from .onboarding import *
+from .rollup import *
 
 
 def register():
     Pool.register(
         Department,
+        DepartmentShift,
         Responsibility,
         Language,
         Academic,
@@ -25,13 +33,31 @@ def register():
         PayrollYear,
         PayrollPeriod,
         PayrollHoliday,
+        RolloverStart,
         AttendanceSummary,
+        LeaveType,
         LeaveApplication,
+        LeaveBalance,
+        LeaveAccrual,
         PaymentDetail,
         Party,
         Configuration,
-        LeaveConfiguration,
         Employee,
         EmployeeHistory,
         Attendance,
+        DocumentExpiry,
+        PaymentBatch,
+        PaymentBatchLine,
+        ImportReturnsStart,
+        Profile,
+        ChangeTombstone,
+        ChangeFeed,
+        CalendarFeed,
+        Onboarding,
+        DepartmentHeadcount,
+        DepartmentAllowance,
         module='hr', type_='model')
+    Pool.register(
+        ImportReturns,
+        Rollover,
+        module='hr', type_='wizard')
@@ -5,20 +5,68 @@
     :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+import datetime
 from datetime import timedelta
 from time import strftime
 
 from trytond.model import ModelView, ModelSQL, Workflow, fields
+from trytond.backend import TableHandler, DatabaseIntegrityError
+from trytond.config import CONFIG
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction
 from trytond.pool import Pool
 from trytond.pyson import Eval
+from trytond.rpc import RPC
+
+from .bulk import bulk_insert
+from .profiling import profiled
 
 __all__ = [
-    'Attendance', 'AttendanceSummary', 'LeaveApplication',
+    'Attendance', 'AttendanceSummary', 'LeaveType', 'LeaveApplication',
+    'LeaveBalance', 'LeaveAccrual',
+]
+
+# The leave types which were hard coded before they became records, with
+# the suffix of their former configuration columns and default entitlements
+# for (probation, confirmed) employees
+DEFAULT_LEAVE_TYPES = [
+    ('casual', 'Casual Leave', 'cl', (5, 10)),
+    ('sick', 'Sick Leave', 'sl', (5, 10)),
+    ('earned', 'Earned Leave', 'el', (0, 15)),
+    ('study', 'Study Leave', 'dl', (0, 0)),
+    ('paternity', 'Paternity Leave', 'pl', (0, 0)),
+    ('annual', 'Annual Leave', 'al', (0, 0)),
 ]
 
 
+def sql_days_between(end, start):
+    "Return the SQL expression of the number of days from start to end"
+    if CONFIG['db_type'] == 'sqlite':
+        return 'CAST(julianday(%s) - julianday(%s) AS INTEGER)' % (end, start)
+    return '(%s - %s)' % (end, start)
+
+
+def sql_minutes_between(end, start):
+    "Return the SQL expression of the number of minutes from start to end"
+    if CONFIG['db_type'] == 'sqlite':
+        return ('CAST(ROUND((julianday(%s) - julianday(%s)) * 86400) / 60 '
+            'AS INTEGER)' % (end, start))
+    return ('CAST(FLOOR(EXTRACT(EPOCH FROM %s - %s) / 60) AS INTEGER)'
+        % (end, start))
+
+
+def sql_date(timestamp, days=0):
+    "Return the SQL expression of the date of timestamp plus days"
+    if CONFIG['db_type'] == 'sqlite':
+        if days:
+            return "date(%s, '%+d day')" % (timestamp, days)
+        return 'date(%s)' % timestamp
+    return '(CAST(%s AS DATE) + %d)' % (timestamp, days)
+
+
 def daterange(start_date, end_date):
-    for n in range(int ((end_date - start_date).days)):
+    "Yield the days from start_date to end_date included"
+    for n in range(int((end_date - start_date).days) + 1):
         yield start_date + timedelta(n)
 
 
@@ -48,7 +96,14 @@ class Attendance(ModelSQL, ModelView):
     out_time = fields.DateTime('Out time', states={
         'invisible': ~Eval('on_leave') != True,
     }, depends=['on_leave'])
+    shift = fields.Many2One('company.department.shift', 'Shift',
+        states={
+            'invisible': Eval('on_leave', False),
+        }, depends=['on_leave'])
     on_leave = fields.Boolean('On Leave')
+    absent = fields.Boolean('Absent', readonly=True, select=True)
+    worked_minutes = fields.Integer('Worked Minutes', readonly=True,
+        select=True)
     leave_application = fields.Many2One(
         'employee.leave.application', 'Leave Application',
         states={
@@ -62,71 +117,440 @@ class Attendance(ModelSQL, ModelView):
         Date = Pool().get('ir.date')
         return Date.today()
 
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().cursor
+        super(Attendance, cls).__register__(module_name)
+        table = TableHandler(cursor, cls, module_name)
+
+        # Incremental consumers look for the records changed since a date
+        table.index_action('create_date', 'add')
+        table.index_action('write_date', 'add')
+
     @classmethod
     def __setup__(cls):
         super(Attendance, cls).__setup__()
-        cls._constraints += [
-            ('check_in_time', 'missing_in_time'),
-            ('check_times', 'wrong_times'),
-            ('check_out_time', 'invalid_out_time'),
-        ]
         cls._error_messages.update({
             'invalid_period': 'Either 0 or more than 1 periods found for '
                 'this date! There should be only 1 period for this date',
-             'wrong_times': 'The day on In time and Out time should be same',
-             'missing_in_time': \
+            'wrong_times': 'The day on In time and Out time should be same '
+                'unless the shift ends on the next day',
+            'missing_in_time': \
                 'Out time can only be entered if In time is provided',
             'invalid_out_time': 'Out time cannot be lesser than In time',
+            'invalid_shift': 'The shift must be one of the department '
+                'of the employee',
+        })
+        cls._sql_constraints += [
+            ('employee_date_uniq', 'UNIQUE(employee, date)',
+                'An employee can have only one attendance per day'),
+        ]
+        cls.__rpc__.update({
+            'calendar': RPC(),
+            'overtime': RPC(),
+            'recompute_worked_minutes': RPC(readonly=False),
         })
 
-    def check_in_time(self):
-        'Check if In time is provided before Out time'
-        if self.out_time and not self.in_time:
-            return False
-        return True
+    @staticmethod
+    def default_absent():
+        return False
 
-    def check_times(self):
-        'Check if the In time and Out time are on same day'
-        if self.in_time and self.out_time and \
-                not self.in_time.date() == self.out_time.date():
-            return False
-        return True
+    @classmethod
+    @profiled
+    def _validate(cls, attendances):
+        """
+        Check the times and shifts of all the attendances with one query per
+        batch of ids instead of a method call per record.
 
-    def check_out_time(self):
-        'Check if Out time is not lesser than In time'
-        if self.in_time and self.out_time and self.out_time <= self.in_time:
-            return False
-        return True
+        The out time must follow the in time on the same day, or on the next
+        day when the shift ends after midnight.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        Shift = pool.get('company.department.shift')
+        cursor = Transaction().cursor
+
+        super(Attendance, cls)._validate(attendances)
+
+        both = 'a.in_time IS NOT NULL AND a.out_time IS NOT NULL'
+        in_date, next_date = sql_date('a.in_time'), sql_date('a.in_time', 1)
+        out_date = sql_date('a.out_time')
+        checks = [
+            ('missing_in_time',
+                'a.out_time IS NOT NULL AND a.in_time IS NULL'),
+            ('invalid_out_time', both + ' AND a.out_time <= a.in_time'),
+            ('wrong_times', both + ' '
+                'AND ' + out_date + ' != ' + in_date + ' '
+                'AND NOT (s.end_time <= s.start_time '
+                    'AND ' + out_date + ' = ' + next_date + ')'),
+            ('invalid_shift', 'a.shift IS NOT NULL '
+                'AND (s.department IS NULL '
+                    'OR s.department != e.department)'),
+        ]
+        ids = [a.id for a in attendances]
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            red_sql, red_ids = reduce_ids('a.id', sub_ids)
+            cursor.execute('SELECT ' + ', '.join(
+                    'MAX(CASE WHEN %s THEN 1 ELSE 0 END)' % condition
+                    for _, condition in checks) + ' '
+                'FROM "' + cls._table + '" AS a '
+                'JOIN "' + Employee._table + '" AS e '
+                    'ON e.id = a.employee '
+                'LEFT JOIN "' + Shift._table + '" AS s ON s.id = a.shift '
+                'WHERE ' + red_sql, red_ids)
+            for (error, _), failed in zip(checks, cursor.fetchone()):
+                if failed:
+                    cls.raise_user_error(error)
+
+    @staticmethod
+    def _worked_minutes(in_time, out_time):
+        if in_time and out_time:
+            delta = out_time - in_time
+            return (delta.days * 24 * 60 * 60 + delta.seconds) // 60
+
+    @classmethod
+    def create(cls, values):
+        values = values.copy()
+        values['worked_minutes'] = cls._worked_minutes(
+            values.get('in_time'), values.get('out_time'))
+        return super(Attendance, cls).create(values)
+
+    @classmethod
+    def write(cls, attendances, values):
+        super(Attendance, cls).write(attendances, values)
+        if 'in_time' in values or 'out_time' in values:
+            cursor = Transaction().cursor
+            ids = [a.id for a in attendances]
+            for i in range(0, len(ids), cursor.IN_MAX):
+                sub_ids = ids[i:i + cursor.IN_MAX]
+                red_sql, red_ids = reduce_ids('id', sub_ids)
+                cls._update_worked_minutes(red_sql, red_ids)
+
+    @classmethod
+    def delete(cls, attendances):
+        Tombstone = Pool().get('hr.change.tombstone')
+        ids = [a.id for a in attendances]
+        super(Attendance, cls).delete(attendances)
+        Tombstone.record_deletions(cls.__name__, ids)
+
+    @classmethod
+    def _update_worked_minutes(cls, where, params):
+        "Store the worked minutes of the attendances matching where"
+        cursor = Transaction().cursor
+        cursor.execute('UPDATE "' + cls._table + '" '
+            'SET worked_minutes = CASE '
+                'WHEN in_time IS NOT NULL AND out_time IS NOT NULL '
+                'THEN ' + sql_minutes_between('out_time', 'in_time') + ' '
+                'ELSE NULL END '
+            'WHERE ' + where, params)
+
+    @classmethod
+    def recompute_worked_minutes(cls, size=10000):
+        """
+        Recompute the worked minutes of all the attendances by ranges of
+        size ids, committing after each range so that the rows are never
+        locked for long.
+        """
+        cursor = Transaction().cursor
+        cursor.execute('SELECT MIN(id), MAX(id) FROM "' + cls._table + '"')
+        min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            return
+        for start in xrange(min_id, max_id + 1, size):
+            cls._update_worked_minutes('id >= %s AND id < %s',
+                (start, start + size))
+            cursor.commit()
+
+    @classmethod
+    @profiled
+    def overtime(cls, period):
+        """
+        Return the worked and overtime minutes of the employees of the
+        departments which follow the period as a list of dictionaries with
+        employee, days, worked_minutes and overtime_minutes.
+
+        The overtime of a day is the time worked beyond the standard hours
+        of the department of the employee. It is aggregated with a single
+        grouped query on the stored worked minutes.
+
+        The period is either a record or its id, as given by the RPC.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        Department = pool.get('company.department')
+        Period = pool.get('payroll.period')
+        cursor = Transaction().cursor
+
+        if not isinstance(period, Period):
+            period = Period(period)
+
+        standard = 'CAST(COALESCE(d.standard_hours, 0) * 60 AS INTEGER)'
+        departments, params = period.departments_query()
+        cursor.execute('SELECT a.employee, COUNT(a.id), '
+                'SUM(a.worked_minutes), '
+                'SUM(CASE WHEN a.worked_minutes > ' + standard + ' '
+                    'THEN a.worked_minutes - ' + standard + ' '
+                    'ELSE 0 END) '
+            'FROM "' + cls._table + '" AS a '
+            'JOIN "' + Employee._table + '" AS e ON e.id = a.employee '
+            'JOIN "' + Department._table + '" AS d ON d.id = e.department '
+            'WHERE e.department IN (' + departments + ') '
+                'AND a.date >= %s AND a.date <= %s '
+                'AND a.worked_minutes IS NOT NULL '
+            'GROUP BY a.employee '
+            'ORDER BY a.employee',
+            params + [period.start_date, period.end_date])
+        return [{
+                'employee': employee,
+                'days': days,
+                'worked_minutes': worked,
+                'overtime_minutes': overtime,
+                } for employee, days, worked, overtime in cursor.fetchall()]
 
     def on_change_in_time(self):
         if self.in_time:
             return {'date': self.in_time.date()}
 
-    def get_period(self, name):
-        Period = Pool().get('payroll.period')
-
-        periods = Period.search([
-            ('state', '=', 'open'),
-            ('start_date', '<=', self.date),
-            ('end_date', '>=', self.date),
-        ])
-        if not periods or len(periods) > 1:
-            self.raise_user_error('invalid_period')
+    @classmethod
+    @profiled
+    def get_period(cls, attendances, name):
+        """
+        Return the open payroll period followed by the department of the
+        employee at the date of each attendance, looked up in the cached
+        calendars of the departments.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        Period = pool.get('payroll.period')
+        cursor = Transaction().cursor
 
-        return periods[0].id
+        ids = [a.id for a in attendances]
+        result = {}
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            red_sql, red_ids = reduce_ids('a.id', sub_ids)
+            cursor.execute('SELECT a.id, e.department, a.date '
+                'FROM "' + cls._table + '" AS a '
+                'JOIN "' + Employee._table + '" AS e ON e.id = a.employee '
+                'WHERE ' + red_sql, red_ids)
+            for id_, department, date in cursor.fetchall():
+                result[id_] = Period.find(department, date, state='open')
+                if result[id_] is None:
+                    cls.raise_user_error('invalid_period')
+        return result
 
+    @profiled
     def get_is_holiday(self, name):
         if not self.period:
             return False
         holidays = [holiday.date for holiday in self.period.holidays]
-        if self.on_leave:
-            date = self.date
-        else:
+        if self.in_time and not self.on_leave:
             date = self.in_time.date()
+        else:
+            date = self.date
         if date in holidays:
             return True
         return False
 
+    @classmethod
+    @profiled
+    def calendar(cls, department, start_date, end_date):
+        """
+        Return the attendance grid of the current employees of the
+        department and its sub-departments between the dates as::
+
+            {
+                'start_date': start_date,
+                'end_date': end_date,
+                'employees': [[employee id, [[status, days], ...]], ...],
+            }
+
+        The days of each employee are run-length encoded in date order with
+        the status 'P' when present, 'H' on a holiday, 'A' when absent or the
+        code of the leave type when on leave. The whole grid comes from a
+        single query.
+        """
+        pool = Pool()
+        Department = pool.get('company.department')
+        Employee = pool.get('company.employee')
+        LeaveApplication = pool.get('employee.leave.application')
+        LeaveType = pool.get('employee.leave.type')
+        PayrollYear = pool.get('payroll.year')
+        Period = pool.get('payroll.period')
+        Holiday = pool.get('payroll.holiday')
+        cursor = Transaction().cursor
+
+        if isinstance(department, Department):
+            department = department.id
+        day = sql_days_between('%s', '%s')
+        cursor.execute('SELECT * FROM (' + Department.subtree_query() +
+            'SELECT e.id, ' + day % ('a.date', '%s') + ', '
+                'CASE WHEN a.on_leave THEN t.code '
+                    'WHEN a.absent THEN %s ELSE %s END '
+            'FROM subtree '
+            'JOIN "' + Employee._table + '" AS e '
+                'ON e.department = subtree.id '
+            'LEFT JOIN "' + cls._table + '" AS a '
+                'ON a.employee = e.id '
+                'AND a.date >= %s AND a.date <= %s '
+            'LEFT JOIN "' + LeaveApplication._table + '" AS l '
+                'ON l.id = a.leave_application '
+            'LEFT JOIN "' + LeaveType._table + '" AS t '
+                'ON t.id = l.leave_type '
+            'WHERE e.state = %s '
+            'UNION ALL '
+            'SELECT e.id, ' + day % ('h.date', '%s') + ', %s '
+            'FROM subtree '
+            'JOIN "' + Employee._table + '" AS e '
+                'ON e.department = subtree.id '
+            'JOIN (' + PayrollYear.department_years() + ') AS dy '
+                'ON dy.department = e.department '
+            'JOIN "' + Period._table + '" AS p '
+                'ON p.payroll_year = dy.year '
+            'JOIN "' + Holiday._table + '" AS h ON h.period = p.id '
+            'WHERE e.state = %s '
+                'AND h.date >= %s AND h.date <= %s) AS days',
+            (department, start_date, 'A', 'P', start_date, end_date,
+                'current',
+                start_date, 'H', 'current', start_date, end_date))
+
+        # Leaves take precedence over presence, presence over holidays
+        days = (end_date - start_date).days + 1
+        grids = {}
+        for employee, offset, status in cursor.fetchall():
+            grid = grids.setdefault(employee, ['A'] * days)
+            if offset is None:
+                continue
+            if grid[offset] == 'A' or status not in ('P', 'H') \
+                    or grid[offset] == 'H':
+                grid[offset] = status
+
+        employees = []
+        for employee in sorted(grids):
+            runs = []
+            for status in grids[employee]:
+                if runs and runs[-1][0] == status:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([status, 1])
+            employees.append([employee, runs])
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'employees': employees,
+        }
+
+
+    @classmethod
+    def detect_due(cls):
+        """
+        Mark the absences of the open payroll periods up to yesterday,
+        committing after each period.
+
+        Only the days after the last detection of the period are scanned, so
+        each run covers the days passed since the previous one.
+        """
+        pool = Pool()
+        Period = pool.get('payroll.period')
+        Date = pool.get('ir.date')
+        cursor = Transaction().cursor
+
+        yesterday = Date.today() - timedelta(days=1)
+        periods = Period.search([
+            ('state', '=', 'open'),
+            ('start_date', '<=', yesterday),
+            ['OR',
+                ('absences_date', '=', None),
+                ('absences_date', '<', yesterday),
+            ],
+        ], order=[('start_date', 'ASC')])
+        for period in periods:
+            end_date = min(period.end_date, yesterday)
+            start_date = period.start_date
+            if period.absences_date:
+                start_date = period.absences_date + timedelta(days=1)
+            if start_date > end_date:
+                continue
+            cls.detect_absences(period, end_date, start_date=start_date)
+            Period.write([period], {'absences_date': end_date})
+            cursor.commit()
+
+    @classmethod
+    @profiled
+    def detect_absences(cls, period, end_date=None, start_date=None):
+        """
+        Insert an absent attendance for every working day of the period from
+        start_date up to end_date on which a current employee of the departments which
+        follow the period has no attendance.
+
+        The working days are the days of the period which are neither a
+        holiday nor a weekly off of the department. They are generated in
+        SQL and the missing days are found with a single anti-join per set
+        of weekly offs, so running it again only adds the absences of the
+        new days.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        Department = pool.get('company.department')
+        Holiday = pool.get('payroll.holiday')
+        cursor = Transaction().cursor
+
+        start_date = max(start_date or period.start_date, period.start_date)
+        end_date = min(end_date or period.end_date, period.end_date)
+        if CONFIG['db_type'] == 'postgresql':
+            calendar = ('WITH calendar (day) AS ('
+                    'SELECT CAST(g AS DATE) FROM generate_series('
+                        'CAST(%s AS DATE), CAST(%s AS DATE), '
+                        "INTERVAL '1 day') AS g) ")
+            weekday = 'CAST(EXTRACT(ISODOW FROM c.day) AS INTEGER)'
+        else:
+            # A recursive WITH clause stands for the calendar table
+            calendar = ('WITH RECURSIVE calendar (day) AS ('
+                    'SELECT date(%s) '
+                    'UNION ALL '
+                    "SELECT date(day, '+1 day') FROM calendar "
+                    'WHERE day < date(%s)) ')
+            # The SQLite cursor passes % through, unlike psycopg2 which
+            # needs it doubled
+            weekday = ("((CAST(strftime('%w', c.day) AS INTEGER) + 6) "
+                "% 7 + 1)")
+
+        departments, params = period.departments_query()
+        cursor.execute(departments, params)
+        by_weekly_offs = {}
+        for department in Department.browse(
+                [x[0] for x in cursor.fetchall()]):
+            weekly_offs = tuple(sorted(department.get_weekly_offs())) or (0,)
+            by_weekly_offs.setdefault(weekly_offs, []).append(department.id)
+
+        for weekly_offs, department_ids in by_weekly_offs.iteritems():
+            for i in range(0, len(department_ids), cursor.IN_MAX):
+                red_sql, red_ids = reduce_ids('e.department',
+                    department_ids[i:i + cursor.IN_MAX])
+                cursor.execute('INSERT INTO "' + cls._table + '" '
+                        '(create_uid, create_date, employee, date, '
+                        'on_leave, absent) '
+                    + calendar +
+                    'SELECT %s, %s, e.id, c.day, %s, %s '
+                    'FROM "' + Employee._table + '" AS e '
+                    'CROSS JOIN calendar AS c '
+                    'WHERE ' + red_sql + ' '
+                        'AND e.state = %s '
+                        'AND (e.join_date IS NULL OR e.join_date <= c.day) '
+                        'AND ' + weekday + ' NOT IN '
+                            '(' + ','.join(('%s',) * len(weekly_offs)) + ') '
+                        'AND NOT EXISTS (SELECT 1 '
+                                'FROM "' + Holiday._table + '" AS h '
+                            'WHERE h.period = %s AND h.date = c.day) '
+                        'AND NOT EXISTS (SELECT 1 '
+                                'FROM "' + cls._table + '" AS a '
+                            'WHERE a.employee = e.id AND a.date = c.day)',
+                    [start_date, end_date,
+                        Transaction().user, datetime.datetime.now(), False,
+                        True] + red_ids + ['current'] + list(weekly_offs)
+                    + [period.id])
+
 
 class AttendanceSummary(ModelSQL, ModelView):
     'Attendance Summary'
@@ -143,6 +567,94 @@ class AttendanceSummary(ModelSQL, ModelView):
     leaves = fields.Numeric('Leaves Taken')
 
 
+class LeaveType(ModelSQL, ModelView):
+    "Leave Type"
+    __name__ = 'employee.leave.type'
+
+    name = fields.Char('Name', required=True, translate=True)
+    code = fields.Char('Code', required=True, select=True)
+    active = fields.Boolean('Active')
+    probation_days = fields.Integer('Probation Entitlement (days)',
+        required=True)
+    confirmed_days = fields.Integer('Confirmed Entitlement (days)',
+        required=True)
+    accrual = fields.Selection([
+        ('annual', 'Annual'),
+        ('monthly', 'Monthly'),
+    ], 'Accrual', required=True)
+    carry_forward_cap = fields.Integer('Carry Forward Cap (days)',
+        required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(LeaveType, cls).__setup__()
+        cls._sql_constraints = [
+            ('code_uniq', 'UNIQUE(code)', 'The code of the leave type '
+                'must be unique'),
+        ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().cursor
+        created = not TableHandler.table_exist(cursor, cls._table)
+        super(LeaveType, cls).__register__(module_name)
+        if created:
+            cls._create_default_types()
+
+    @classmethod
+    def _create_default_types(cls):
+        """
+        Create the leave types which used to be hard coded, with the
+        entitlements of the former leave configuration when it exists.
+        """
+        cursor = Transaction().cursor
+
+        entitlements = {}
+        if TableHandler.table_exist(cursor, 'employee_leave_configuration'):
+            columns = []
+            for _, _, suffix, _ in DEFAULT_LEAVE_TYPES:
+                columns += ['probation_' + suffix, 'confirmed_' + suffix]
+            cursor.execute('SELECT ' + ', '.join(columns) + ' '
+                'FROM employee_leave_configuration ORDER BY id')
+            row = cursor.fetchone()
+            if row:
+                entitlements = dict(zip(columns, row))
+
+        now = datetime.datetime.now()
+        for code, name, suffix, defaults in DEFAULT_LEAVE_TYPES:
+            probation = entitlements.get('probation_' + suffix)
+            confirmed = entitlements.get('confirmed_' + suffix)
+            cursor.execute('INSERT INTO "' + cls._table + '" '
+                    '(create_uid, create_date, name, code, active, '
+                    'probation_days, confirmed_days, accrual, '
+                    'carry_forward_cap) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                (0, now, name, code, True,
+                    probation if probation is not None else defaults[0],
+                    confirmed if confirmed is not None else defaults[1],
+                    cls.default_accrual(), cls.default_carry_forward_cap()))
+
+    @staticmethod
+    def default_active():
+        return True
+
+    @staticmethod
+    def default_probation_days():
+        return 0
+
+    @staticmethod
+    def default_confirmed_days():
+        return 0
+
+    @staticmethod
+    def default_accrual():
+        return 'annual'
+
+    @staticmethod
+    def default_carry_forward_cap():
+        return 0
+
+
 class LeaveApplication(Workflow, ModelSQL, ModelView):
     "Leave Application"
     __name__ = 'employee.leave.application'
@@ -167,14 +679,8 @@ class LeaveApplication(Workflow, ModelSQL, ModelView):
     ], 'Type', required=True,
         states={'readonly': Eval('state') != 'Draft'}, depends=['state']
     )
-    leave_type = fields.Selection([
-        ('casual', 'Casual Leave'),
-        ('Sick', 'Sick Leave'),
-        ('earned', 'earned Leave'),
-        ('study', 'Study Leave'),
-        ('paternity', 'Paternity Leave'),
-        ('annual', 'Annual Leave')
-    ], 'Leave Type', required=True,
+    leave_type = fields.Many2One(
+        'employee.leave.type', 'Leave Type', required=True, select=True,
         states={'readonly': Eval('state') != 'Draft'}, depends=['state']
     )
     state = fields.Selection([
@@ -192,6 +698,40 @@ class LeaveApplication(Workflow, ModelSQL, ModelView):
     def default_type():
         return 'full_day'
 
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        LeaveType = pool.get('employee.leave.type')
+        cursor = Transaction().cursor
+        table = TableHandler(cursor, cls, module_name)
+
+        # Migration from the hard coded selection: keep the codes aside
+        # until the column is recreated as a foreign key
+        migrate_leave_type = (table.column_exist('leave_type')
+            and table._columns['leave_type']['typname'].lower()
+            in ('varchar', 'text'))
+        if migrate_leave_type:
+            table.column_rename('leave_type', 'leave_type_code')
+
+        super(LeaveApplication, cls).__register__(module_name)
+
+        if migrate_leave_type:
+            # The selection stored 'Sick' capitalised
+            cursor.execute('UPDATE "' + cls._table + '" '
+                'SET leave_type = ('
+                    'SELECT t.id FROM "' + LeaveType._table + '" AS t '
+                    'WHERE t.code = '
+                        'LOWER("' + cls._table + '".leave_type_code)'
+                ')')
+            table = TableHandler(cursor, cls, module_name)
+            table.drop_column('leave_type_code')
+            table.not_null_action('leave_type', action='add')
+
+        # Incremental consumers look for the records changed since a date
+        table = TableHandler(cursor, cls, module_name)
+        table.index_action('create_date', 'add')
+        table.index_action('write_date', 'add')
+
     @classmethod
     def __setup__(cls):
         super(LeaveApplication, cls).__setup__()
@@ -214,7 +754,11 @@ class LeaveApplication(Workflow, ModelSQL, ModelView):
         })
         cls._error_messages.update({
             'wrong_type': \
-                'OOPS! Half day leaves are not implemented yet'
+                'OOPS! Half day leaves are not implemented yet',
+            'not_in_review': 'The leave application "%s" is not in review '
+                'anymore',
+            'attendance_conflict': 'The employee "%s" already has an '
+                'attendance on %s',
         })
 
     def check_type(self):
@@ -226,6 +770,7 @@ class LeaveApplication(Workflow, ModelSQL, ModelView):
     @classmethod
     @ModelView.button
     @Workflow.transition('In Review')
+    @profiled
     def review(cls, apps):
         for app in apps:
             if not app.check_type():
@@ -234,19 +779,357 @@ class LeaveApplication(Workflow, ModelSQL, ModelView):
     @classmethod
     @ModelView.button
     @Workflow.transition('Approved')
+    @profiled
     def approve(cls, apps):
+        """
+        Book the days of the applications as leave attendance.
+
+        The employees and the applications are locked first, so concurrent
+        approvals for the same employee are serialised while those of other
+        employees proceed. The absences already marked on the leave days are
+        turned into leaves; any other attendance on these days is a
+        conflict.
+        """
         Attendance = Pool().get('employee.attendance')
+        cursor = Transaction().cursor
+
+        cls._lock(apps)
         for app in apps:
-            for single_date in daterange(app.from_date, app.to_date):
-                Attendance.create({
-                    'employee': app.employee.id,
-                    'date': single_date,
-                    'on_leave': True,
-                    'leave_application': app.id
-                })
+            dates = list(daterange(app.from_date, app.to_date))
+            if not dates:
+                continue
+            cursor.execute('SELECT id, date, absent '
+                'FROM "' + Attendance._table + '" '
+                'WHERE employee = %s AND date >= %s AND date <= %s',
+                (app.employee.id, dates[0], dates[-1]))
+            absences = {}
+            for attendance_id, date, absent in cursor.fetchall():
+                if not absent:
+                    cls.raise_user_error('attendance_conflict',
+                        (app.employee.rec_name, date))
+                absences[attendance_id] = date
+            if absences:
+                red_sql, red_ids = reduce_ids('id', absences.keys())
+                cursor.execute('UPDATE "' + Attendance._table + '" '
+                    'SET absent = %s, on_leave = %s, leave_application = %s, '
+                        'write_uid = %s, write_date = %s '
+                    'WHERE ' + red_sql,
+                    [False, True, app.id, Transaction().user,
+                        datetime.datetime.now()] + red_ids)
+                booked = set(absences.itervalues())
+                dates = [d for d in dates if d not in booked]
+            # The unique (employee, date) constraint stops any double booking
+            # which would get past the locks: on PostgreSQL the snapshot of
+            # the transaction does not see the attendance of the approvals
+            # committed while it was waiting for them
+            employee = app.employee
+            try:
+                bulk_insert(Attendance._table,
+                    ['employee', 'date', 'on_leave', 'absent',
+                        'leave_application'],
+                    [(employee.id, d, True, False, app.id) for d in dates],
+                    return_ids=False)
+            except DatabaseIntegrityError:
+                with Transaction().new_cursor():
+                    cursor = Transaction().cursor
+                    cursor.execute('SELECT MIN(date) '
+                        'FROM "' + Attendance._table + '" '
+                        'WHERE employee = %s AND date >= %s AND date <= %s',
+                        (employee.id, dates[0], dates[-1]))
+                    date, = cursor.fetchone()
+                    cls.raise_user_error('attendance_conflict',
+                        (employee.rec_name, date))
+
+    @classmethod
+    def _lock(cls, apps):
+        """
+        Lock the employees and then the applications in id order, to not
+        deadlock, and check the applications are still in review once the
+        concurrent approvals are over.
+        """
+        Employee = Pool().get('company.employee')
+        cursor = Transaction().cursor
+
+        if CONFIG['db_type'] != 'postgresql':
+            # The other backends serialise the writing transactions
+            return
+        for Model, ids in (
+                (Employee, sorted(set(a.employee.id for a in apps))),
+                (cls, sorted(a.id for a in apps))):
+            for i in range(0, len(ids), cursor.IN_MAX):
+                sub_ids = ids[i:i + cursor.IN_MAX]
+                red_sql, red_ids = reduce_ids('id', sub_ids)
+                cursor.execute('SELECT id FROM "' + Model._table + '" '
+                    'WHERE ' + red_sql + ' ORDER BY id FOR UPDATE', red_ids)
+        ids = [a.id for a in apps]
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            red_sql, red_ids = reduce_ids('id', sub_ids)
+            cursor.execute('SELECT id FROM "' + cls._table + '" '
+                'WHERE ' + red_sql + ' AND state != %s',
+                red_ids + ['In Review'])
+            row = cursor.fetchone()
+            if row:
+                cls.raise_user_error('not_in_review', (cls(row[0]).rec_name,))
 
     @classmethod
     @ModelView.button
     @Workflow.transition('Denied')
+    @profiled
     def deny(cls, apps):
         pass
+
+    @classmethod
+    def delete(cls, apps):
+        Tombstone = Pool().get('hr.change.tombstone')
+        ids = [a.id for a in apps]
+        super(LeaveApplication, cls).delete(apps)
+        Tombstone.record_deletions(cls.__name__, ids)
+
+
+class LeaveBalance(ModelSQL, ModelView):
+    "Leave Balance"
+    __name__ = 'employee.leave.balance'
+    _rec_name = 'leave_type'
+
+    employee = fields.Many2One('company.employee', 'Employee', readonly=True)
+    leave_type = fields.Many2One('employee.leave.type', 'Leave Type',
+        readonly=True)
+    entitled = fields.Numeric('Entitled', digits=(16, 2), readonly=True)
+    taken = fields.Integer('Taken', readonly=True)
+    available = fields.Numeric('Available', digits=(16, 2), readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(LeaveBalance, cls).__setup__()
+        cls._order.insert(0, ('leave_type', 'ASC'))
+
+    @classmethod
+    def table_query(cls):
+        """
+        Compute the balance of every leave type for every employee in the
+        current payroll year followed by its department with a single
+        aggregate.
+        The entitlement is the flat one of the leave type, or the accrued
+        days for the monthly ones, plus the days carried forward.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        LeaveType = pool.get('employee.leave.type')
+        LeaveApplication = pool.get('employee.leave.application')
+        Attendance = pool.get('employee.attendance')
+        PayrollYear = pool.get('payroll.year')
+        Period = pool.get('payroll.period')
+        LeaveAccrual = pool.get('employee.leave.accrual')
+        Date = pool.get('ir.date')
+
+        today = Date.today()
+        flat = ('CASE WHEN e.type = %s '
+            'THEN t.probation_days ELSE t.confirmed_days END')
+        entitled = ('(CASE WHEN t.accrual = %s THEN 0 ELSE ' + flat + ' END '
+            '+ COALESCE(acc.days, 0))')
+        return ('SELECT e.id * n.n + t.id AS id, '
+                'MAX(e.create_uid) AS create_uid, '
+                'MAX(e.create_date) AS create_date, '
+                'MAX(e.write_uid) AS write_uid, '
+                'MAX(e.write_date) AS write_date, '
+                'e.id AS employee, t.id AS leave_type, '
+                + entitled + ' AS entitled, '
+                'COUNT(a.id) AS taken, '
+                + entitled + ' - COUNT(a.id) AS available '
+            'FROM "' + Employee._table + '" AS e '
+            'CROSS JOIN "' + LeaveType._table + '" AS t '
+            'CROSS JOIN (SELECT COALESCE(MAX(id), 0) + 1 AS n '
+                'FROM "' + LeaveType._table + '") AS n '
+            'LEFT JOIN (SELECT dy.department, y.id, y.start_date, '
+                    'y.end_date '
+                'FROM (' + PayrollYear.department_years() + ') AS dy '
+                'JOIN "' + PayrollYear._table + '" AS y ON y.id = dy.year '
+                'WHERE y.state = %s '
+                    'AND y.start_date <= %s AND y.end_date >= %s) AS y '
+                'ON y.department = e.department '
+            'LEFT JOIN (SELECT x.employee, x.leave_type, p.payroll_year, '
+                    'SUM(x.days) AS days '
+                'FROM "' + LeaveAccrual._table + '" AS x '
+                'JOIN "' + Period._table + '" AS p ON p.id = x.period '
+                'GROUP BY x.employee, x.leave_type, p.payroll_year) AS acc '
+                'ON acc.employee = e.id AND acc.leave_type = t.id '
+                'AND acc.payroll_year = y.id '
+            'LEFT JOIN "' + LeaveApplication._table + '" AS l '
+                'ON l.employee = e.id AND l.leave_type = t.id '
+            'LEFT JOIN "' + Attendance._table + '" AS a '
+                'ON a.leave_application = l.id '
+                'AND a.on_leave = %s '
+                'AND a.date >= y.start_date AND a.date <= y.end_date '
+            'WHERE t.active = %s '
+            'GROUP BY e.id, t.id, n.n, e.type, t.accrual, '
+                't.probation_days, t.confirmed_days, acc.days',
+            ['monthly', 'probation', 'monthly', 'probation',
+                'open', today, today, True, True])
+
+
+class LeaveAccrual(ModelSQL, ModelView):
+    "Leave Accrual"
+    __name__ = 'employee.leave.accrual'
+    _rec_name = 'leave_type'
+
+    employee = fields.Many2One('company.employee', 'Employee', required=True,
+        select=True, readonly=True, ondelete='CASCADE')
+    leave_type = fields.Many2One('employee.leave.type', 'Leave Type',
+        required=True, readonly=True, ondelete='CASCADE')
+    period = fields.Many2One('payroll.period', 'Payroll Period',
+        required=True, select=True, readonly=True, ondelete='CASCADE')
+    kind = fields.Selection([
+        ('accrual', 'Accrual'),
+        ('carry_forward', 'Carry Forward'),
+    ], 'Kind', required=True, readonly=True)
+    days = fields.Numeric('Days', digits=(16, 2), required=True,
+        readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(LeaveAccrual, cls).__setup__()
+        cls._sql_constraints = [
+            ('accrual_uniq', 'UNIQUE(employee, leave_type, period, kind)',
+                'A leave can be accrued only once per period'),
+        ]
+
+    @classmethod
+    def accrue_due(cls):
+        """
+        Accrue the open payroll periods which are over and not yet accrued,
+        committing after each period so that an interrupted run restarts
+        where it stopped.
+        """
+        Period = Pool().get('payroll.period')
+        Date = Pool().get('ir.date')
+        cursor = Transaction().cursor
+
+        cursor.execute('SELECT p.id FROM "' + Period._table + '" AS p '
+            'WHERE p.state = %s AND p.end_date < %s '
+                'AND NOT EXISTS (SELECT 1 FROM "' + cls._table + '" AS x '
+                    'WHERE x.period = p.id AND x.kind = %s) '
+            'ORDER BY p.start_date',
+            ('open', Date.today(), 'accrual'))
+        periods = Period.browse([row[0] for row in cursor.fetchall()])
+        for period in periods:
+            cls.accrue(period)
+            cursor.commit()
+
+    @classmethod
+    @profiled
+    def accrue(cls, period):
+        """
+        Accrue the leaves of all the current employees of the departments
+        which follow the period with set based statements.
+
+        Monthly leave types earn a twelfth of the entitlement, prorated by
+        the days worked in the period for the employees who joined during
+        it. On the first period of a payroll year, the balance left on the
+        previous year is carried forward up to the cap of the leave type.
+        Entries which already exist are kept, so running it again is a
+        no-op.
+        """
+        PayrollYear = Pool().get('payroll.year')
+
+        if period.start_date == period.payroll_year.start_date:
+            year = period.payroll_year
+            previous_years = PayrollYear.search([
+                ('company', '=', year.company.id),
+                ('department', '=',
+                    year.department.id if year.department else None),
+                ('end_date', '<', period.start_date),
+            ], order=[('end_date', 'DESC')], limit=1)
+            if previous_years:
+                cls._carry_forward(period, previous_years[0])
+        cls._accrue_monthly(period)
+
+    @classmethod
+    def _accrue_monthly(cls, period):
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        LeaveType = pool.get('employee.leave.type')
+        cursor = Transaction().cursor
+
+        period_days = (period.end_date - period.start_date).days + 1
+        worked = sql_days_between('%s', 'e.join_date') + ' + 1'
+        departments, params = period.departments_query()
+        cursor.execute('INSERT INTO "' + cls._table + '" '
+                '(create_uid, create_date, employee, leave_type, period, '
+                'kind, days) '
+            'SELECT %s, %s, e.id, t.id, %s, %s, ROUND(CAST('
+                '(CASE WHEN e.type = %s '
+                    'THEN t.probation_days ELSE t.confirmed_days END) '
+                '/ 12.0 '
+                '* (CASE WHEN e.join_date > %s '
+                    'THEN (' + worked + ') / %s ELSE 1 END) '
+                'AS NUMERIC), 2) '
+            'FROM "' + Employee._table + '" AS e '
+            'CROSS JOIN "' + LeaveType._table + '" AS t '
+            'WHERE e.department IN (' + departments + ') '
+                'AND e.state = %s '
+                'AND t.active = %s '
+                'AND t.accrual = %s '
+                'AND (e.join_date IS NULL OR e.join_date <= %s) '
+                'AND NOT EXISTS (SELECT 1 FROM "' + cls._table + '" AS x '
+                    'WHERE x.employee = e.id AND x.leave_type = t.id '
+                    'AND x.period = %s AND x.kind = %s)',
+            [Transaction().user, datetime.datetime.now(), period.id,
+                'accrual', 'probation', period.start_date, period.end_date,
+                float(period_days)] + params + ['current', True,
+                'monthly', period.end_date, period.id, 'accrual'])
+
+    @classmethod
+    def _carry_forward(cls, period, previous_year):
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        LeaveType = pool.get('employee.leave.type')
+        LeaveApplication = pool.get('employee.leave.application')
+        Attendance = pool.get('employee.attendance')
+        Period = pool.get('payroll.period')
+        cursor = Transaction().cursor
+
+        departments, params = period.departments_query()
+        balance = ('(CASE WHEN t.accrual = %s THEN 0 '
+                'WHEN e.type = %s THEN t.probation_days '
+                'ELSE t.confirmed_days END '
+            '+ COALESCE(acc.days, 0) - COALESCE(taken.days, 0))')
+        cursor.execute('INSERT INTO "' + cls._table + '" '
+                '(create_uid, create_date, employee, leave_type, period, '
+                'kind, days) '
+            'SELECT %s, %s, e.id, t.id, %s, %s, '
+                'CASE WHEN ' + balance + ' > t.carry_forward_cap '
+                'THEN t.carry_forward_cap ELSE ' + balance + ' END '
+            'FROM "' + Employee._table + '" AS e '
+            'CROSS JOIN "' + LeaveType._table + '" AS t '
+            'LEFT JOIN (SELECT x.employee, x.leave_type, '
+                    'SUM(x.days) AS days '
+                'FROM "' + cls._table + '" AS x '
+                'JOIN "' + Period._table + '" AS p ON p.id = x.period '
+                'WHERE p.payroll_year = %s '
+                'GROUP BY x.employee, x.leave_type) AS acc '
+                'ON acc.employee = e.id AND acc.leave_type = t.id '
+            'LEFT JOIN (SELECT l.employee, l.leave_type, '
+                    'COUNT(a.id) AS days '
+                'FROM "' + Attendance._table + '" AS a '
+                'JOIN "' + LeaveApplication._table + '" AS l '
+                    'ON l.id = a.leave_application '
+                'WHERE a.on_leave = %s '
+                    'AND a.date >= %s AND a.date <= %s '
+                'GROUP BY l.employee, l.leave_type) AS taken '
+                'ON taken.employee = e.id AND taken.leave_type = t.id '
+            'WHERE e.department IN (' + departments + ') '
+                'AND e.state = %s '
+                'AND t.active = %s '
+                'AND t.carry_forward_cap > 0 '
+                'AND ' + balance + ' > 0 '
+                'AND NOT EXISTS (SELECT 1 FROM "' + cls._table + '" AS x '
+                    'WHERE x.employee = e.id AND x.leave_type = t.id '
+                    'AND x.period = %s AND x.kind = %s)',
+            (Transaction().user, datetime.datetime.now(), period.id,
+                'carry_forward')
+            + ('monthly', 'probation') * 2
+            + (previous_year.id, True, previous_year.start_date,
+                previous_year.end_date) + tuple(params) + ('current', True)
+            + ('monthly', 'probation')
+            + (period.id, 'carry_forward'))
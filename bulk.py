@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+    Bulk
+
+    Helpers to insert many rows with multi-row INSERT statements, bypassing
+    the per-record create of the ORM.
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import datetime
+from itertools import islice
+
+from trytond.config import CONFIG
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction
+
+__all__ = ['bulk_insert', 'copy_history']
+
+# SQLite refuses statements with more parameters than this
+SQLITE_MAX_VARIABLES = 999
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _reserve_ids(table, count):
+    """
+    Return count new ids from the sequence of table or None if the database
+    allocates them on insert.
+    """
+    cursor = Transaction().cursor
+    if CONFIG['db_type'] != 'postgresql':
+        return None
+    cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)',
+        ('"%s_id_seq"' % table, count))
+    return [x[0] for x in cursor.fetchall()]
+
+
+def bulk_insert(table, columns, rows, size=1000, return_ids=True):
+    """
+    Insert the rows into table and return their ids in the same order.
+
+    :param table: the name of the table
+    :param columns: the list of the column names, create_uid and
+        create_date are filled automatically
+    :param rows: an iterable of tuples following columns
+    :param size: the maximum number of rows per INSERT
+    :param return_ids: set to False to not keep the ids in memory
+    """
+    transaction = Transaction()
+    cursor = transaction.cursor
+    columns = ['create_uid', 'create_date'] + list(columns)
+    if CONFIG['db_type'] == 'sqlite':
+        size = min(size, SQLITE_MAX_VARIABLES // (len(columns) + 1))
+    prefix = (transaction.user, datetime.datetime.now())
+
+    ids = []
+    for chunk in _chunks(rows, size):
+        chunk_ids = _reserve_ids(table, len(chunk))
+        if chunk_ids:
+            names = ['id'] + columns
+            values = []
+            for id_, row in zip(chunk_ids, chunk):
+                values.extend((id_,) + prefix + tuple(row))
+        else:
+            names = columns
+            values = []
+            for row in chunk:
+                values.extend(prefix + tuple(row))
+        placeholder = '(' + ','.join(('%s',) * len(names)) + ')'
+        cursor.execute('INSERT INTO "' + table + '" '
+            '(' + ','.join('"%s"' % n for n in names) + ') '
+            'VALUES ' + ','.join((placeholder,) * len(chunk)), values)
+        if not chunk_ids:
+            # SQLite allocates consecutive ids to a multi-row insert
+            last_id = cursor.lastid()
+            chunk_ids = range(last_id - len(chunk) + 1, last_id + 1)
+        if return_ids:
+            ids.extend(chunk_ids)
+    return ids
+
+
+def copy_history(Model, ids):
+    """
+    Copy the current rows of Model with the given ids into its history
+    table, as the ORM does on create and write.
+    """
+    cursor = Transaction().cursor
+    table = Model._table
+    history_table = '%s__history' % table
+
+    names = ','.join('"%s"' % name
+        for name, field in Model._fields.iteritems()
+        if not hasattr(field, 'set'))
+    for i in range(0, len(ids), cursor.IN_MAX):
+        sub_ids = ids[i:i + cursor.IN_MAX]
+        red_sql, red_ids = reduce_ids('id', sub_ids)
+        cursor.execute('INSERT INTO "' + history_table + '" '
+            '(' + names + ') '
+            'SELECT ' + names + ' FROM "' + table + '" '
+            'WHERE ' + red_sql, red_ids)
@@ -5,18 +5,28 @@
     :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+import datetime
+from bisect import bisect_right
+from decimal import Decimal
+from weakref import WeakKeyDictionary
+
 from trytond.model import ModelView, ModelSQL, Workflow, fields
+from trytond.backend import TableHandler
 from dateutil.relativedelta import relativedelta
-from datetime import datetime
 
 from trytond.pyson import Eval, Bool
 from trytond.pool import Pool, PoolMeta
 from trytond.transaction import Transaction
+from trytond.tools import reduce_ids
+from trytond.config import CONFIG
+from trytond.rpc import RPC
+
+from .profiling import profiled
 
 __all__ = [
-    'Department', 'Employee', 'Responsibility', 'Language', 'Academic',
-    'Skill', 'Team', 'TransferProposal', 'TransferRemark', 'Party',
-    'PaymentDetail', 'EmployeeHistory',
+    'Department', 'DepartmentShift', 'Employee', 'Responsibility',
+    'Language', 'Academic', 'Skill', 'Team', 'TransferProposal',
+    'TransferRemark', 'Party', 'PaymentDetail', 'EmployeeHistory',
 ]
 
 STATES = {
@@ -25,6 +35,10 @@ STATES = {
 
 __metaclass__ = PoolMeta
 
+# Point-in-time record names resolved during the transaction of a cursor as
+# {cursor: {(model name, id, datetime): name}}
+_history_names = WeakKeyDictionary()
+
 
 class Department(ModelView, ModelSQL):
     "Company Department"
@@ -52,6 +66,44 @@ class Department(ModelView, ModelSQL):
     allowed_late_comings = fields.Integer(
         'Allowed Late Comings (per month)', states=STATES
     )
+    standard_hours = fields.Numeric('Standard Hours (per day)',
+        digits=(16, 2), states=STATES,
+        help='The hours of a working day beyond which it is overtime')
+    shifts = fields.One2Many('company.department.shift', 'department',
+        'Shifts', states=STATES)
+    weekly_offs = fields.Char('Weekly Offs', states=STATES,
+        help='The ISO numbers of the weekly days off separated by commas, '
+        'from 1 for Monday to 7 for Sunday')
+
+    @classmethod
+    def __setup__(cls):
+        super(Department, cls).__setup__()
+        cls._constraints += [
+            ('check_weekly_offs', 'invalid_weekly_offs'),
+        ]
+        cls._error_messages.update({
+            'invalid_weekly_offs': 'The weekly offs must be day numbers '
+                'between 1 and 7 separated by commas',
+        })
+
+    @staticmethod
+    def default_standard_hours():
+        return Decimal('8')
+
+    @staticmethod
+    def default_weekly_offs():
+        return '6,7'
+
+    def get_weekly_offs(self):
+        "Return the set of the ISO weekdays off"
+        return set(int(day) for day in (self.weekly_offs or '').split(',')
+            if day.strip())
+
+    def check_weekly_offs(self):
+        try:
+            return all(1 <= day <= 7 for day in self.get_weekly_offs())
+        except ValueError:
+            return False
 
     @staticmethod
     def default_allowed_early_departures():
@@ -61,16 +113,168 @@ class Department(ModelView, ModelSQL):
     def default_allowed_late_comings():
         return 2
 
+    @classmethod
+    def subtree_query(cls):
+        """
+        Return the recursive WITH clause defining "subtree" as the ids of the
+        department given as parameter and of all its descendants.
+
+        A query starting with it must be nested in a sub-select: the sqlite3
+        module of Python 2 commits the transaction before any statement which
+        does not start with SELECT, INSERT, UPDATE, DELETE or REPLACE.
+        """
+        return ('WITH RECURSIVE subtree (id) AS ('
+                'SELECT id FROM "' + cls._table + '" WHERE id = %s '
+                'UNION ALL '
+                'SELECT d.id FROM "' + cls._table + '" AS d '
+                'JOIN subtree AS s ON d.parent = s.id'
+            ') ')
+
+    @classmethod
+    def ancestors_query(cls, where=None):
+        """
+        Return the recursive WITH clause defining "ancestors" as the pairs of
+        the id of every department, or of those matching the where clause,
+        as origin, with its own id and the ids of all its ancestors. Like
+        subtree_query, it must not start a query.
+        """
+        return ('WITH RECURSIVE ancestors (id, origin) AS ('
+                'SELECT id, id FROM "' + cls._table + '" '
+                    + ('WHERE ' + where + ' ' if where else '') +
+                'UNION ALL '
+                'SELECT d.parent, a.origin FROM "' + cls._table + '" AS d '
+                'JOIN ancestors AS a ON d.id = a.id '
+                'WHERE d.parent IS NOT NULL'
+            ') ')
+
+    @classmethod
+    def write(cls, departments, values):
+        pool = Pool()
+        if 'parent' not in values:
+            super(Department, cls).write(departments, values)
+            return
+
+        # The totals of the moved subtrees leave their former ancestors
+        # and join the new ones
+        cursor = Transaction().cursor
+        ids = set()
+        for department in departments:
+            cursor.execute('SELECT id FROM ('
+                + cls.subtree_query() + 'SELECT id FROM subtree) AS s',
+                (department.id,))
+            ids.update(x[0] for x in cursor.fetchall())
+        rollups = [pool.get(name) for name in ('company.department.headcount',
+                'company.department.allowance')]
+        totals = [Rollup.own_totals(list(ids)) for Rollup in rollups]
+        for Rollup, own in zip(rollups, totals):
+            Rollup.apply(own, {})
+        super(Department, cls).write(departments, values)
+        for Rollup, own in zip(rollups, totals):
+            Rollup.apply({}, own)
+
     @staticmethod
     def default_active():
         return True
 
 
+class DepartmentShift(ModelSQL, ModelView):
+    "Department Shift"
+    __name__ = 'company.department.shift'
+
+    department = fields.Many2One('company.department', 'Department',
+        required=True, select=True, ondelete='CASCADE')
+    name = fields.Char('Name', required=True)
+    start_time = fields.Time('Start Time', required=True)
+    end_time = fields.Time('End Time', required=True)
+    overnight = fields.Function(fields.Boolean('Overnight'), 'get_overnight')
+
+    @classmethod
+    def __setup__(cls):
+        super(DepartmentShift, cls).__setup__()
+        cls._order.insert(0, ('start_time', 'ASC'))
+
+    def get_overnight(self, name):
+        "A shift ending at or before its start time ends on the next day"
+        return self.end_time <= self.start_time
+
+
 class Party:
     "Party"
     __name__ = 'party.party'
     _history = True
 
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().cursor
+        super(Party, cls).__register__(module_name)
+
+        # The compaction looks for the later revisions of each party
+        table = TableHandler(cursor, cls, module_name, history=True)
+        table.index_action(['id', '__id'], 'add')
+        table.index_action('write_date', 'add')
+
+    @classmethod
+    def compact_history(cls, size=10000):
+        """
+        Compact the history of the parties as configured by ranges of size
+        revisions, committing after each range.
+
+        A revision followed by another one within the window is removed, and
+        so is a revision older than the retention which is followed by
+        another one also older than the retention. The creations and
+        deletions are kept, so the time travel reads still find the records
+        within the window and the retention.
+        """
+        Configuration = Pool().get('company.employee.configuration')
+        cursor = Transaction().cursor
+        table = '%s__history' % cls._table
+
+        config = Configuration(1)
+        window = config.party_history_window
+        retention = config.party_history_retention
+        if not window and not retention:
+            return
+
+        conditions = []
+        if window:
+            if CONFIG['db_type'] == 'sqlite':
+                limit = 'datetime(h.write_date, %s)'
+                window = '+%s minutes' % window
+            else:
+                limit = 'h.write_date + %s'
+                window = datetime.timedelta(minutes=window)
+            conditions.append(('h.write_date IS NOT NULL '
+                    'AND EXISTS (SELECT 1 FROM "' + table + '" AS n '
+                        'WHERE n.id = h.id AND n.__id > h.__id '
+                        'AND n.create_date IS NOT NULL '
+                        'AND n.write_date <= ' + limit + ')',
+                [window]))
+        if retention:
+            cutoff = datetime.datetime.now() - datetime.timedelta(
+                days=retention)
+            conditions.append(('h.write_date IS NOT NULL '
+                    'AND h.write_date < %s '
+                    'AND EXISTS (SELECT 1 FROM "' + table + '" AS n '
+                        'WHERE n.id = h.id AND n.__id > h.__id '
+                        'AND n.create_date IS NOT NULL '
+                        'AND COALESCE(n.write_date, n.create_date) < %s)',
+                [cutoff, cutoff]))
+
+        cursor.execute('SELECT MIN(__id), MAX(__id) FROM "' + table + '"')
+        min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            return
+        for start in xrange(min_id, max_id + 1, size):
+            for condition, params in conditions:
+                cursor.execute('DELETE FROM "' + table + '" '
+                    'WHERE __id IN ('
+                        'SELECT h.__id FROM "' + table + '" AS h '
+                        'WHERE h.__id >= %s AND h.__id < %s '
+                            'AND h.create_date IS NOT NULL '
+                            'AND ' + condition + ')',
+                    [start, start + size] + params)
+            cursor.commit()
+
 
 class Employee:
     "Employee"
@@ -121,13 +325,17 @@ class Employee:
             ('female', 'Female')
         ], 'Sex', required=True
     )
-    date_of_birth = fields.Date('Date of Birth', required=True)
+    date_of_birth = fields.Date('Date of Birth', required=True, select=True)
 
     # TODO: Not implemented for death
     age = fields.Function(
         fields.Char('Age', on_change_with=['date_of_birth']),
         'get_age'
     )
+    age_years = fields.Function(
+        fields.Integer('Age (Years)'),
+        'get_age_years', searcher='search_age_years'
+    )
     place_of_birth = fields.Char('Place of Birth', required=True)
     marital_status = fields.Selection([
             ('single', 'Single'),
@@ -163,12 +371,12 @@ class Employee:
     denomination = fields.Char('Denomination') #TODO: m2o to employee.denomination
     driving_license = fields.Char('Driving License')
     driving_license_validity = fields.Date(
-        'Driving License Validity',
+        'Driving License Validity', select=True,
         states={'required': Bool(Eval('driving_license'))},
     )
     passport_number = fields.Char('Passport Number')
     passport_validity = fields.Date(
-        'Passport Validity',
+        'Passport Validity', select=True,
         states={'required': Bool(Eval('passport_number'))},
     )
     academics = fields.One2Many(
@@ -200,6 +408,7 @@ class Employee:
         ('probation', 'Probation'),
         ('confirmed', 'Confirmed')
     ], 'Type', required=True)
+    join_date = fields.Date('Date of Joining')
 
     current_payrollyear = fields.Function(
         fields.Many2One('payroll.year', 'Current Payroll Year'),
@@ -208,23 +417,12 @@ class Employee:
     leave_applications = fields.One2Many(
         'employee.leave.application', 'employee', 'Leave Applications'
     )
-    available_cl = fields.Function(
-        fields.Integer('Available Casual Leaves'), 'get_available_cl'
-    )
-    available_sl = fields.Function(
-        fields.Integer('Available Sick Leaves'), 'get_available_sl'
-    )
-    available_el = fields.Function(
-        fields.Integer('Available Earned Leaves'), 'get_available_el'
-    )
-    available_dl = fields.Function(
-        fields.Integer('Available Study Leaves'), 'get_available_dl'
-    )
-    available_pl = fields.Function(
-        fields.Integer('Available Paternity Leaves'), 'get_available_pl'
+    leave_balances = fields.One2Many(
+        'employee.leave.balance', 'employee', 'Leave Balances', readonly=True
     )
-    available_al = fields.Function(
-        fields.Integer('Available Annual Leaves'), 'get_available_al'
+    directory_text = fields.Text('Directory Text', readonly=True)
+    directory = fields.Function(
+        fields.Char('Directory'), 'get_directory', searcher='search_directory'
     )
 
     @classmethod
@@ -234,6 +432,91 @@ class Employee:
             'payrollyear_not_found': \
                 'Payroll Year not found for today!',
         })
+        cls.__rpc__.update({
+            'snapshot': RPC(),
+        })
+
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().cursor
+        super(Employee, cls).__register__(module_name)
+        table = TableHandler(cursor, cls, module_name)
+
+        # Incremental consumers look for the records changed since a date
+        table.index_action('create_date', 'add')
+        table.index_action('write_date', 'add')
+
+        # Snapshots look for the last revision of each employee before a date
+        history_table = TableHandler(cursor, cls, module_name, history=True)
+        history_table.index_action(['id', 'write_date'], 'add')
+
+        if CONFIG['db_type'] == 'postgresql':
+            cls._register_directory_trigram_index()
+        elif CONFIG['db_type'] == 'sqlite':
+            cls._register_directory_fts()
+
+    @classmethod
+    def _register_directory_trigram_index(cls):
+        "Index the directory text with trigrams to serve ILIKE '%x%'"
+        cursor = Transaction().cursor
+        index_name = '%s_directory_trgm' % cls._table
+
+        cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s',
+            (index_name,))
+        if cursor.fetchone():
+            return
+        cursor.execute('SAVEPOINT hr_directory_trgm')
+        try:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute('CREATE INDEX "' + index_name + '" '
+                'ON "' + cls._table + '" '
+                'USING gin (directory_text gin_trgm_ops)')
+        except Exception:
+            # pg_trgm is not available or may not be installed by this user,
+            # the search still works with a sequential scan.
+            cursor.execute('ROLLBACK TO SAVEPOINT hr_directory_trgm')
+        else:
+            cursor.execute('RELEASE SAVEPOINT hr_directory_trgm')
+
+    @classmethod
+    def _register_directory_fts(cls):
+        """
+        Create the FTS5 table mirroring the directory text on SQLite
+
+        The trigram tokenizer serves LIKE '%x%' like the trigram index of
+        PostgreSQL, the tables made with the default tokenizer are rebuilt.
+        """
+        cursor = Transaction().cursor
+        table = '%s_fts' % cls._table
+        cursor.execute('SELECT sql FROM sqlite_master '
+            'WHERE type = %s AND name = %s', ('table', table))
+        row = cursor.fetchone()
+        if row and 'trigram' in row[0]:
+            return
+        try:
+            if row:
+                cursor.execute('DROP TABLE "' + table + '"')
+            cursor.execute('CREATE VIRTUAL TABLE "' + table + '" '
+                'USING fts5(directory_text, tokenize=\'trigram\')')
+        except Exception:
+            # SQLite built without FTS5 or older than 3.34, search falls
+            # back on LIKE
+            return
+        cursor.execute('INSERT INTO "' + table + '" (rowid, directory_text) '
+            'SELECT id, directory_text FROM "' + cls._table + '" '
+            'WHERE directory_text IS NOT NULL')
+
+    @classmethod
+    def _directory_fts(cls):
+        "Return the name of the FTS5 table if it exists"
+        cursor = Transaction().cursor
+        if CONFIG['db_type'] != 'sqlite':
+            return
+        table = '%s_fts' % cls._table
+        cursor.execute('SELECT 1 FROM sqlite_master '
+            'WHERE type = %s AND name = %s', ('table', table))
+        if cursor.fetchone():
+            return table
 
     @staticmethod
     def default_type():
@@ -260,165 +543,370 @@ class Employee:
         Sequence = Pool().get('ir.sequence')
         Configuration = Pool().get('company.employee.configuration')
 
-        values = values.copy()
-        config = Configuration(1)
-        values['employee_id'] = Sequence.get_id(config.employee_sequence.id)
-        return super(Employee, cls).create(values)
+        Headcount = Pool().get('company.department.headcount')
 
-    def get_current_payrollyear(self, name):
-        PayrollYear = Pool().get('payroll.year')
-        Date = Pool().get('ir.date')
+        values = values.copy()
+        values['employee_id'] = Sequence.get_id(
+            Configuration.get_employee_sequence())
+        employee = super(Employee, cls).create(values)
+        cls.update_directory([employee])
+        Headcount.apply({}, Headcount.collect([employee.id]))
+        return employee
 
-        date = Date.today()
-        years = PayrollYear.search([
-            ('state', '=', 'open'),
-            ('start_date', '<=', date),
-            ('end_date', '>=', date),
-        ])
-        if not years or len(years) > 1:
-            self.raise_user_error('payrollyear_not_found')
+    @classmethod
+    def write(cls, employees, values):
+        Headcount = Pool().get('company.department.headcount')
+        ids = [e.id for e in employees]
+        counted = set(values) & set(['department'] + Headcount._keys)
+        if counted:
+            before = Headcount.collect(ids)
+        super(Employee, cls).write(employees, values)
+        if counted:
+            Headcount.apply(before, Headcount.collect(ids))
+        if set(values) & set(cls._directory_fields):
+            cls.update_directory(employees)
 
-        return years[0].id
+    @classmethod
+    def delete(cls, employees):
+        pool = Pool()
+        Tombstone = pool.get('hr.change.tombstone')
+        Headcount = pool.get('company.department.headcount')
+        cursor = Transaction().cursor
+        fts_table = cls._directory_fts()
+        ids = [e.id for e in employees]
+        before = Headcount.collect(ids)
+        super(Employee, cls).delete(employees)
+        Headcount.apply(before, {})
+        Tombstone.record_deletions(cls.__name__, ids)
+        if fts_table:
+            for i in range(0, len(ids), cursor.IN_MAX):
+                sub_ids = ids[i:i + cursor.IN_MAX]
+                red_sql, red_ids = reduce_ids('rowid', sub_ids)
+                cursor.execute('DELETE FROM "' + fts_table + '" '
+                    'WHERE ' + red_sql, red_ids)
+
+    _snapshot_fields = [
+        'party', 'company', 'department', 'manager', 'state', 'type',
+        'employee_id', 'first_name', 'middle_name', 'last_name',
+    ]
 
-    def get_addresses(self, name):
-        """
-        Return all the addresses of the party as the address of the employee
+    @classmethod
+    @profiled
+    def snapshot(cls, date, domain=None):
         """
-        return map(int, self.party.addresses)
-
-    def calculate_leaves(self, type):
-        """Calculate leaves as per given type
+        Return the employees as they were at the given datetime as a list of
+        dictionaries with the id and the _snapshot_fields.
 
-        :param type: Type for which leaves have to be calculated
+        The last revision of every employee before the date is selected from
+        the history table with a single window query. The domain restricts
+        the result to the employees whose selected revision matches it, so
+        the employees deleted since the date are found too.
         """
-        leaves = 0
-        for attendance in self.attendance:
-            if attendance.date >= self.current_payrollyear.start_date \
-                    and attendance.date <= self.current_payrollyear.end_date:
-                if attendance.on_leave and \
-                        attendance.leave_application.leave_type == type:
-                    leaves += 1
-
-        return leaves
-
-    def get_available_cl(self, name):
-        "Calculate remaining casual leaves in current payroll year"
-        LeaveConfig = Pool().get('employee.leave.configuration')
+        cursor = Transaction().cursor
+        table = '%s__history' % cls._table
+
+        if isinstance(date, datetime.date) \
+                and not isinstance(date, datetime.datetime):
+            date = datetime.datetime.combine(date, datetime.time.max)
+        names = ['id'] + cls._snapshot_fields
+        columns = ', '.join('"%s"' % n for n in names)
+        params = [date, date]
+        where = ''
+        if domain is not None:
+            # The domain is converted on the history table aliased as the
+            # table of the model and matched against the selected revision
+            with Transaction().set_context(_datetime=date):
+                qu1, qu2, tables, tables_args = cls.search_domain(domain,
+                    active_test=False)
+            where = ('AND __id IN (SELECT "' + cls._table + '".__id '
+                'FROM ' + ' '.join(tables)
+                + (' WHERE ' + qu1 if qu1 else '') + ') ')
+            params += tables_args + qu2
+        cursor.execute('SELECT ' + columns + ' FROM ('
+                'SELECT ' + columns + ', __id, create_date, '
+                    'ROW_NUMBER() OVER (PARTITION BY id '
+                        'ORDER BY COALESCE(write_date, create_date) DESC, '
+                        '__id DESC) AS revision '
+                'FROM "' + table + '" '
+                'WHERE (write_date <= %s '
+                    'OR (write_date IS NULL AND create_date <= %s))'
+                ') AS h '
+            # Deletions are recorded as revisions without create_date
+            'WHERE revision = 1 AND create_date IS NOT NULL '
+                + where +
+            'ORDER BY id', params)
+        rows = cursor.fetchall()
+        return [dict(zip(names, row)) for row in rows]
+
+    _directory_fields = [
+        'first_name', 'middle_name', 'last_name', 'employee_id',
+    ]
 
-        config = LeaveConfig(1)
-        cl_taken = self.calculate_leaves('casual')
-        if self.type == 'probation':
-            allowed_cl = config.probation_cl or 0
-        else:
-            allowed_cl = config.confirmed_cl or 0
-
-        return allowed_cl - cl_taken
-
-    def get_available_sl(self, name):
-        "Calculate remaining sick leaves in current payroll year"
-        LeaveConfig = Pool().get('employee.leave.configuration')
-
-        config = LeaveConfig(1)
-        sl_taken = self.calculate_leaves('sick')
-        if self.type == 'probation':
-            allowed_sl = config.probation_sl or 0
-        else:
-            allowed_sl = config.confirmed_sl or 0
-
-        return allowed_sl - sl_taken
+    @classmethod
+    @profiled
+    def update_directory(cls, employees):
+        """
+        Rebuild the directory text of the employees from their names, skills,
+        languages and academics, with one query per child model.
 
-    def get_available_el(self, name):
-        "Calculate remaining earned leaves in current payroll year"
-        LeaveConfig = Pool().get('employee.leave.configuration')
+        The text is stored with plain SQL so that it neither touches
+        write_date nor creates history revisions.
+        """
+        pool = Pool()
+        Skill = pool.get('company.employee.skill')
+        Language = pool.get('company.employee.language')
+        Academic = pool.get('company.employee.academic')
+        cursor = Transaction().cursor
+
+        ids = [e.id for e in employees]
+        if not ids:
+            return
+        employees = cls.browse(ids)
+        words = dict((e.id, [
+                    getattr(e, f) or '' for f in cls._directory_fields])
+            for e in employees)
+        for skill in Skill.search([('employee', 'in', ids)]):
+            words[skill.employee.id].append(skill.name)
+        for language in Language.search([('employee', 'in', ids)]):
+            words[language.employee.id].append(language.language.name)
+        for academic in Academic.search([('employee', 'in', ids)]):
+            words[academic.employee.id].extend(
+                [academic.institution, academic.major])
+
+        documents = [(' '.join(w for w in words[i] if w), i) for i in ids]
+        for i in range(0, len(documents), cursor.IN_MAX):
+            sub_documents = documents[i:i + cursor.IN_MAX]
+            red_sql, red_ids = reduce_ids('id',
+                [id_ for _, id_ in sub_documents])
+            cursor.execute('UPDATE "' + cls._table + '" '
+                'SET directory_text = CASE id '
+                    + ' '.join(['WHEN %s THEN %s'] * len(sub_documents))
+                    + ' END '
+                'WHERE ' + red_sql,
+                [x for text, id_ in sub_documents for x in (id_, text)]
+                + red_ids)
+        fts_table = cls._directory_fts()
+        if fts_table:
+            for i in range(0, len(ids), cursor.IN_MAX):
+                red_sql, red_ids = reduce_ids('rowid',
+                    ids[i:i + cursor.IN_MAX])
+                cursor.execute('DELETE FROM "' + fts_table + '" '
+                    'WHERE ' + red_sql, red_ids)
+            for i in range(0, len(documents), cursor.IN_MAX):
+                sub_documents = documents[i:i + cursor.IN_MAX]
+                cursor.execute('INSERT INTO "' + fts_table + '" '
+                    '(rowid, directory_text) VALUES '
+                    + ', '.join(['(%s, %s)'] * len(sub_documents)),
+                    [x for text, id_ in sub_documents for x in (id_, text)])
 
-        config = LeaveConfig(1)
-        el_taken = self.calculate_leaves('earned')
-        if self.type == 'probation':
-            allowed_el = config.probation_el or 0
-        else:
-            allowed_el = config.confirmed_el or 0
+    @classmethod
+    def rebuild_directory(cls, size=1000):
+        "Rebuild the directory text of all the employees by chunks"
+        cursor = Transaction().cursor
 
-        return allowed_el - el_taken
+        cursor.execute('SELECT id FROM "' + cls._table + '" ORDER BY id')
+        ids = [x[0] for x in cursor.fetchall()]
+        for i in range(0, len(ids), size):
+            cls.update_directory(cls.browse(ids[i:i + size]))
 
-    def get_available_dl(self, name):
-        "Calculate remaining study leaves in current payroll year"
-        LeaveConfig = Pool().get('employee.leave.configuration')
+    def get_directory(self, name):
+        return self.directory_text
 
-        config = LeaveConfig(1)
-        dl_taken = self.calculate_leaves('study')
-        if self.type == 'probation':
-            allowed_dl = config.probation_dl or 0
-        else:
-            allowed_dl = config.confirmed_dl or 0
+    @classmethod
+    @profiled
+    def search_directory(cls, name, clause):
+        """
+        Search the directory text, through the FTS5 table on SQLite and the
+        trigram index on PostgreSQL.
 
-        return allowed_dl - dl_taken
+        Both match the pattern as a substring anywhere in the text. The
+        SQLite LIKE ignores the case like ILIKE, also for the like operator.
+        """
+        _, operator, value = clause
 
-    def get_available_pl(self, name):
-        "Calculate remaining paternity leaves in current payroll year"
-        LeaveConfig = Pool().get('employee.leave.configuration')
+        fts_table = cls._directory_fts()
+        if fts_table and operator in ('like', 'ilike') and value:
+            return [('id', 'inselect', ('SELECT rowid '
+                        'FROM "' + fts_table + '" '
+                        'WHERE directory_text LIKE %s', [value]))]
+        return [('directory_text', operator, value)]
 
-        config = LeaveConfig(1)
-        pl_taken = self.calculate_leaves('paternity')
-        if self.type == 'probation':
-            allowed_pl = config.probation_pl or 0
-        else:
-            allowed_pl = config.confirmed_pl or 0
+    @profiled
+    def get_current_payrollyear(self, name):
+        PayrollYear = Pool().get('payroll.year')
+        Date = Pool().get('ir.date')
 
-        return allowed_pl - pl_taken
+        year = PayrollYear.find(self.department.id, Date.today(),
+            state='open')
+        if year is None:
+            self.raise_user_error('payrollyear_not_found')
+        return year
 
-    def get_available_al(self, name):
-        "Calculate remaining annual leaves in current payroll year"
-        LeaveConfig = Pool().get('employee.leave.configuration')
+    @classmethod
+    def _get_party_records(cls, employees, model_name):
+        """
+        Return a dictionary mapping each employee id to the ids of the
+        records of `model_name` which belong to the party of the employee.
 
-        config = LeaveConfig(1)
-        al_taken = self.calculate_leaves('annual')
-        if self.type == 'probation':
-            allowed_al = config.probation_al or 0
-        else:
-            allowed_al = config.confirmed_al or 0
+        All the records of the batch are fetched with a single search.
+        """
+        Model = Pool().get(model_name)
+
+        party2employees = {}
+        for employee in employees:
+            party2employees.setdefault(employee.party.id, []).append(
+                employee.id
+            )
+        result = dict((e.id, []) for e in employees)
+        if not party2employees:
+            return result
+        for record in Model.search([
+                    ('party', 'in', party2employees.keys()),
+                ]):
+            for employee_id in party2employees[record.party.id]:
+                result[employee_id].append(record.id)
+        return result
 
-        return allowed_al - al_taken
+    @classmethod
+    @profiled
+    def get_addresses(cls, employees, name):
+        """
+        Return all the addresses of the party as the address of the employee
+        """
+        return cls._get_party_records(employees, 'party.address')
 
     @classmethod
     def set_addresses(cls, records, name, value=None):
         """
         Set the address as the address of the party
         """
-        Party = Pool().get('party.party')
+        parties = list(set(record.party for record in records))
+        if parties:
+            cls._write_parties(parties, 'addresses', value)
 
-        for record in records:
-            Party.write([record.party], {'addresses': value})
+    @classmethod
+    def _write_parties(cls, parties, name, value):
+        """
+        Write the One2Many name of the parties, without writing a party
+        revision unless the configuration records the HR changes
+        """
+        pool = Pool()
+        Party = pool.get('party.party')
+        Configuration = pool.get('company.employee.configuration')
 
-    def get_contact_mechanisms(self, name):
+        if Configuration(1).party_history_hr:
+            Party.write(parties, {name: value})
+        else:
+            Party._fields[name].set([p.id for p in parties], Party, name,
+                value)
+
+    @classmethod
+    @profiled
+    def get_contact_mechanisms(cls, employees, name):
         """
         Return all the contact_mechanisms of the party as the
         contact_mechanism of the employee
         """
-        return map(int, self.party.contact_mechanisms)
+        return cls._get_party_records(employees, 'party.contact_mechanism')
 
     @classmethod
     def set_contact_mechanisms(cls, records, name, value=None):
         """
         Set the contact_mechanism as the contact_mechanism of the party
         """
-        Party = Pool().get('party.party')
+        parties = list(set(record.party for record in records))
+        if parties:
+            cls._write_parties(parties, 'contact_mechanisms', value)
 
-        for record in records:
-            Party.write([record.party], {'contact_mechanisms': value})
+    @staticmethod
+    def _format_age(date_of_birth, today):
+        delta = relativedelta(today, date_of_birth)
+        return str(delta.years) + 'y ' + str(delta.months) + \
+                'm ' + str(delta.days) + 'd'
 
-    def get_age(self, name=None):
+    @classmethod
+    @profiled
+    def get_age(cls, employees, name=None):
         """
         Retrun age of employee
         """
-        now = datetime.now()
-        delta = relativedelta(now, self.date_of_birth)
-        years_months_days = str(delta.years) + 'y ' + str(delta.months) + \
-                'm ' + str(delta.days) + 'd'
-        return years_months_days
+        Date = Pool().get('ir.date')
+
+        today = Date.today()
+        return dict(
+            (e.id, cls._format_age(e.date_of_birth, today)
+                if e.date_of_birth else None)
+            for e in employees
+        )
+
+    @classmethod
+    @profiled
+    def get_age_years(cls, employees, name):
+        """
+        Return the age of the employees in completed years
+        """
+        Date = Pool().get('ir.date')
+
+        today = Date.today()
+        return dict(
+            (e.id, relativedelta(today, e.date_of_birth).years
+                if e.date_of_birth else None)
+            for e in employees
+        )
+
+    @classmethod
+    def search_age_years(cls, name, clause):
+        """
+        Translate a clause on the age into a clause on the date of birth so
+        that it can be answered by the database.
+        """
+        Date = Pool().get('ir.date')
+
+        today = Date.today()
+        _, operator, value = clause
+
+        def born_before(years):
+            "Last date of birth for an age of at least `years`"
+            return today - relativedelta(years=years)
+
+        def age_equal(years):
+            return ['AND',
+                ('date_of_birth', '<=', born_before(years)),
+                ('date_of_birth', '>', born_before(years + 1)),
+            ]
+
+        def age_not_equal(years):
+            return ['OR',
+                ('date_of_birth', '>', born_before(years)),
+                ('date_of_birth', '<=', born_before(years + 1)),
+            ]
+
+        if value is None:
+            return [('date_of_birth', operator, None)]
+        if operator == 'in':
+            return [['OR'] + [age_equal(int(v)) for v in value]]
+        elif operator == 'not in':
+            return [['AND'] + [age_not_equal(int(v)) for v in value]]
+        value = int(value)
+        if operator == '=':
+            return [age_equal(value)]
+        elif operator == '!=':
+            return [age_not_equal(value)]
+        elif operator == '>=':
+            return [('date_of_birth', '<=', born_before(value))]
+        elif operator == '>':
+            return [('date_of_birth', '<=', born_before(value + 1))]
+        elif operator == '<=':
+            return [('date_of_birth', '>', born_before(value + 1))]
+        elif operator == '<':
+            return [('date_of_birth', '>', born_before(value))]
+        return [('id', '=', -1)]
 
     def on_change_with_age(self):
+        Date = Pool().get('ir.date')
+
         if self.date_of_birth:
-            return self.get_age()
+            return self._format_age(self.date_of_birth, Date.today())
 
 
 class EmployeeHistory(ModelSQL, ModelView):
@@ -484,12 +972,109 @@ class EmployeeHistory(ModelSQL, ModelView):
     driving_license_validity = fields.Date('Driving License Validity')
     passport_number = fields.Char('Passport Number')
     passport_validity = fields.Date('Passport Validity')
+    party_name = fields.Function(fields.Char('Party'), 'get_history_name')
+    company_name = fields.Function(fields.Char('Company'), 'get_history_name')
+    department_name = fields.Function(
+        fields.Char('Department'), 'get_history_name'
+    )
+    manager_name = fields.Function(fields.Char('Manager'), 'get_history_name')
 
     @classmethod
     def __setup__(cls):
         super(EmployeeHistory, cls).__setup__()
         cls._order.insert(0, ('date', 'DESC'))
 
+    @classmethod
+    @profiled
+    def get_history_name(cls, histories, name):
+        """
+        Return the name at the date of the history of the record referenced
+        by the field of which name is suffixed by _name.
+
+        All the references of the histories are resolved in one pass with a
+        query per referenced model instead of a time-travel read per row and
+        field, and the names are kept for the rest of the transaction.
+        """
+        field_name = name[:-len('_name')]
+        Target = Pool().get(cls._fields[field_name].model_name)
+
+        # Read the raw ids to not instantiate the references at each date
+        pairs = dict((r['id'], (r[field_name], r['date']))
+            for r in cls.read([h.id for h in histories], [field_name, 'date'])
+            if r[field_name])
+        names = cls._resolve_names(Target, set(pairs.itervalues()))
+        return dict((h.id, names.get(pairs.get(h.id))) for h in histories)
+
+    @classmethod
+    def _resolve_names(cls, Model, pairs):
+        """
+        Return the name of the records of Model at a datetime as
+        {(id, datetime): name} for the given (id, datetime) pairs.
+
+        Models without history have the same name at every date and are read
+        once. For the others the history rows of all the ids are fetched at
+        once and the row valid at each date is found by bisection. A record
+        name which is a reference to another model with history, like the
+        party of an employee, is resolved in turn at the same date.
+        """
+        cursor = Transaction().cursor
+        cache = _history_names.setdefault(cursor, {})
+        missing = [p for p in pairs if (Model.__name__,) + p not in cache]
+        if missing:
+            ids = list(set(id_ for id_, _ in missing))
+            rec_field = Model._fields.get(Model._rec_name)
+            if not getattr(Model, '_history', False) or rec_field is None \
+                    or hasattr(rec_field, 'set'):
+                current = dict((r['id'], r['rec_name'])
+                    for r in Model.read(ids, ['rec_name']))
+                for id_, date in missing:
+                    cache[(Model.__name__, id_, date)] = current.get(id_)
+            else:
+                values = cls._history_values(Model, Model._rec_name, missing)
+                if rec_field._type == 'many2one':
+                    Target = Pool().get(rec_field.model_name)
+                    targets = dict((p, (v, p[1]))
+                        for p, v in values.iteritems() if v is not None)
+                    names = cls._resolve_names(Target,
+                        set(targets.itervalues()))
+                    values = dict((p, names.get(targets.get(p)))
+                        for p in values)
+                for (id_, date), value in values.iteritems():
+                    cache[(Model.__name__, id_, date)] = value
+        return dict((p, cache[(Model.__name__,) + p]) for p in pairs)
+
+    @staticmethod
+    def _history_values(Model, column, pairs):
+        """
+        Return the value of column of the records of Model at a datetime as
+        {(id, datetime): value} using a single scan of its history table.
+        """
+        cursor = Transaction().cursor
+        table = '%s__history' % Model._table
+
+        ids = list(set(id_ for id_, _ in pairs))
+        rows = {}
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            red_sql, red_ids = reduce_ids('id', sub_ids)
+            cursor.execute('SELECT id, '
+                    'COALESCE(write_date, create_date) AS stamp, '
+                    '"' + column + '" '
+                'FROM "' + table + '" '
+                'WHERE ' + red_sql + ' '
+                'ORDER BY id, stamp, __id', red_ids)
+            for id_, stamp, value in cursor.fetchall():
+                stamps, values = rows.setdefault(id_, ([], []))
+                stamps.append(stamp)
+                values.append(value)
+
+        result = {}
+        for id_, date in pairs:
+            stamps, values = rows.get(id_, ([], []))
+            index = bisect_right(stamps, date)
+            result[(id_, date)] = values[index - 1] if index else None
+        return result
+
     @classmethod
     def _table_query_fields(cls):
         Employee = Pool().get('company.employee')
@@ -559,6 +1144,32 @@ class TransferProposal(Workflow, ModelSQL, ModelView):
     def default_state():
         return 'Draft'
 
+    @classmethod
+    def create(cls, values):
+        Allowance = Pool().get('company.department.allowance')
+        proposal = super(TransferProposal, cls).create(values)
+        Allowance.apply({}, Allowance.collect([proposal.id]))
+        return proposal
+
+    @classmethod
+    def write(cls, proposals, values):
+        Allowance = Pool().get('company.department.allowance')
+        ids = [p.id for p in proposals]
+        counted = set(values) & set(['proposed_department',
+                'proposed_allowance'] + Allowance._keys)
+        if counted:
+            before = Allowance.collect(ids)
+        super(TransferProposal, cls).write(proposals, values)
+        if counted:
+            Allowance.apply(before, Allowance.collect(ids))
+
+    @classmethod
+    def delete(cls, proposals):
+        Allowance = Pool().get('company.department.allowance')
+        before = Allowance.collect([p.id for p in proposals])
+        super(TransferProposal, cls).delete(proposals)
+        Allowance.apply(before, {})
+
     @classmethod
     def __setup__(cls):
         super(TransferProposal, cls).__setup__()
@@ -582,12 +1193,14 @@ class TransferProposal(Workflow, ModelSQL, ModelView):
     @classmethod
     @ModelView.button
     @Workflow.transition('In Review')
+    @profiled
     def review(cls, proposals):
         pass
 
     @classmethod
     @ModelView.button
     @Workflow.transition('Approved')
+    @profiled
     def approve(cls, proposals):
         Employee = Pool().get('company.employee')
 
@@ -600,6 +1213,7 @@ class TransferProposal(Workflow, ModelSQL, ModelView):
     @classmethod
     @ModelView.button
     @Workflow.transition('Rejected')
+    @profiled
     def reject(cls, proposals):
         pass
 
@@ -634,6 +1248,35 @@ class TransferRemark(ModelSQL, ModelView):
         return Date.today()
 
 
+class DirectoryMixin(object):
+    """
+    Keep the directory text of the employee up to date when a child record
+    feeding it is created, written or deleted.
+    """
+
+    @classmethod
+    def create(cls, values):
+        record = super(DirectoryMixin, cls).create(values)
+        Pool().get('company.employee').update_directory([record.employee])
+        return record
+
+    @classmethod
+    def write(cls, records, values):
+        Employee = Pool().get('company.employee')
+        employees = set(r.employee for r in records)
+        super(DirectoryMixin, cls).write(records, values)
+        if 'employee' in values:
+            employees.add(Employee(values['employee']))
+        Employee.update_directory(list(employees))
+
+    @classmethod
+    def delete(cls, records):
+        Employee = Pool().get('company.employee')
+        employees = list(set(r.employee for r in records))
+        super(DirectoryMixin, cls).delete(records)
+        Employee.update_directory(employees)
+
+
 class Responsibility(ModelSQL, ModelView):
     "Responsibility"
     __name__ = "company.employee.responsibility"
@@ -656,7 +1299,7 @@ class Team(ModelSQL, ModelView):
     description = fields.Text('Description')
 
 
-class Language(ModelSQL, ModelView):
+class Language(DirectoryMixin, ModelSQL, ModelView):
     "Language"
     __name__ = "company.employee.language"
 
@@ -681,7 +1324,7 @@ class Language(ModelSQL, ModelView):
         # TODO: The should only be one mother tounge
 
 
-class Skill(ModelSQL, ModelView):
+class Skill(DirectoryMixin, ModelSQL, ModelView):
     "Skill"
     __name__ = "company.employee.skill"
 
@@ -691,7 +1334,7 @@ class Skill(ModelSQL, ModelView):
     name = fields.Char('Name', required=True)
 
 
-class Academic(ModelSQL, ModelView):
+class Academic(DirectoryMixin, ModelSQL, ModelView):
     "Academic"
     __name__ = "company.employee.academic"
 
@@ -710,13 +1353,15 @@ class PaymentDetail(ModelSQL, ModelView):
     "Payment Detail"
     __name__ = 'company.employee.payment_detail'
 
-    employee = fields.Many2One('company.employee', 'Employee', required=True)
+    employee = fields.Many2One(
+        'company.employee', 'Employee', required=True, select=True
+    )
     active = fields.Boolean('Active')
     payment_mode = fields.Selection([
             ('cash', 'Cash'),
             ('cheque', 'Cheque'),
             ('bank', 'Bank'),
-        ], 'Payment Mode',
+        ], 'Payment Mode', select=True,
     )
     payment_date = fields.Date('Payment Date')
     bank_code = fields.Char('Bank Code')
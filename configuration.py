@@ -6,8 +6,10 @@
     :license: BSD, see LICENSE for more details.
 """
 from trytond.model import ModelView, ModelSQL, ModelSingleton, fields
+from trytond.cache import Cache
+from trytond.transaction import Transaction
 
-__all__ = ['Configuration', 'LeaveConfiguration']
+__all__ = ['Configuration']
 
 
 class Configuration(ModelSingleton, ModelSQL, ModelView):
@@ -16,72 +18,70 @@ class Configuration(ModelSingleton, ModelSQL, ModelView):
 
     employee_sequence = fields.Property(fields.Many2One(
             'ir.sequence', 'Employee Sequence',
-            domain=[('employee_id', '=', 'company.employee')]
+            domain=[('code', '=', 'company.employee')]
     ))
-
-
-class LeaveConfiguration(ModelSingleton, ModelSQL, ModelView):
-    "Leave Configuration"
-    __name__ = 'employee.leave.configuration'
-
-    probation_cl = fields.Integer('Probation Casual Leaves')
-    probation_sl = fields.Integer('Probation Sick Leaves')
-    probation_el = fields.Integer('Probation Earned Leaves')
-    confirmed_cl = fields.Integer('Confirmed Casual Leaves')
-    confirmed_sl = fields.Integer('Confirmed Sick Leaves')
-    confirmed_el = fields.Integer('Confirmed Earned Leaves')
-
-    probation_dl = fields.Integer('Probation Study Leaves')
-    probation_pl = fields.Integer('Probation Paternity Leaves')
-    probation_al = fields.Integer('Probation Annual Leaves')
-    confirmed_dl = fields.Integer('Confirmed Study Leaves')
-    confirmed_pl = fields.Integer('Confirmed Paternity Leaves')
-    confirmed_al = fields.Integer('Confirmed Annual Leaves')
-
-    @staticmethod
-    def default_probation_cl():
-        return 5
-
-    @staticmethod
-    def default_probation_sl():
-        return 5
-
-    @staticmethod
-    def default_probation_el():
-        return 0
-
-    @staticmethod
-    def default_confirmed_cl():
-        return 10
-
-    @staticmethod
-    def default_confirmed_sl():
-        return 10
-
-    @staticmethod
-    def default_confirmed_el():
-        return 15
-
-    @staticmethod
-    def default_probation_dl():
-        return 0
+    expiry_window = fields.Integer('Document Expiry Window (days)')
+    expiry_scan_date = fields.DateTime('Last Expiry Scan', readonly=True)
+    expiry_scan_horizon = fields.Date('Last Expiry Horizon', readonly=True)
+    party_history_hr = fields.Boolean('Record Party History of HR Changes',
+        help='Write a party revision when the addresses or contact '
+        'mechanisms are changed from the employee')
+    party_history_window = fields.Integer('Party History Window (minutes)',
+        help='Keep only the last of the party revisions made within this '
+        'window, 0 to keep them all')
+    party_history_retention = fields.Integer(
+        'Party History Retention (days)',
+        help='Keep only the last party revision older than this retention, '
+        '0 to keep them all')
+
+    _sequence_cache = Cache('company.employee.configuration',
+        context=False)
 
     @staticmethod
-    def default_probation_pl():
-        return 0
+    def default_expiry_window():
+        return 30
 
     @staticmethod
-    def default_probation_al():
-        return 0
+    def default_party_history_hr():
+        return True
 
     @staticmethod
-    def default_confirmed_dl():
+    def default_party_history_window():
         return 0
 
     @staticmethod
-    def default_confirmed_pl():
+    def default_party_history_retention():
         return 0
 
-    @staticmethod
-    def default_confirmed_al():
-        return 0
+    @classmethod
+    def get_employee_sequence(cls):
+        """
+        Return the id of the employee sequence of the company of the context
+
+        The value is cached per database and company.
+        """
+        transaction = Transaction()
+        key = (transaction.cursor.database_name,
+            transaction.context.get('company'))
+        sequence_id = cls._sequence_cache.get(key)
+        if sequence_id is None:
+            config = cls(1)
+            sequence_id = config.employee_sequence.id \
+                if config.employee_sequence else False
+            cls._sequence_cache.set(key, sequence_id)
+        return sequence_id
+
+    @classmethod
+    def create(cls, values):
+        cls._sequence_cache.clear()
+        return super(Configuration, cls).create(values)
+
+    @classmethod
+    def write(cls, configurations, values):
+        cls._sequence_cache.clear()
+        super(Configuration, cls).write(configurations, values)
+
+    @classmethod
+    def delete(cls, configurations):
+        cls._sequence_cache.clear()
+        super(Configuration, cls).delete(configurations)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    Document
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import datetime
+
+from trytond.model import ModelView, ModelSQL, fields
+from trytond.pyson import Eval
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+
+from .bulk import bulk_insert
+from .profiling import profiled
+
+__all__ = ['DocumentExpiry']
+
+DOCUMENTS = [
+    # (document, number column, validity column)
+    ('passport', 'passport_number', 'passport_validity'),
+    ('driving_license', 'driving_license', 'driving_license_validity'),
+]
+
+
+class DocumentExpiry(ModelSQL, ModelView):
+    "Employee Document Expiry"
+    __name__ = 'employee.document.expiry'
+    _rec_name = 'employee'
+
+    employee = fields.Many2One(
+        'company.employee', 'Employee', required=True, readonly=True,
+        select=True, ondelete='CASCADE'
+    )
+    document = fields.Selection([
+        ('passport', 'Passport'),
+        ('driving_license', 'Driving License'),
+    ], 'Document', required=True, readonly=True)
+    number = fields.Char('Number', readonly=True)
+    expiry_date = fields.Date(
+        'Expiry Date', required=True, readonly=True, select=True
+    )
+    state = fields.Selection([
+        ('open', 'Open'),
+        ('done', 'Done'),
+    ], 'State', required=True, readonly=True, select=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(DocumentExpiry, cls).__setup__()
+        cls._order.insert(0, ('expiry_date', 'ASC'))
+        cls._sql_constraints = [
+            ('employee_document_uniq', 'UNIQUE(employee, document)',
+                'Employee can have only one expiry per document'),
+        ]
+        cls._buttons.update({
+            'done': {
+                'invisible': Eval('state') != 'open',
+            },
+        })
+
+    @staticmethod
+    def default_state():
+        return 'open'
+
+    @classmethod
+    @ModelView.button
+    def done(cls, expiries):
+        cls.write(expiries, {'state': 'done'})
+
+    @classmethod
+    @profiled
+    def scan(cls):
+        """
+        Queue the documents expiring within the configured window.
+
+        Only the employees which were modified since the last scan and the
+        documents which entered the window since the last scan are looked
+        at, both through indexed predicates.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        Configuration = pool.get('company.employee.configuration')
+        Date = pool.get('ir.date')
+        cursor = Transaction().cursor
+
+        config = Configuration(1)
+        now = datetime.datetime.now()
+        today = Date.today()
+        horizon = today + datetime.timedelta(days=config.expiry_window or 0)
+        last_scan = config.expiry_scan_date
+        last_horizon = config.expiry_scan_horizon
+
+        columns = ', '.join(['id'] + sum(
+                [[number, validity] for _, number, validity in DOCUMENTS],
+                []))
+        rows = {}
+        for _, _, validity in DOCUMENTS:
+            if last_horizon:
+                cursor.execute('SELECT ' + columns + ' '
+                    'FROM "' + Employee._table + '" '
+                    'WHERE "' + validity + '" > %s '
+                        'AND "' + validity + '" <= %s',
+                    (last_horizon, horizon))
+            else:
+                cursor.execute('SELECT ' + columns + ' '
+                    'FROM "' + Employee._table + '" '
+                    'WHERE "' + validity + '" <= %s', (horizon,))
+            rows.update((row[0], row) for row in cursor.fetchall())
+        if last_scan:
+            cursor.execute('SELECT ' + columns + ' '
+                'FROM "' + Employee._table + '" '
+                'WHERE write_date >= %s OR create_date >= %s',
+                (last_scan, last_scan))
+            rows.update((row[0], row) for row in cursor.fetchall())
+
+        cls._update_queue(rows.values(), horizon)
+        Configuration.write([config], {
+            'expiry_scan_date': now,
+            'expiry_scan_horizon': horizon,
+        })
+
+    @classmethod
+    def _update_queue(cls, rows, horizon):
+        """
+        Synchronise the queue with the given employee rows
+
+        :param rows: list of (id, number, validity, ...) tuples following
+            the DOCUMENTS order
+        :param horizon: the last expiry date to queue
+        """
+        cursor = Transaction().cursor
+
+        wanted = {}
+        for row in rows:
+            for i, (document, _, _) in enumerate(DOCUMENTS):
+                number, validity = row[1 + 2 * i], row[2 + 2 * i]
+                if validity and validity <= horizon:
+                    wanted[(row[0], document)] = (number, validity)
+        employee_ids = list(set(row[0] for row in rows))
+
+        to_delete = []
+        for i in range(0, len(employee_ids), cursor.IN_MAX):
+            sub_ids = employee_ids[i:i + cursor.IN_MAX]
+            red_sql, red_ids = reduce_ids('employee', sub_ids)
+            cursor.execute('SELECT id, employee, document, expiry_date '
+                'FROM "' + cls._table + '" '
+                'WHERE ' + red_sql, red_ids)
+            for id_, employee, document, expiry_date in cursor.fetchall():
+                key = (employee, document)
+                if key in wanted and wanted[key][1] == expiry_date:
+                    # Already queued with the same date
+                    del wanted[key]
+                else:
+                    to_delete.append(id_)
+        if to_delete:
+            cls.delete(cls.browse(to_delete))
+        bulk_insert(cls._table,
+            ['employee', 'document', 'number', 'expiry_date', 'state'],
+            [(employee_id, kind, doc_number, expiry, cls.default_state())
+                for (employee_id, kind), (doc_number, expiry)
+                in wanted.iteritems()],
+            return_ids=False)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+    Feed
+
+    Incremental change feed of the employees, attendance and leave
+    applications for the systems which synchronise with the HR data.
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import base64
+import datetime
+
+from trytond.model import ModelView, ModelSQL, fields
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.rpc import RPC
+
+from .bulk import bulk_insert
+
+__all__ = ['ChangeTombstone', 'ChangeFeed']
+
+FEED_MODELS = [
+    'company.employee',
+    'employee.attendance',
+    'employee.leave.application',
+]
+
+# The write date of a record is the start of the transaction which wrote it,
+# so the most recent changes are held back until the transactions which
+# could still commit older dates are over
+SETTLE_DELAY = datetime.timedelta(minutes=1)
+
+TOMBSTONE_RETENTION = datetime.timedelta(days=90)
+
+STAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class ChangeTombstone(ModelSQL, ModelView):
+    "Change Tombstone"
+    __name__ = 'hr.change.tombstone'
+    _rec_name = 'model'
+
+    model = fields.Char('Model', required=True, readonly=True, select=True)
+    record = fields.Integer('Record', required=True, readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(ChangeTombstone, cls).__setup__()
+        cls._order.insert(0, ('id', 'ASC'))
+
+    @classmethod
+    def record_deletions(cls, model, ids):
+        "Record the deletion of the records of the model with the given ids"
+        if model not in FEED_MODELS or not ids:
+            return
+        bulk_insert(cls._table, ['model', 'record'],
+            ((model, id_) for id_ in ids), return_ids=False)
+
+    @classmethod
+    def purge(cls):
+        "Delete the tombstones older than the retention"
+        cursor = Transaction().cursor
+        cursor.execute('DELETE FROM "' + cls._table + '" '
+            'WHERE create_date < %s',
+            (datetime.datetime.now() - TOMBSTONE_RETENTION,))
+
+
+class ChangeFeed(ModelView):
+    "Change Feed"
+    __name__ = 'hr.change.feed'
+
+    @classmethod
+    def __setup__(cls):
+        super(ChangeFeed, cls).__setup__()
+        cls.__rpc__.update({
+            'changes': RPC(),
+        })
+        cls._error_messages.update({
+            'invalid_model': 'The changes of "%s" are not available',
+            'invalid_token': 'The change feed token "%s" is invalid',
+        })
+
+    @staticmethod
+    def _encode_token(stamp, id_, tombstone):
+        # SQLite returns the COALESCE of the dates as text
+        if isinstance(stamp, datetime.datetime):
+            stamp = stamp.strftime(STAMP_FORMAT)
+        return base64.urlsafe_b64encode(
+            '%s|%s|%s' % (stamp or '', id_, tombstone))
+
+    @classmethod
+    def _decode_token(cls, token):
+        if not token:
+            return None, 0, 0
+        try:
+            stamp, id_, tombstone = base64.urlsafe_b64decode(
+                str(token)).split('|')
+            if '.' not in stamp:
+                stamp += '.0'
+            stamp = (datetime.datetime.strptime(stamp, STAMP_FORMAT)
+                if stamp != '.0' else None)
+            return stamp, int(id_), int(tombstone)
+        except (TypeError, ValueError):
+            cls.raise_user_error('invalid_token', (token,))
+
+    @classmethod
+    def changes(cls, model, token=None, limit=1000, fields_names=None):
+        """
+        Return the records of model created, modified or deleted since the
+        token as a dictionary with:
+
+            - changed: the values of the changed records ordered by date
+            - deleted: the ids of the deleted records
+            - token: the token to pass to get the next page
+            - more: True if there are more changes to fetch right away
+
+        The first call is made without token and returns everything. The
+        changed records have their stored fields unless fields_names is
+        given.
+        """
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        Tombstone = pool.get('hr.change.tombstone')
+        cursor = Transaction().cursor
+
+        if model not in FEED_MODELS:
+            cls.raise_user_error('invalid_model', (model,))
+        ModelAccess.check(model, 'read')
+        Model = pool.get(model)
+        if fields_names is None:
+            fields_names = [name for name, field in Model._fields.iteritems()
+                if not hasattr(field, 'set')]
+        stamp, last_id, last_tombstone = cls._decode_token(token)
+        horizon = datetime.datetime.now() - SETTLE_DELAY
+
+        # write_date is never older than create_date, so the predicates on
+        # both columns match the same rows as the COALESCE through their
+        # indexes
+        where = ['COALESCE(write_date, create_date) < %s']
+        params = [horizon]
+        if stamp:
+            where.append('(write_date >= %s '
+                'OR (write_date IS NULL AND create_date >= %s))')
+            where.append('(COALESCE(write_date, create_date) > %s '
+                'OR id > %s)')
+            params += [stamp, stamp, stamp, last_id]
+        cursor.execute('SELECT id, COALESCE(write_date, create_date) '
+                'AS stamp '
+            'FROM "' + Model._table + '" '
+            'WHERE ' + ' AND '.join(where) + ' '
+            'ORDER BY stamp, id LIMIT %s', params + [limit + 1])
+        rows = cursor.fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        changed = []
+        if rows:
+            last_id, stamp = rows[-1]
+            order = dict((id_, i) for i, (id_, _) in enumerate(rows))
+            changed = sorted(Model.read(order.keys(), fields_names),
+                key=lambda values: order[values['id']])
+
+        cursor.execute('SELECT id, record FROM "' + Tombstone._table + '" '
+            'WHERE model = %s AND id > %s '
+            'ORDER BY id LIMIT %s', (model, last_tombstone, limit + 1))
+        tombstones = cursor.fetchall()
+        more |= len(tombstones) > limit
+        tombstones = tombstones[:limit]
+        if tombstones:
+            last_tombstone = tombstones[-1][0]
+
+        return {
+            'changed': changed,
+            'deleted': [record for _, record in tombstones],
+            'token': cls._encode_token(stamp, last_id, last_tombstone),
+            'more': more,
+        }
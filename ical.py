@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    iCalendar
+
+    Feed of the approved leaves and the holidays of a department and its
+    sub-departments in the iCalendar format (RFC 5545).
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import datetime
+import hashlib
+
+from trytond.model import ModelView
+from trytond.config import CONFIG
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.rpc import RPC
+
+from .profiling import profiled
+
+__all__ = ['CalendarFeed']
+
+
+def _escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(
+        ',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    "Fold the content line at 75 octets"
+    line = line.encode('utf-8')
+    parts = []
+    while len(line) > 75:
+        cut = 75 if not parts else 74
+        # Do not split a multi-byte character
+        while cut and (ord(line[cut]) & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _latest(*aliases):
+    """
+    Return the SQL of the last change of the rows of the aliases, the first
+    one being the row of the event which stands for the rows missing from
+    the outer joins
+    """
+    # SQLite has no GREATEST but a MAX with many arguments, which is NULL
+    # if any of them is
+    function = 'GREATEST' if CONFIG['db_type'] == 'postgresql' else 'MAX'
+    return function + '(' + ', '.join(
+        'COALESCE(%s.write_date, %s.create_date, %s.create_date)'
+        % (a, a, aliases[0]) for a in aliases) + ')'
+
+
+def _date(value):
+    # SQLite returns the dates of a UNION as text
+    if isinstance(value, basestring):
+        value = datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value
+
+
+class CalendarFeed(ModelView):
+    "HR Calendar Feed"
+    __name__ = 'hr.calendar.feed'
+
+    @classmethod
+    def __setup__(cls):
+        super(CalendarFeed, cls).__setup__()
+        cls.__rpc__.update({
+            'feed': RPC(),
+        })
+
+    @classmethod
+    def _sources(cls):
+        """
+        Return the SQL selecting the events of the subtree as the kind, id,
+        date of change, title, start and end dates and the parameters which
+        follow the department.
+
+        The date of change is the last one of all the rows the event is
+        built from, so that renaming a leave type or moving an employee
+        changes the entity tag.
+        """
+        pool = Pool()
+        Department = pool.get('company.department')
+        Company = pool.get('company.company')
+        Employee = pool.get('company.employee')
+        Party = pool.get('party.party')
+        LeaveApplication = pool.get('employee.leave.application')
+        LeaveType = pool.get('employee.leave.type')
+        PayrollYear = pool.get('payroll.year')
+        Period = pool.get('payroll.period')
+        Holiday = pool.get('payroll.holiday')
+
+        return (
+            'SELECT %s AS kind, l.id AS id, '
+                + _latest('l', 'e', 'p', 't') + ' AS stamp, '
+                'p.name AS title, t.name AS detail, '
+                'l.from_date AS start_date, l.to_date AS end_date '
+            'FROM "' + LeaveApplication._table + '" AS l '
+            'JOIN "' + Employee._table + '" AS e ON e.id = l.employee '
+            'JOIN subtree ON subtree.id = e.department '
+            'JOIN "' + Party._table + '" AS p ON p.id = e.party '
+            'JOIN "' + LeaveType._table + '" AS t ON t.id = l.leave_type '
+            'WHERE l.state = %s '
+            'UNION ALL '
+            'SELECT %s, h.id, ' + _latest('h', 'd', 'cp') + ', '
+                'COALESCE(d.name, cp.name), NULL, h.date, h.date '
+            'FROM "' + Holiday._table + '" AS h '
+            'JOIN "' + Period._table + '" AS r ON r.id = h.period '
+            'JOIN "' + PayrollYear._table + '" AS y '
+                'ON y.id = r.payroll_year '
+            'LEFT JOIN "' + Department._table + '" AS d '
+                'ON d.id = y.department '
+            'JOIN "' + Company._table + '" AS c ON c.id = y.company '
+            'JOIN "' + Party._table + '" AS cp ON cp.id = c.party '
+            # A year of the company calendar is listed once however many
+            # departments of the subtree follow it
+            'WHERE y.id IN (SELECT dy.year '
+                'FROM (' + PayrollYear.department_years() + ') AS dy '
+                'JOIN subtree ON subtree.id = dy.department)',
+            ['leave', 'Approved', 'holiday'])
+
+    @classmethod
+    def etag(cls, department):
+        """
+        Return the entity tag of the feed of the department from the last
+        change of the rows of its events and their number, with a single
+        aggregate.
+        """
+        Department = Pool().get('company.department')
+        cursor = Transaction().cursor
+
+        sources, params = cls._sources()
+        cursor.execute('SELECT MAX(stamp), COUNT(*) FROM ('
+            + Department.subtree_query() + sources + ') AS events',
+            [department] + params)
+        stamp, count = cursor.fetchone()
+        return hashlib.md5('%s|%s|%s|%s' % (cursor.database_name,
+                department, stamp, count)).hexdigest()
+
+    @classmethod
+    @profiled
+    def feed(cls, department, etag=None, size=1000):
+        """
+        Return the iCalendar feed of the department and its sub-departments
+        as a dictionary with the etag and the data.
+
+        When etag matches the current one, only the aggregate of etag is
+        run and the data is None, which is the 304 of the feed.
+        """
+        current = cls.etag(department)
+        if etag == current:
+            return {'etag': current, 'data': None}
+        return {
+            'etag': current,
+            'data': ''.join(cls.stream(department, size=size)).decode(
+                'utf-8'),
+        }
+
+    @classmethod
+    def stream(cls, department, size=1000):
+        """
+        Yield the lines of the iCalendar feed of the department, fetching
+        the events of the single query by size rows.
+        """
+        Department = Pool().get('company.department')
+        cursor = Transaction().cursor
+
+        sources, params = cls._sources()
+        cursor.execute('SELECT * FROM ('
+            + Department.subtree_query() + sources + ') AS events '
+            'ORDER BY start_date', [department] + params)
+
+        database = cursor.database_name
+        now = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        yield 'BEGIN:VCALENDAR\r\n'
+        yield 'VERSION:2.0\r\n'
+        yield 'PRODID:-//Openlabs//Tryton HR//EN\r\n'
+        yield 'CALSCALE:GREGORIAN\r\n'
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            for kind, id_, _, title, detail, start_date, end_date in rows:
+                start_date, end_date = _date(start_date), _date(end_date)
+                # DTEND is exclusive unlike the to date of the leaves
+                if kind == 'holiday' or end_date < start_date:
+                    end_date = start_date
+                end_date += datetime.timedelta(days=1)
+                summary = ('%s: %s' % (title, detail) if detail
+                    else 'Holiday: %s' % title)
+                yield 'BEGIN:VEVENT\r\n'
+                yield _fold(u'UID:%s-%s@%s' % (kind, id_, database))
+                yield 'DTSTAMP:%s\r\n' % now
+                yield 'DTSTART;VALUE=DATE:%s\r\n' % start_date.strftime(
+                    '%Y%m%d')
+                yield 'DTEND;VALUE=DATE:%s\r\n' % end_date.strftime('%Y%m%d')
+                yield _fold(u'SUMMARY:%s' % _escape(summary))
+                yield 'TRANSP:TRANSPARENT\r\n'
+                yield 'END:VEVENT\r\n'
+        yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    loadgen
+
+    Generate a synthetic HR data set to load test a deployment::
+
+        python -m trytond.modules.hr.loadgen -c trytond.conf -d database \\
+            --company 1 --employees 100000 --attendance-days 500
+
+    The data is loaded with multi-row INSERT statements, bypassing the per
+    record create of the ORM, and is fully determined by --seed and --date so
+    that benchmark runs are comparable.
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import datetime
+import random
+import time
+
+from dateutil.relativedelta import relativedelta
+
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction
+
+from .bulk import bulk_insert, copy_history
+
+FIRST_NAMES = [
+    'Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Ishaan', 'Kabir',
+    'Meera', 'Nisha', 'Rohan', 'Saanvi', 'Tara', 'Vihaan', 'Zara',
+]
+LAST_NAMES = [
+    'Sharma', 'Verma', 'Iyer', 'Nair', 'Reddy', 'Patel', 'Menon', 'Gupta',
+    'Das', 'Khan', 'Pillai', 'Rao', 'Singh', 'Joseph',
+]
+CITIES = ['Chennai', 'Delhi', 'Mumbai', 'Kochi', 'Pune', 'Bangalore']
+LEAVE_STATES = ['Draft', 'In Review', 'Approved', 'Denied']
+
+
+class Generator(object):
+    "Synthetic data generator"
+
+    def __init__(self, pool, company, country, options):
+        self.pool = pool
+        self.company = company
+        self.country = country
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.today = options.date
+        self.cursor = Transaction().cursor
+
+    def log(self, message, *args):
+        if self.options.verbose:
+            print '[%s] %s' % (time.strftime('%H:%M:%S'), message % args)
+
+    def link(self, table, column, pairs):
+        """
+        Set column to the parent of every (parent, id) pair with one UPDATE
+        per parent and chunk of ids
+        """
+        children = {}
+        for parent, id_ in pairs:
+            children.setdefault(parent, []).append(id_)
+        for parent, ids in children.iteritems():
+            for i in range(0, len(ids), self.cursor.IN_MAX):
+                red_sql, red_ids = reduce_ids('id',
+                    ids[i:i + self.cursor.IN_MAX])
+                self.cursor.execute('UPDATE "' + table + '" '
+                    'SET "' + column + '" = %s WHERE ' + red_sql,
+                    [parent] + red_ids)
+
+    def run(self):
+        departments = self.departments()
+        self.log('%s departments', len(departments))
+        periods = self.payroll(departments)
+        self.log('%s payroll periods', sum(len(p) for p in periods.values()))
+        employees = self.employees(departments)
+        self.log('%s employees', len(employees))
+        leaves = self.leaves(employees)
+        self.log('%s employees with approved leaves', len(leaves))
+        count = self.attendance(employees, periods, leaves)
+        self.log('%s attendance rows', count)
+        if self.options.directory:
+            self.pool.get('company.employee').rebuild_directory()
+            self.log('directory rebuilt')
+        for name in ('company.department.headcount',
+                'company.department.allowance'):
+            self.pool.get(name).rebuild()
+        self.log('department rollups rebuilt')
+
+    def departments(self):
+        "Create a department tree with the given fan out"
+        Department = self.pool.get('company.department')
+
+        count, fanout = self.options.departments, self.options.fanout
+        ids = bulk_insert(Department._table,
+            ['name', 'company', 'active'],
+            (('Department %s' % i, self.company, True)
+                for i in range(count)))
+        self.link(Department._table, 'parent',
+            [(ids[(i - 1) // fanout], ids[i]) for i in range(1, count)])
+        return ids
+
+    def payroll(self, departments):
+        """
+        Create the payroll years with monthly periods and holidays of the
+        company calendar and of the first departments which override it, and
+        return the periods by department, None for the company calendar, as
+        (id, start_date, end_date, holidays) tuples.
+        """
+        pool = self.pool
+        Year = pool.get('payroll.year')
+        Period = pool.get('payroll.period')
+        Holiday = pool.get('payroll.holiday')
+
+        first_year = self.today.year - self.options.years + 1
+        years = [(department, first_year + y)
+            for department in [None] + departments[:self.options.overrides]
+            for y in range(self.options.years)]
+        year_ids = bulk_insert(Year._table,
+            ['name', 'start_date', 'end_date', 'state', 'company',
+                'department'],
+            ((str(year), datetime.date(year, 1, 1),
+                    datetime.date(year, 12, 31),
+                    'open' if year == self.today.year else 'close',
+                    self.company, department)
+                for department, year in years))
+
+        months = []
+        for year_id, (department, year) in zip(year_ids, years):
+            for month in range(1, 13):
+                start = datetime.date(year, month, 1)
+                months.append((year_id, department, start,
+                        start + relativedelta(day=31),
+                        'open' if year == self.today.year else 'close'))
+        period_ids = bulk_insert(Period._table,
+            ['name', 'payroll_year', 'department', 'start_date',
+                'end_date', 'state'],
+            ((start.strftime('%Y-%m'), year_id, department, start, end,
+                    state)
+                for year_id, department, start, end, state in months))
+
+        periods = {}
+        holidays = []
+        for period_id, (_, department, start, end, _) in zip(
+                period_ids, months):
+            dates = set(start + datetime.timedelta(days=self.random.randint(
+                            0, (end - start).days))
+                for _ in range(self.options.holidays))
+            holidays.extend((period_id, d, False) for d in sorted(dates))
+            periods.setdefault(department, []).append(
+                (period_id, start, end, dates))
+        bulk_insert(Holiday._table, ['period', 'date', 'recurring'], holidays,
+            return_ids=False)
+        return periods
+
+    def employees(self, departments):
+        """
+        Create the parties with their address and the employees with manager
+        chains inside each department and return the employees as
+        (id, department) tuples.
+        """
+        pool = self.pool
+        Party = pool.get('party.party')
+        Address = pool.get('party.address')
+        Employee = pool.get('company.employee')
+        rand = self.random
+
+        count = self.options.employees
+        names = [(rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES))
+            for _ in range(count)]
+        party_ids = bulk_insert(Party._table, ['name', 'code', 'active'],
+            (('%s %s' % name, 'HR%08d' % i, True)
+                for i, name in enumerate(names)))
+        copy_history(Party, party_ids)
+        address_ids = bulk_insert(Address._table,
+            ['party', 'street', 'city', 'country', 'active'],
+            ((party_id, '%s Main Street' % rand.randint(1, 999),
+                    rand.choice(CITIES), self.country, True)
+                for party_id in party_ids))
+
+        employee_departments = [departments[i % len(departments)]
+            for i in range(count)]
+
+        def rows():
+            for i, (first_name, last_name) in enumerate(names):
+                yield (party_ids[i], self.company, employee_departments[i],
+                    'current', first_name, last_name, 'E%08d' % i,
+                    address_ids[i], address_ids[i],
+                    rand.choice(['male', 'female']),
+                    datetime.date(rand.randint(1955, 1998),
+                        rand.randint(1, 12), rand.randint(1, 28)),
+                    rand.choice(CITIES), rand.choice(['single', 'married']),
+                    self.country, rand.choice(['probation', 'confirmed']),
+                    self.today - datetime.timedelta(
+                        days=rand.randint(0, 365 * self.options.years)))
+        employee_ids = bulk_insert(Employee._table,
+            ['party', 'company', 'department', 'state', 'first_name',
+                'last_name', 'employee_id', 'permanent_address',
+                'present_address', 'sex', 'date_of_birth', 'place_of_birth',
+                'marital_status', 'nationality', 'type', 'join_date'],
+            rows())
+
+        # Chain each employee to a manager of the same department hired
+        # before, which gives trees of depth log(size) per department
+        by_department = {}
+        for employee_id, department in zip(
+                employee_ids, employee_departments):
+            by_department.setdefault(department, []).append(employee_id)
+        managers = []
+        for members in by_department.itervalues():
+            for i in range(1, len(members)):
+                managers.append(
+                    (members[(i - 1) // self.options.fanout], members[i]))
+        self.link(Employee._table, 'manager', managers)
+        copy_history(Employee, employee_ids)
+        return zip(employee_ids, employee_departments)
+
+    def leaves(self, employees):
+        """
+        Create leave applications in every state and return the approved
+        ones by employee as (id, leave type, dates) tuples.
+        """
+        LeaveApplication = self.pool.get('employee.leave.application')
+        rand = self.random
+
+        LeaveType = self.pool.get('employee.leave.type')
+        self.cursor.execute('SELECT id FROM "%s" ORDER BY id'
+            % LeaveType._table)
+        leave_types = [x[0] for x in self.cursor.fetchall()]
+        start = self.today - datetime.timedelta(
+            days=self.options.attendance_days)
+        applications = []
+        for employee_id, _ in employees:
+            for i in range(self.options.leaves):
+                from_date = start + datetime.timedelta(
+                    days=rand.randint(0, self.options.attendance_days))
+                days = rand.randint(1, 3)
+                applications.append((employee_id, from_date,
+                        from_date + datetime.timedelta(days=days),
+                        rand.choice(leave_types),
+                        LEAVE_STATES[i % len(LEAVE_STATES)]))
+        ids = bulk_insert(LeaveApplication._table,
+            ['employee', 'from_date', 'to_date', 'type', 'leave_type',
+                'state'],
+            ((employee_id, from_date, to_date, 'full_day', leave_type,
+                    state)
+                for employee_id, from_date, to_date, leave_type, state
+                in applications))
+
+        approved = {}
+        for id_, (employee_id, from_date, to_date, _, state) in zip(
+                ids, applications):
+            if state != 'Approved':
+                continue
+            dates = [from_date + datetime.timedelta(days=d)
+                for d in range((to_date - from_date).days)]
+            approved.setdefault(employee_id, []).append((id_, dates))
+        return approved
+
+    def attendance(self, employees, periods, leaves):
+        """
+        Create the daily attendance of the employees, skipping holidays and
+        marking the days of the approved leaves.
+        """
+        Attendance = self.pool.get('employee.attendance')
+        rand = self.random
+
+        holidays = {}
+        for department, department_periods in periods.iteritems():
+            holidays[department] = set()
+            for _, _, _, dates in department_periods:
+                holidays[department].update(dates)
+        for _, department in employees:
+            holidays.setdefault(department, holidays[None])
+        days = [self.today - datetime.timedelta(days=d)
+            for d in range(self.options.attendance_days, 0, -1)]
+
+        def rows():
+            for employee_id, department in employees:
+                on_leave = {}
+                for application_id, dates in leaves.get(employee_id, []):
+                    for date in dates:
+                        on_leave.setdefault(date, application_id)
+                for date in days:
+                    if date in on_leave:
+                        yield (employee_id, date, None, None, True,
+                            on_leave[date], None)
+                    elif (date not in holidays[department]
+                            and date.weekday() < 5):
+                        in_time = datetime.datetime.combine(date,
+                            datetime.time(8, rand.randint(30, 59)))
+                        out_time = in_time + datetime.timedelta(
+                            minutes=rand.randint(420, 600))
+                        yield (employee_id, date, in_time, out_time, False,
+                            None, (out_time - in_time).seconds // 60)
+
+        counter = [0]
+
+        def counted(iterable):
+            for row in iterable:
+                counter[0] += 1
+                yield row
+        bulk_insert(Attendance._table,
+            ['employee', 'date', 'in_time', 'out_time', 'on_leave',
+                'leave_application', 'worked_minutes'],
+            counted(rows()), size=5000, return_ids=False)
+        return counter[0]
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', dest='config',
+        help='the trytond configuration file')
+    parser.add_argument('-d', '--database', dest='database', required=True)
+    parser.add_argument('--company', type=int, required=True,
+        help='the id of the company')
+    parser.add_argument('--country', type=int,
+        help='the id of the country, the first one by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--date', type=parse_date,
+        default=datetime.date.today(),
+        help='the reference date as YYYY-MM-DD, today by default')
+    parser.add_argument('--departments', type=int, default=300)
+    parser.add_argument('--fanout', type=int, default=5,
+        help='the children per department and reports per manager')
+    parser.add_argument('--employees', type=int, default=100000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--holidays', type=int, default=1,
+        help='the holidays per period')
+    parser.add_argument('--overrides', type=int, default=0,
+        help='the departments with their own payroll calendar')
+    parser.add_argument('--attendance-days', type=int, default=30)
+    parser.add_argument('--leaves', type=int, default=4,
+        help='the leave applications per employee')
+    parser.add_argument('--no-directory', dest='directory',
+        action='store_false', help='do not build the directory text')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    options = parser.parse_args()
+
+    from trytond.config import CONFIG
+    if options.config:
+        CONFIG.update_etc(options.config)
+    from trytond.pool import Pool
+
+    Pool.start()
+    pool = Pool(options.database)
+    pool.init()
+    with Transaction().start(options.database, 0) as transaction:
+        cursor = transaction.cursor
+        country = options.country
+        if not country:
+            Country = pool.get('country.country')
+            cursor.execute('SELECT MIN(id) FROM "%s"' % Country._table)
+            country, = cursor.fetchone()
+        Generator(pool, options.company, country, options).run()
+        cursor.commit()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+    Onboarding
+
+    Batch creation of employees with their party, addresses and details.
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+from itertools import chain
+
+from trytond.model import ModelView
+from trytond.config import CONFIG
+from trytond.exceptions import UserError
+from trytond.pyson import PYSONEncoder, PYSONDecoder
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.rpc import RPC
+
+from .bulk import bulk_insert, copy_history
+from .profiling import profiled
+
+__all__ = ['Onboarding']
+
+# The One2Many fields of the employee which can be given in a payload
+CHILDREN = ['language_skills', 'academics', 'skills', 'payment_details']
+
+MAGIC_FIELDS = ('id', 'create_uid', 'create_date', 'write_uid', 'write_date')
+
+UNIQUE = re.compile(r'^\s*UNIQUE\s*\((.*)\)\s*$', re.I)
+
+
+def _stored_fields(Model):
+    return [name for name, field in Model._fields.iteritems()
+        if not hasattr(field, 'set') and name not in MAGIC_FIELDS]
+
+
+class Onboarding(ModelView):
+    "Employee Onboarding"
+    __name__ = 'company.employee.onboarding'
+
+    @classmethod
+    def __setup__(cls):
+        super(Onboarding, cls).__setup__()
+        cls.__rpc__.update({
+            'onboard': RPC(readonly=False),
+        })
+        cls._error_messages.update({
+            'unknown_field': 'Unknown field "%s" on "%s"',
+            'required_field': 'The field "%s" on "%s" is required',
+            'invalid_selection': 'The value "%s" of the field "%s" on "%s" '
+                'is not valid',
+            'missing_record': 'The record %s of "%s" referenced by the field '
+                '"%s" does not exist',
+            'invalid_record': 'The record %s of "%s" referenced by the field '
+                '"%s" does not match its domain',
+            'missing_address': 'The address index %s of "%s" does not exist',
+            'duplicate_record': 'The record of "%s" is not unique: %s',
+        })
+
+    @classmethod
+    def _error(cls, error, args):
+        return cls.raise_user_error(error, args, raise_exception=False)
+
+    @classmethod
+    @profiled
+    def onboard(cls, payloads):
+        """
+        Create the employees of the payloads and return a dictionary with:
+
+            - employees: the list of [index, employee id] created
+            - errors: the list of [index, message] of the payloads refused
+
+        A payload holds the values of the employee with:
+
+            - party: the values of the party
+            - addresses: the list of the values of the addresses of the party
+            - permanent_address and present_address: the index of the
+              address in addresses, the first one by default
+            - language_skills, academics, skills and payment_details: the
+              lists of the values of the children
+
+        Every payload is validated first like by create: the required
+        fields and their states, the selections, the constraints of the
+        models and the domains of the references, these with one query per
+        model and domain for the whole batch. The unique keys are checked
+        against the batch and the existing records, so a payload which would
+        break them is refused alone. Then each model is created
+        with multi-row INSERTs, the history of the parties and employees is
+        copied in bulk, and the directory text and the department headcounts
+        are updated once.
+        """
+        pool = Pool()
+        Party = pool.get('party.party')
+        Address = pool.get('party.address')
+        Employee = pool.get('company.employee')
+
+        errors = {}
+        rows = {}
+        batch = {
+            'defaults': {},
+            'references': [],
+            'records': {},
+        }
+        for index, payload in enumerate(payloads):
+            payload = payload.copy()
+            try:
+                party = cls._prepare(Party, payload.pop('party', {}), index,
+                    batch, skip=['code'])
+                addresses = [cls._prepare(Address, values, index, batch,
+                        skip=['party'])
+                    for values in payload.pop('addresses', [])]
+                for name in ('permanent_address', 'present_address'):
+                    position = payload.pop(name, 0)
+                    if not 0 <= position < len(addresses):
+                        raise ValueError(cls._error('missing_address',
+                                (position, name)))
+                    payload[name] = position
+                children = {}
+                for name in CHILDREN:
+                    Child = pool.get(Employee._fields[name].model_name)
+                    children[name] = [cls._prepare(Child, values, index,
+                            batch, skip=[Employee._fields[name].field])
+                        for values in payload.pop(name, [])]
+                employee = cls._prepare(Employee, payload, index, batch,
+                    skip=['party', 'permanent_address', 'present_address',
+                        'employee_id'])
+            except ValueError, exception:
+                errors[index] = exception.args[0]
+                continue
+            rows[index] = (party, addresses, employee, children)
+
+        # The unique keys are checked once the other errors are known so
+        # that a refused payload does not hide a later one
+        for index, message in chain(
+                cls._check_references(batch['references']),
+                cls._check_unique(batch['records'], rows)):
+            errors.setdefault(index, message)
+            rows.pop(index, None)
+
+        indexes = sorted(rows)
+        ids = cls._insert(indexes, rows) if indexes else []
+        return {
+            'employees': [[i, id_] for i, id_ in zip(indexes, ids)],
+            'errors': [[i, errors[i]] for i in sorted(errors)],
+        }
+
+    @classmethod
+    def _prepare(cls, Model, values, index, batch, skip=None):
+        """
+        Return the values completed with the defaults of Model after checking
+        the fields, the required values, the selections and the constraints
+        of Model.
+
+        The Many2One values are added to the references of the batch as
+        (index, target, id, field name, domain) and the row to its records
+        as (index, row, skip). The defaults are computed once per model and
+        kept in the batch.
+        """
+        skip = set(skip or [])
+        names = set(_stored_fields(Model))
+        for name in values:
+            if name not in names:
+                raise ValueError(cls._error('unknown_field',
+                        (name, Model.__name__)))
+        defaults = batch['defaults']
+        if Model.__name__ not in defaults:
+            defaults[Model.__name__] = Model.default_get(list(names - skip),
+                with_rec_name=False)
+        row = defaults[Model.__name__].copy()
+        row.update(values)
+
+        env = Transaction().context.copy()
+        env.update(row)
+        env['id'] = None
+
+        def evaluate(value):
+            return PYSONDecoder(env).decode(PYSONEncoder().encode(value))
+
+        for name in names - skip:
+            field = Model._fields[name]
+            value = row.get(name)
+            required = field.required or evaluate(
+                (field.states or {}).get('required', False))
+            if required and value in (None, ''):
+                raise ValueError(cls._error('required_field',
+                        (name, Model.__name__)))
+            if value is None:
+                continue
+            if field._type == 'selection' \
+                    and isinstance(field.selection, (list, tuple)) \
+                    and value not in dict(field.selection):
+                raise ValueError(cls._error('invalid_selection',
+                        (value, name, Model.__name__)))
+            if field._type == 'many2one':
+                batch['references'].append((index, field.model_name, value,
+                        name, evaluate(field.domain or [])))
+
+        if Model._constraints:
+            record = Model(**row)
+            for name, error in Model._constraints:
+                method = getattr(Model, name)
+                try:
+                    if not hasattr(method, 'im_self') or method.im_self:
+                        valid = method([record])
+                    else:
+                        valid = method(record)
+                except UserError, exception:
+                    raise ValueError(exception.message)
+                if not valid:
+                    raise ValueError(Model.raise_user_error(error,
+                            raise_exception=False))
+
+        batch['records'].setdefault(Model.__name__, []).append(
+            (index, row, skip))
+        return row
+
+    @classmethod
+    def _check_references(cls, references):
+        """
+        Yield (index, message) for the references to missing records or to
+        records which do not match the domain of the field
+        """
+        pool = Pool()
+        cursor = Transaction().cursor
+
+        by_model = {}
+        by_domain = {}
+        for index, model_name, id_, name, domain in references:
+            by_model.setdefault(model_name, set()).add(id_)
+            if domain:
+                key = (model_name, PYSONEncoder().encode(domain))
+                by_domain.setdefault(key, (domain, set()))[1].add(id_)
+        existing = {}
+        for model_name, ids in by_model.iteritems():
+            Target = pool.get(model_name)
+            ids = list(ids)
+            existing[model_name] = set()
+            for i in range(0, len(ids), cursor.IN_MAX):
+                red_sql, red_ids = reduce_ids('id', ids[i:i + cursor.IN_MAX])
+                cursor.execute('SELECT id FROM "' + Target._table + '" '
+                    'WHERE ' + red_sql, red_ids)
+                existing[model_name].update(x[0] for x in cursor.fetchall())
+        matching = {}
+        for key, (domain, ids) in by_domain.iteritems():
+            Target = pool.get(key[0])
+            ids = [i for i in ids if i in existing[key[0]]]
+            matching[key] = set()
+            for i in range(0, len(ids), cursor.IN_MAX):
+                matching[key].update(r.id for r in Target.search([
+                            ('id', 'in', ids[i:i + cursor.IN_MAX]),
+                            ] + domain))
+
+        for index, model_name, id_, name, domain in references:
+            if id_ not in existing[model_name]:
+                yield index, cls._error('missing_record',
+                    (id_, model_name, name))
+            elif domain and id_ not in matching[
+                    (model_name, PYSONEncoder().encode(domain))]:
+                yield index, cls._error('invalid_record',
+                    (id_, model_name, name))
+
+    @classmethod
+    def _check_unique(cls, records, rows):
+        """
+        Yield (index, message) for the rows of the valid payloads which
+        break a UNIQUE constraint of their model, against the previous rows
+        of the batch or the existing records.
+
+        The columns skipped by _prepare and not given are filled at the
+        insertion, so they are unique to the payload.
+        """
+        pool = Pool()
+        cursor = Transaction().cursor
+
+        for model_name, entries in records.iteritems():
+            Model = pool.get(model_name)
+            entries = [e for e in entries if e[0] in rows]
+            for _, constraint, message in Model._sql_constraints:
+                match = UNIQUE.match(constraint)
+                if not match:
+                    continue
+                columns = [c.strip().strip('"')
+                    for c in match.group(1).split(',')]
+                seen = set()
+                lookups = {}
+                for index, row, skip in entries:
+                    key = tuple(('new', index)
+                        if c in skip and row.get(c) is None else row.get(c)
+                        for c in columns)
+                    # NULL values never collide
+                    if None in key:
+                        continue
+                    if key in seen:
+                        yield index, cls._error('duplicate_record',
+                            (model_name, message))
+                        continue
+                    seen.add(key)
+                    if not any(isinstance(k, tuple) for k in key):
+                        lookups.setdefault(key, []).append(index)
+
+                keys = lookups.keys()
+                condition = '(' + ' AND '.join('"%s" = %%s' % c
+                    for c in columns) + ')'
+                size = max(cursor.IN_MAX // len(columns), 1)
+                for i in range(0, len(keys), size):
+                    sub_keys = keys[i:i + size]
+                    cursor.execute('SELECT '
+                            + ', '.join('"%s"' % c for c in columns) + ' '
+                        'FROM "' + Model._table + '" '
+                        'WHERE ' + ' OR '.join([condition] * len(sub_keys)),
+                        [x for key in sub_keys for x in key])
+                    for key in cursor.fetchall():
+                        for index in lookups.get(tuple(key), []):
+                            yield index, cls._error('duplicate_record',
+                                (model_name, message))
+
+    @classmethod
+    def _insert(cls, indexes, rows):
+        "Create the records of the valid payloads and return the employee ids"
+        pool = Pool()
+        Party = pool.get('party.party')
+        PartyConfiguration = pool.get('party.configuration')
+        Address = pool.get('party.address')
+        Employee = pool.get('company.employee')
+        Configuration = pool.get('company.employee.configuration')
+        Headcount = pool.get('company.department.headcount')
+
+        parties = [rows[index][0] for index in indexes]
+        codes = iter(cls._get_sequence_numbers(
+                PartyConfiguration(1).party_sequence.id,
+                len([p for p in parties if not p.get('code')])))
+        for party in parties:
+            if not party.get('code'):
+                party['code'] = codes.next()
+        party_ids = cls._bulk_create(Party, parties)
+        copy_history(Party, party_ids)
+
+        addresses = []
+        for index, party_id in zip(indexes, party_ids):
+            for address in rows[index][1]:
+                address['party'] = party_id
+                addresses.append(address)
+        address_ids = iter(cls._bulk_create(Address, addresses))
+
+        employee_codes = iter(cls._get_sequence_numbers(
+                Configuration.get_employee_sequence(), len(indexes)))
+        employees = []
+        for index, party_id in zip(indexes, party_ids):
+            party_addresses, employee = rows[index][1:3]
+            party_address_ids = [address_ids.next()
+                for address in party_addresses]
+            employee['party'] = party_id
+            for name in ('permanent_address', 'present_address'):
+                employee[name] = party_address_ids[employee[name]]
+            employee['employee_id'] = employee_codes.next()
+            employees.append(employee)
+        employee_ids = cls._bulk_create(Employee, employees)
+        copy_history(Employee, employee_ids)
+
+        for name in CHILDREN:
+            field = Employee._fields[name]
+            children = []
+            for index, employee_id in zip(indexes, employee_ids):
+                for child in rows[index][3][name]:
+                    child[field.field] = employee_id
+                    children.append(child)
+            if children:
+                cls._bulk_create(pool.get(field.model_name), children,
+                    return_ids=False)
+
+        Employee.update_directory(Employee.browse(employee_ids))
+        Headcount.apply({}, Headcount.collect(employee_ids))
+        return employee_ids
+
+    @staticmethod
+    def _get_sequence_numbers(sequence_id, count):
+        """
+        Return count numbers of the sequence, reserved with a single query
+        when the sequence is incremental
+        """
+        Sequence = Pool().get('ir.sequence')
+        transaction = Transaction()
+        cursor = transaction.cursor
+
+        # bypass the rules on the sequences like Sequence.get_id
+        with transaction.set_context(user=False):
+            with transaction.set_user(0):
+                sequence = Sequence(sequence_id)
+                if sequence.type != 'incremental':
+                    return [Sequence.get_id(sequence_id)
+                        for i in range(count)]
+                if not count:
+                    return []
+                if CONFIG['db_type'] == 'postgresql':
+                    cursor.execute('SELECT nextval(%s) '
+                        'FROM generate_series(1, %s)',
+                        ('"%s"' % sequence._sql_sequence_name, count))
+                    numbers = sorted(x[0] for x in cursor.fetchall())
+                else:
+                    number_next = sequence.number_next_internal
+                    numbers = range(number_next,
+                        number_next + count * sequence.number_increment,
+                        sequence.number_increment)
+                    Sequence.write([sequence], {
+                            'number_next_internal': (number_next
+                                + count * sequence.number_increment),
+                            })
+                date = transaction.context.get('date')
+                prefix = Sequence._process(sequence.prefix, date=date)
+                suffix = Sequence._process(sequence.suffix, date=date)
+        return ['%s%s%s' % (prefix, '%%0%sd' % sequence.padding % number,
+                suffix) for number in numbers]
+
+    @staticmethod
+    def _bulk_create(Model, rows, return_ids=True):
+        columns = sorted(set().union(*rows)) if rows else []
+        return bulk_insert(Model._table, columns,
+            (tuple(row.get(c) for c in columns) for row in rows),
+            return_ids=return_ids)
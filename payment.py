@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+    Payment
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import csv
+import datetime
+from StringIO import StringIO
+
+from trytond.model import ModelView, ModelSQL, Workflow, fields
+from trytond.wizard import Wizard, StateView, StateTransition, Button
+from trytond.pyson import Eval
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.tools import reduce_ids
+
+from .profiling import profiled
+
+__all__ = [
+    'PaymentBatch', 'PaymentBatchLine', 'ImportReturnsStart',
+    'ImportReturns',
+]
+
+STATES = {
+    'readonly': Eval('state') != 'draft',
+}
+DEPENDS = ['state']
+
+# Width of the columns of the fixed width layout
+FIXED_WIDTHS = [
+    ('record', 1),
+    ('bank_code', 11),
+    ('bank_branch_code', 11),
+    ('employee_id', 16),
+    ('bank_account_name', 35),
+    ('payment_date', 8),
+    ('reference', 16),
+]
+
+
+class PaymentBatch(Workflow, ModelSQL, ModelView):
+    "Employee Payment Batch"
+    __name__ = 'company.employee.payment_batch'
+
+    name = fields.Char('Name', required=True, states=STATES, depends=DEPENDS)
+    company = fields.Many2One(
+        'company.company', 'Company', required=True, select=True,
+        states=STATES, depends=DEPENDS
+    )
+    period = fields.Many2One(
+        'payroll.period', 'Payroll Period', required=True,
+        states=STATES, depends=DEPENDS
+    )
+    payment_date = fields.Date(
+        'Payment Date', required=True, states=STATES, depends=DEPENDS
+    )
+    layout = fields.Selection([
+        ('csv', 'CSV'),
+        ('fixed', 'Fixed Width'),
+    ], 'File Layout', required=True, states=STATES, depends=DEPENDS)
+    lines = fields.One2Many(
+        'company.employee.payment_batch.line', 'batch', 'Lines',
+        readonly=True
+    )
+    file = fields.Binary('Bank File', readonly=True)
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('generated', 'Generated'),
+        ('done', 'Done'),
+    ], 'State', readonly=True, required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(PaymentBatch, cls).__setup__()
+        cls._order.insert(0, ('payment_date', 'DESC'))
+        cls._transitions |= set((
+            ('draft', 'generated'),
+            ('generated', 'draft'),
+            ('generated', 'done'),
+        ))
+        cls._buttons.update({
+            'generate': {
+                'invisible': Eval('state') != 'draft',
+            },
+            'draft': {
+                'invisible': Eval('state') != 'generated',
+            },
+            'done': {
+                'invisible': Eval('state') != 'generated',
+            },
+        })
+        cls._error_messages.update({
+            'invalid_return': 'Line %s of the return file is invalid: %s',
+        })
+
+    @staticmethod
+    def default_state():
+        return 'draft'
+
+    @staticmethod
+    def default_layout():
+        return 'csv'
+
+    @staticmethod
+    def default_company():
+        return Transaction().context.get('company')
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('generated')
+    @profiled
+    def generate(cls, batches):
+        for batch in batches:
+            cls.select_lines(batch)
+            output = StringIO()
+            cls.write_bank_file(batch, output)
+            cls.write([batch], {'file': buffer(output.getvalue())})
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('draft')
+    @profiled
+    def draft(cls, batches):
+        cursor = Transaction().cursor
+        Line = Pool().get('company.employee.payment_batch.line')
+
+        for batch in batches:
+            cursor.execute('DELETE FROM "' + Line._table + '" '
+                'WHERE batch = %s', (batch.id,))
+        cls.write(batches, {'file': None})
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('done')
+    @profiled
+    def done(cls, batches):
+        pass
+
+    @classmethod
+    def select_lines(cls, batch):
+        """
+        Create the lines of the batch from the active bank payment details
+        of the company which apply to the period, with a single
+        INSERT ... SELECT.
+        """
+        pool = Pool()
+        Line = pool.get('company.employee.payment_batch.line')
+        PaymentDetail = pool.get('company.employee.payment_detail')
+        Employee = pool.get('company.employee')
+        cursor = Transaction().cursor
+
+        cursor.execute('DELETE FROM "' + Line._table + '" '
+            'WHERE batch = %s', (batch.id,))
+        cursor.execute('INSERT INTO "' + Line._table + '" '
+                '(create_uid, create_date, batch, payment_detail, employee, '
+                    'bank_code, bank_branch_code, bank_account_name, state) '
+            'SELECT %s, %s, %s, d.id, d.employee, '
+                'd.bank_code, d.bank_branch_code, d.bank_account_name, %s '
+            'FROM "' + PaymentDetail._table + '" AS d '
+            'JOIN "' + Employee._table + '" AS e ON e.id = d.employee '
+            'WHERE d.active = %s '
+                'AND d.payment_mode = %s '
+                'AND e.company = %s '
+                'AND (d.payment_date IS NULL '
+                    'OR (d.payment_date >= %s AND d.payment_date <= %s))',
+            (Transaction().user, datetime.datetime.now(), batch.id, 'sent',
+                True, 'bank', batch.company.id,
+                batch.period.start_date, batch.period.end_date))
+
+    @classmethod
+    def _iter_lines(cls, batch, size=1000):
+        """
+        Yield the lines of the batch as tuples ordered by bank and branch
+        without instantiating them.
+        """
+        pool = Pool()
+        Line = pool.get('company.employee.payment_batch.line')
+        Employee = pool.get('company.employee')
+        cursor = Transaction().cursor
+
+        cursor.execute('SELECT l.bank_code, l.bank_branch_code, '
+                'e.employee_id, l.bank_account_name, l.id '
+            'FROM "' + Line._table + '" AS l '
+            'JOIN "' + Employee._table + '" AS e ON e.id = l.employee '
+            'WHERE l.batch = %s '
+            'ORDER BY l.bank_code, l.bank_branch_code, l.id', (batch.id,))
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    @classmethod
+    def write_bank_file(cls, batch, fileobj):
+        """
+        Stream the bank transfer file of the batch to fileobj.
+
+        The payees are grouped by bank and branch. Each group starts with a
+        header record (H) and ends with a trailer record (T) holding the
+        number of payees of the group. The detail records (D) end with the
+        id of the line as the reference which the bank quotes on returns.
+        """
+        payment_date = batch.payment_date.strftime('%Y%m%d')
+        if batch.layout == 'csv':
+            writer = csv.writer(fileobj)
+            write = lambda values: writer.writerow([
+                    (v or '').encode('utf-8') for v in values])
+        else:
+            def write(values):
+                fileobj.write(''.join(
+                        (v or '').encode('utf-8')[:width].ljust(width)
+                        for v, (_, width) in zip(values, FIXED_WIDTHS)))
+                fileobj.write('\r\n')
+
+        group, count = None, 0
+        for bank_code, branch_code, employee_id, account_name, line_id \
+                in cls._iter_lines(batch):
+            if (bank_code, branch_code) != group:
+                if group is not None:
+                    write(['T', group[0], group[1], str(count)])
+                group, count = (bank_code, branch_code), 0
+                write(['H', bank_code, branch_code, batch.name])
+            write(['D', bank_code, branch_code, employee_id, account_name,
+                    payment_date, str(line_id)])
+            count += 1
+        if group is not None:
+            write(['T', group[0], group[1], str(count)])
+
+    @classmethod
+    @profiled
+    def import_returns(cls, batch, data):
+        """
+        Reconcile the payments returned by the bank, with one update of the
+        lines and one of the payment details per chunk of returns.
+
+        :param data: CSV content with one return per line as
+            reference,return_date (YYYY-MM-DD),return_reason
+            where the reference is the one of the detail record
+        """
+        pool = Pool()
+        Line = pool.get('company.employee.payment_batch.line')
+        PaymentDetail = pool.get('company.employee.payment_detail')
+        cursor = Transaction().cursor
+
+        returns = {}
+        for lineno, row in enumerate(csv.reader(StringIO(data)), 1):
+            if not row:
+                continue
+            try:
+                reference, return_date, reason = row[:3]
+                line_id = int(reference)
+                return_date = datetime.datetime.strptime(
+                    return_date.strip(), '%Y-%m-%d').date()
+            except ValueError, exception:
+                cls.raise_user_error('invalid_return',
+                    (lineno, str(exception)))
+            returns[line_id] = (return_date, reason.strip().decode('utf-8'))
+
+        line_ids = returns.keys()
+        user, now = Transaction().user, datetime.datetime.now()
+        updates = []
+        for i in range(0, len(line_ids), cursor.IN_MAX):
+            red_sql, red_ids = reduce_ids('id', line_ids[i:i + cursor.IN_MAX])
+            cursor.execute('SELECT id, payment_detail '
+                'FROM "' + Line._table + '" '
+                'WHERE batch = %s AND ' + red_sql, [batch.id] + red_ids)
+            sub_updates = [(line_id, detail_id) + returns[line_id]
+                for line_id, detail_id in cursor.fetchall()]
+            if not sub_updates:
+                continue
+            updates.extend(sub_updates)
+
+            cases = ' '.join(['WHEN %s THEN %s'] * len(sub_updates))
+            dates = [x for u in sub_updates for x in (u[0], u[2])]
+            reasons = [x for u in sub_updates for x in (u[0], u[3])]
+            red_sql, red_ids = reduce_ids('id', [u[0] for u in sub_updates])
+            cursor.execute('UPDATE "' + Line._table + '" '
+                'SET state = %s, '
+                    'return_date = CASE id ' + cases + ' END, '
+                    'return_reason = CASE id ' + cases + ' END, '
+                    'write_uid = %s, write_date = %s '
+                'WHERE ' + red_sql,
+                ['returned'] + dates + reasons + [user, now] + red_ids)
+
+            dates = [x for u in sub_updates for x in (u[1], u[2])]
+            reasons = [x for u in sub_updates for x in (u[1], u[3])]
+            red_sql, red_ids = reduce_ids('id', [u[1] for u in sub_updates])
+            cursor.execute('UPDATE "' + PaymentDetail._table + '" '
+                'SET return_date = CASE id ' + cases + ' END, '
+                    'return_reason = CASE id ' + cases + ' END, '
+                    'write_uid = %s, write_date = %s '
+                'WHERE ' + red_sql,
+                dates + reasons + [user, now] + red_ids)
+        return len(updates)
+
+
+class PaymentBatchLine(ModelSQL, ModelView):
+    "Employee Payment Batch Line"
+    __name__ = 'company.employee.payment_batch.line'
+    _rec_name = 'employee'
+
+    batch = fields.Many2One(
+        'company.employee.payment_batch', 'Batch', required=True,
+        select=True, ondelete='CASCADE', readonly=True
+    )
+    payment_detail = fields.Many2One(
+        'company.employee.payment_detail', 'Payment Detail', required=True,
+        readonly=True
+    )
+    employee = fields.Many2One(
+        'company.employee', 'Employee', required=True, readonly=True
+    )
+    bank_code = fields.Char('Bank Code', readonly=True)
+    bank_branch_code = fields.Char('Bank Branch Code', readonly=True)
+    bank_account_name = fields.Char('Bank Account Name', readonly=True)
+    state = fields.Selection([
+        ('sent', 'Sent'),
+        ('returned', 'Returned'),
+    ], 'State', required=True, readonly=True)
+    return_date = fields.Date('Return Date', readonly=True)
+    return_reason = fields.Char('Return Reason', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(PaymentBatchLine, cls).__setup__()
+        cls._order.insert(0, ('bank_code', 'ASC'))
+        cls._order.insert(1, ('bank_branch_code', 'ASC'))
+
+    @staticmethod
+    def default_state():
+        return 'sent'
+
+
+class ImportReturnsStart(ModelView):
+    "Import Payment Returns"
+    __name__ = 'company.employee.payment_batch.import_returns.start'
+
+    file = fields.Binary('File', required=True)
+
+
+class ImportReturns(Wizard):
+    "Import Payment Returns"
+    __name__ = 'company.employee.payment_batch.import_returns'
+
+    start = StateView(
+        'company.employee.payment_batch.import_returns.start',
+        'hr.payment_batch_import_returns_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Import', 'import_', 'tryton-ok', default=True),
+        ]
+    )
+    import_ = StateTransition()
+
+    def transition_import_(self):
+        Batch = Pool().get('company.employee.payment_batch')
+
+        batch = Batch(Transaction().context['active_id'])
+        Batch.import_returns(batch, str(self.start.file))
+        return 'end'
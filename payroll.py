@@ -5,14 +5,43 @@
     :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+import datetime
+from bisect import bisect_right
+
 from dateutil.relativedelta import relativedelta
 from trytond.model import ModelView, ModelSQL, fields
-from trytond.tools import datetime_strftime
+from trytond.wizard import Wizard, StateView, StateTransition, Button
+from trytond.tools import datetime_strftime, reduce_ids
 from trytond.pyson import Eval, If
 from trytond.transaction import Transaction
 from trytond.pool import Pool
+from trytond.config import CONFIG
+from trytond.cache import Cache
+
+from .bulk import bulk_insert
+from .profiling import profiled
+
+__all__ = ['PayrollYear', 'PayrollPeriod', 'PayrollHoliday',
+    'RolloverStart', 'Rollover']
 
-__all__ = ['PayrollYear', 'PayrollPeriod', 'PayrollHoliday']
+
+def period_dates(start_date, end_date, interval=1):
+    """
+    Yield the name, start and end dates of the periods of interval months
+    between start_date and end_date
+    """
+    period_start_date = start_date
+    while period_start_date < end_date:
+        period_end_date = period_start_date + \
+                relativedelta(months=interval - 1) + \
+                relativedelta(day=31)
+        if period_end_date > end_date:
+            period_end_date = end_date
+        name = datetime_strftime(period_start_date, '%Y-%m')
+        if name != datetime_strftime(period_end_date, '%Y-%m'):
+            name += ' - ' + datetime_strftime(period_end_date, '%Y-%m')
+        yield name, period_start_date, period_end_date
+        period_start_date = period_end_date + relativedelta(days=1)
 
 
 STATES = {
@@ -45,11 +74,15 @@ class PayrollYear(ModelSQL, ModelView):
             ], select=True, states=STATES, depends=DEPENDS
         )
     department = fields.Many2One(
-        'company.department', 'Department', required=True, select=True,
+        'company.department', 'Department', select=True,
         domain=[('company', '=', Eval('company'))],
-        states=STATES, depends=DEPENDS
+        states=STATES, depends=DEPENDS + ['company'],
+        help='Leave empty for the company calendar which is followed by '
+        'the departments without their own year'
     )
 
+    _calendar_cache = Cache('payroll.year.calendar', context=False)
+
     @staticmethod
     def default_state():
         return 'open'
@@ -58,6 +91,85 @@ class PayrollYear(ModelSQL, ModelView):
     def default_company():
         return Transaction().context.get('company')
 
+    @classmethod
+    def create(cls, values):
+        cls._calendar_cache.clear()
+        return super(PayrollYear, cls).create(values)
+
+    @classmethod
+    def write(cls, payrollyears, values):
+        cls._calendar_cache.clear()
+        super(PayrollYear, cls).write(payrollyears, values)
+
+    @classmethod
+    def delete(cls, payrollyears):
+        cls._calendar_cache.clear()
+        super(PayrollYear, cls).delete(payrollyears)
+
+    @classmethod
+    def department_years(cls):
+        """
+        Return the SQL selecting the department and year of the payroll
+        years followed by every department: its own years and the years of
+        the company calendar which none of its own years overlap.
+        """
+        Department = Pool().get('company.department')
+        return ('SELECT d.id AS department, y.id AS year '
+            'FROM "' + Department._table + '" AS d '
+            'JOIN "' + cls._table + '" AS y ON y.company = d.company '
+                'AND (y.department = d.id '
+                    'OR (y.department IS NULL '
+                        'AND NOT EXISTS (SELECT 1 '
+                            'FROM "' + cls._table + '" AS o '
+                            'WHERE o.department = d.id '
+                                'AND o.start_date <= y.end_date '
+                                'AND o.end_date >= y.start_date)))')
+
+    @classmethod
+    def _calendar(cls, department):
+        """
+        Return the years and the periods followed by the department as two
+        lists of (start date, end date, id, state) ordered by start date.
+
+        The calendars are cached per database and department.
+        """
+        Period = Pool().get('payroll.period')
+        cursor = Transaction().cursor
+
+        key = (cursor.database_name, department)
+        calendar = cls._calendar_cache.get(key)
+        if calendar is None:
+            calendar = []
+            for table, column in ((cls._table, 'id'),
+                    (Period._table, 'payroll_year')):
+                cursor.execute('SELECT r.start_date, r.end_date, r.id, '
+                        'r.state '
+                    'FROM (' + cls.department_years() + ') AS dy '
+                    'JOIN "' + table + '" AS r ON r.' + column + ' = dy.year '
+                    'WHERE dy.department = %s '
+                    'ORDER BY r.start_date', (department,))
+                calendar.append(cursor.fetchall())
+            cls._calendar_cache.set(key, calendar)
+        return calendar
+
+    @staticmethod
+    def _find(rows, date, state):
+        index = bisect_right([r[0] for r in rows], date) - 1
+        if index >= 0:
+            _, end_date, id_, row_state = rows[index]
+            if end_date >= date and state in (None, row_state):
+                return id_
+        return None
+
+    @classmethod
+    def find(cls, department, date, state=None):
+        """
+        Return the id of the payroll year of the department at the date,
+        optionally in the given state, or None
+        """
+        years, _ = cls._calendar(department)
+        return cls._find(years, date, state)
+
     @classmethod
     def __setup__(cls):
         super(PayrollYear, cls).__setup__()
@@ -68,6 +180,8 @@ class PayrollYear(ModelSQL, ModelView):
         cls._error_messages.update({
             'payrollyear_overlaps': \
                 'You can not have 2 payroll years that overlap!',
+            'rollover_overlaps': 'The new payroll years overlap the '
+                'year "%s"!',
         })
         cls._buttons.update({
             'create_period': {
@@ -84,6 +198,7 @@ class PayrollYear(ModelSQL, ModelView):
 
     @classmethod
     @ModelView.button
+    @profiled
     def close(cls, payrollyears):
         '''
         Close a payroll year
@@ -95,12 +210,14 @@ class PayrollYear(ModelSQL, ModelView):
 
     @classmethod
     @ModelView.button
+    @profiled
     def reopen(cls, payrollyears):
         '''
         Reopen a payroll year
         '''
         cls.write(payrollyears, {'state': 'open'})
 
+    @profiled
     def check_dates(self):
         cursor = Transaction().cursor
         cursor.execute('SELECT id ' \
@@ -109,41 +226,159 @@ class PayrollYear(ModelSQL, ModelView):
                     'OR (start_date <= %s AND end_date >= %s) ' \
                     'OR (start_date >= %s AND end_date <= %s)) ' \
                 'AND company = %s ' \
+                'AND ' + ('department = %s ' if self.department
+                    else 'department IS NULL ') + \
                 'AND id != %s',
             (self.start_date, self.start_date,
                 self.end_date, self.end_date,
                 self.start_date, self.end_date,
-                self.company.id, self.id))
+                self.company.id)
+            + ((self.department.id,) if self.department else ())
+            + (self.id,))
         if cursor.fetchone():
             return False
         return True
 
     @classmethod
     @ModelView.button
+    @profiled
     def create_period(cls, payrollyears, interval=1):
         '''
         Create periods for the payroll years with month interval
         '''
         Period = Pool().get('payroll.period')
         for payrollyear in payrollyears:
-            period_start_date = payrollyear.start_date
-            while period_start_date < payrollyear.end_date:
-                period_end_date = period_start_date + \
-                        relativedelta(months=interval - 1) + \
-                        relativedelta(day=31)
-                if period_end_date > payrollyear.end_date:
-                    period_end_date = payrollyear.end_date
-                name = datetime_strftime(period_start_date, '%Y-%m')
-                if name != datetime_strftime(period_end_date, '%Y-%m'):
-                    name += ' - ' + datetime_strftime(period_end_date, '%Y-%m')
+            for name, start_date, end_date in period_dates(
+                    payrollyear.start_date, payrollyear.end_date, interval):
                 Period.create({
                     'name': name,
-                    'start_date': period_start_date,
-                    'department': payrollyear.department.id,
-                    'end_date': period_end_date,
+                    'start_date': start_date,
+                    'department': (payrollyear.department.id
+                        if payrollyear.department else None),
+                    'end_date': end_date,
                     'payroll_year': payrollyear.id,
                     })
-                period_start_date = period_end_date + relativedelta(days=1)
+
+    @classmethod
+    @profiled
+    def rollover(cls, company, name, start_date, end_date, interval=1):
+        """
+        Close the open payroll years of the company which end before
+        start_date and create the year from start_date to end_date with its
+        periods of interval months in the company calendar and for every
+        active department which had its own year the year before. The
+        recurring holidays of the year before are shifted by one year into
+        the new periods.
+
+        Each step is a single query whatever the number of departments. The
+        years are inserted in one statement which gives their ids, so that
+        the periods and holidays only go to the years created by this call.
+        Return the number of years created.
+        """
+        pool = Pool()
+        Department = pool.get('company.department')
+        Period = pool.get('payroll.period')
+        Holiday = pool.get('payroll.holiday')
+        transaction = Transaction()
+        cursor = transaction.cursor
+        stamp = (transaction.user, datetime.datetime.now())
+
+        previous_date = start_date - relativedelta(years=1)
+        cursor.execute('SELECT name FROM "' + cls._table + '" '
+            'WHERE company = %s '
+                'AND start_date <= %s AND end_date >= %s '
+                'AND start_date < %s',
+            (company, end_date, start_date, start_date))
+        overlap = cursor.fetchone()
+        if overlap:
+            cls.raise_user_error('rollover_overlaps', overlap)
+
+        cursor.execute('UPDATE "' + Period._table + '" '
+            'SET state = %s, write_uid = %s, write_date = %s '
+            'WHERE state = %s AND payroll_year IN ('
+                'SELECT id FROM "' + cls._table + '" '
+                'WHERE company = %s AND end_date < %s)',
+            ('close',) + stamp + ('open', company, start_date))
+        cursor.execute('UPDATE "' + cls._table + '" '
+            'SET state = %s, write_uid = %s, write_date = %s '
+            'WHERE state = %s AND company = %s AND end_date < %s',
+            ('close',) + stamp + ('open', company, start_date))
+
+        # The calendars which already have this year are skipped
+        cursor.execute('SELECT NULL '
+            'WHERE NOT EXISTS (SELECT 1 FROM "' + cls._table + '" AS y '
+                'WHERE y.company = %s AND y.department IS NULL '
+                    'AND y.start_date <= %s AND y.end_date >= %s)',
+            (company, end_date, start_date))
+        departments = [x[0] for x in cursor.fetchall()]
+        cursor.execute('SELECT d.id '
+            'FROM "' + Department._table + '" AS d '
+            'WHERE d.company = %s AND d.active = %s '
+                'AND EXISTS (SELECT 1 FROM "' + cls._table + '" AS o '
+                    'WHERE o.department = d.id '
+                        'AND o.end_date >= %s AND o.end_date < %s) '
+                'AND NOT EXISTS (SELECT 1 FROM "' + cls._table + '" AS y '
+                    'WHERE y.department = d.id '
+                        'AND y.start_date <= %s AND y.end_date >= %s)',
+            (company, True, previous_date, start_date, end_date, start_date))
+        departments += [x[0] for x in cursor.fetchall()]
+        year_ids = bulk_insert(cls._table,
+            ['name', 'start_date', 'end_date', 'state', 'company',
+                'department'],
+            [(name, start_date, end_date, 'open', company, department)
+                for department in departments])
+        count = len(year_ids)
+
+        periods = list(period_dates(start_date, end_date, interval))
+        if count and periods:
+            red_sql, red_ids = reduce_ids('y.id', year_ids)
+            if CONFIG['db_type'] == 'sqlite':
+                # SQLite stores the dates as text
+                value = 'SELECT %s AS name, %s AS start_date, %s AS end_date'
+            else:
+                value = ('SELECT CAST(%s AS VARCHAR) AS name, '
+                    'CAST(%s AS DATE) AS start_date, '
+                    'CAST(%s AS DATE) AS end_date')
+            values = ' UNION ALL '.join((value,) * len(periods))
+            cursor.execute('INSERT INTO "' + Period._table + '" '
+                    '(create_uid, create_date, name, start_date, end_date, '
+                        'state, department, payroll_year) '
+                'SELECT %s, %s, v.name, v.start_date, v.end_date, %s, '
+                    'y.department, y.id '
+                'FROM "' + cls._table + '" AS y, (' + values + ') AS v '
+                'WHERE ' + red_sql,
+                stamp + ('open',) + sum(periods, ()) + tuple(red_ids))
+
+            # The 29th of February becomes the 28th, like relativedelta
+            if CONFIG['db_type'] == 'sqlite':
+                shifted = ("CASE WHEN strftime('%m-%d', h.date) = '02-29' "
+                    "THEN date(h.date, '-1 day', '+1 year') "
+                    "ELSE date(h.date, '+1 year') END")
+            else:
+                shifted = "CAST(h.date + INTERVAL '1 year' AS DATE)"
+            cursor.execute('INSERT INTO "' + Holiday._table + '" '
+                    '(create_uid, create_date, period, date, recurring) '
+                'SELECT %s, %s, np.id, ' + shifted + ', %s '
+                'FROM "' + Holiday._table + '" AS h '
+                'JOIN "' + Period._table + '" AS op ON op.id = h.period '
+                'JOIN "' + cls._table + '" AS oy '
+                    'ON oy.id = op.payroll_year '
+                'JOIN "' + cls._table + '" AS y '
+                    'ON COALESCE(y.department, 0) '
+                        '= COALESCE(oy.department, 0) '
+                'JOIN "' + Period._table + '" AS np '
+                    'ON np.payroll_year = y.id '
+                'WHERE h.recurring = %s '
+                    'AND h.date >= %s AND h.date < %s '
+                    'AND oy.company = %s '
+                    'AND ' + red_sql + ' '
+                    'AND ' + shifted + ' >= np.start_date '
+                    'AND ' + shifted + ' <= np.end_date',
+                stamp + (True, True, previous_date, start_date, company)
+                + tuple(red_ids))
+
+        cls._calendar_cache.clear()
+        return count
 
 
 class PayrollPeriod(ModelSQL, ModelView):
@@ -155,7 +390,7 @@ class PayrollPeriod(ModelSQL, ModelView):
         states=STATES, depends=DEPENDS
     )
     department = fields.Many2One(
-        'company.department', 'Department', required=True, select=True,
+        'company.department', 'Department', select=True,
         states=STATES, depends=DEPENDS
     )
     start_date = fields.Date('Start Date', required=True,
@@ -171,11 +406,49 @@ class PayrollPeriod(ModelSQL, ModelView):
         ('open', 'Open'),
         ('close', 'Close')
     ], 'State', readonly=True, select=True, required=True)
+    absences_date = fields.Date('Absences Detected Until', readonly=True)
 
     @staticmethod
     def default_state():
         return 'open'
 
+    @classmethod
+    def create(cls, values):
+        Pool().get('payroll.year')._calendar_cache.clear()
+        return super(PayrollPeriod, cls).create(values)
+
+    @classmethod
+    def write(cls, periods, values):
+        Pool().get('payroll.year')._calendar_cache.clear()
+        super(PayrollPeriod, cls).write(periods, values)
+
+    @classmethod
+    def delete(cls, periods):
+        Pool().get('payroll.year')._calendar_cache.clear()
+        super(PayrollPeriod, cls).delete(periods)
+
+    @classmethod
+    def find(cls, department, date, state=None):
+        """
+        Return the id of the payroll period of the department at the date,
+        optionally in the given state, or None
+
+        The lookup is a bisection in the cached calendar of the department.
+        """
+        PayrollYear = Pool().get('payroll.year')
+        _, periods = PayrollYear._calendar(department)
+        return PayrollYear._find(periods, date, state)
+
+    def departments_query(self):
+        """
+        Return the SQL selecting the ids of the departments which follow the
+        period and its parameters
+        """
+        PayrollYear = Pool().get('payroll.year')
+        return ('SELECT dy.department '
+            'FROM (' + PayrollYear.department_years() + ') AS dy '
+            'WHERE dy.year = %s', [self.payroll_year.id])
+
     @classmethod
     def __setup__(cls):
         super(PayrollPeriod, cls).__setup__()
@@ -197,6 +470,7 @@ class PayrollPeriod(ModelSQL, ModelView):
 
     @classmethod
     @ModelView.button
+    @profiled
     def close(cls, periods):
         '''
         Close a payroll year
@@ -205,6 +479,7 @@ class PayrollPeriod(ModelSQL, ModelView):
 
     @classmethod
     @ModelView.button
+    @profiled
     def reopen(cls, periods):
         '''
         Reopen a payroll year
@@ -215,6 +490,7 @@ class PayrollPeriod(ModelSQL, ModelView):
             PayrollYear.write([period.payroll_year], {'state': 'open'})
 
 
+    @profiled
     def check_dates(self):
         cursor = Transaction().cursor
         cursor.execute('SELECT id ' \
@@ -239,6 +515,9 @@ class PayrollHoliday(ModelSQL, ModelView):
         'payroll.period', 'Payroll Period', required=True
     )
     date = fields.Date('Date', required=True, select=True, depends=['period'])
+    recurring = fields.Boolean('Recurring',
+        help='Repeat the holiday on the same date when the payroll year is '
+        'rolled over')
 
     @classmethod
     def __setup__(cls):
@@ -251,9 +530,83 @@ class PayrollHoliday(ModelSQL, ModelView):
                 'The date must be between start and end date of period',
         })
 
+    @staticmethod
+    def default_recurring():
+        return False
+
+    @profiled
     def check_date(self):
         'Check if the date is between start and end date of period'
         if self.date < self.period.start_date or \
                 self.date > self.period.end_date:
             return False
         return True
+
+
+class RolloverStart(ModelView):
+    "Payroll Year Rollover"
+    __name__ = 'payroll.year.rollover.start'
+
+    company = fields.Many2One('company.company', 'Company', required=True)
+    name = fields.Char('Name', required=True)
+    start_date = fields.Date('Start Date', required=True)
+    end_date = fields.Date('End Date', required=True)
+    interval = fields.Integer('Period Interval (months)', required=True)
+
+    @staticmethod
+    def default_company():
+        return Transaction().context.get('company')
+
+    @staticmethod
+    def default_interval():
+        return 1
+
+    @staticmethod
+    def _last_end_date():
+        PayrollYear = Pool().get('payroll.year')
+        years = PayrollYear.search([
+                ('company', '=', Transaction().context.get('company')),
+                ], order=[('end_date', 'DESC')], limit=1)
+        return years[0].end_date if years else None
+
+    @classmethod
+    def default_start_date(cls):
+        end_date = cls._last_end_date()
+        if end_date:
+            return end_date + relativedelta(days=1)
+
+    @classmethod
+    def default_end_date(cls):
+        end_date = cls._last_end_date()
+        if end_date:
+            return end_date + relativedelta(years=1)
+
+    @classmethod
+    def default_name(cls):
+        end_date = cls._last_end_date()
+        if end_date:
+            start_date = end_date + relativedelta(days=1)
+            end_date += relativedelta(years=1)
+            if start_date.year == end_date.year:
+                return str(start_date.year)
+            return '%s-%s' % (start_date.year, end_date.year)
+
+
+class Rollover(Wizard):
+    "Payroll Year Rollover"
+    __name__ = 'payroll.year.rollover'
+
+    start = StateView('payroll.year.rollover.start',
+        'hr.payroll_year_rollover_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Rollover', 'rollover', 'tryton-ok', default=True),
+        ]
+    )
+    rollover = StateTransition()
+
+    def transition_rollover(self):
+        PayrollYear = Pool().get('payroll.year')
+        PayrollYear.rollover(self.start.company.id, self.start.name,
+            self.start.start_date, self.start.end_date,
+            self.start.interval)
+        return 'end'
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+    Profiling
+
+    Opt-in instrumentation of the getters, buttons and constraints of the
+    module. It is enabled for a request by setting `hr_profile` in the
+    context; each decorated call then records its number of SQL queries,
+    the number of rows fetched and its wall time.
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import logging
+import threading
+import time
+from functools import wraps
+
+from trytond.model import ModelView
+from trytond.transaction import Transaction
+from trytond.rpc import RPC
+
+__all__ = ['Profile', 'profiled']
+
+logger = logging.getLogger('hr.profile')
+
+# {database: {name: [calls, queries, rows, seconds]}}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class _CursorCounter(object):
+    """
+    Count the queries and fetched rows of a cursor by shadowing its methods
+    with instance attributes, which are removed by uninstall.
+    """
+    methods = ('execute', 'fetchone', 'fetchmany', 'fetchall')
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.queries = 0
+        self.rows = 0
+        self.depth = 0
+
+    def install(self):
+        cursor = self.cursor
+        execute = cursor.execute
+        fetchone = cursor.fetchone
+        fetchmany = cursor.fetchmany
+        fetchall = cursor.fetchall
+
+        def counting_execute(*args, **kwargs):
+            self.queries += 1
+            return execute(*args, **kwargs)
+
+        def counting_fetchone(*args, **kwargs):
+            row = fetchone(*args, **kwargs)
+            if row is not None:
+                self.rows += 1
+            return row
+
+        def counting_fetchmany(*args, **kwargs):
+            rows = fetchmany(*args, **kwargs)
+            self.rows += len(rows)
+            return rows
+
+        def counting_fetchall(*args, **kwargs):
+            rows = fetchall(*args, **kwargs)
+            self.rows += len(rows)
+            return rows
+
+        cursor.execute = counting_execute
+        cursor.fetchone = counting_fetchone
+        cursor.fetchmany = counting_fetchmany
+        cursor.fetchall = counting_fetchall
+        cursor._hr_profile_counter = self
+
+    def uninstall(self):
+        for name in self.methods + ('_hr_profile_counter',):
+            delattr(self.cursor, name)
+
+
+def profiled(func):
+    """
+    Record the SQL queries, rows and wall time of the calls of func when
+    `hr_profile` is set in the context. The name of the measure is the model
+    name followed by the function name.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        transaction = Transaction()
+        if not transaction.context.get('hr_profile'):
+            return func(*args, **kwargs)
+
+        cursor = transaction.cursor
+        counter = getattr(cursor, '_hr_profile_counter', None)
+        if counter is None:
+            counter = _CursorCounter(cursor)
+            counter.install()
+        counter.depth += 1
+        queries, rows = counter.queries, counter.rows
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            counter.depth -= 1
+            if not counter.depth:
+                counter.uninstall()
+            name = '%s.%s' % (args[0].__name__, func.__name__)
+            _record(cursor.database_name, name,
+                counter.queries - queries, counter.rows - rows, elapsed)
+    return wrapper
+
+
+def _record(database, name, queries, rows, seconds):
+    with _stats_lock:
+        stat = _stats.setdefault(database, {}).setdefault(
+            name, [0, 0, 0, 0.0])
+        stat[0] += 1
+        stat[1] += queries
+        stat[2] += rows
+        stat[3] += seconds
+    logger.debug('%s %s: %s queries, %s rows, %.3fs',
+        database, name, queries, rows, seconds)
+
+
+class Profile(ModelView):
+    "HR Profile"
+    __name__ = 'hr.profile'
+
+    @classmethod
+    def __setup__(cls):
+        super(Profile, cls).__setup__()
+        cls.__rpc__.update({
+            'get_stats': RPC(),
+            'reset_stats': RPC(readonly=False),
+        })
+
+    @classmethod
+    def get_stats(cls):
+        """
+        Return the aggregates of the current database as a dictionary
+        mapping the measure name to its calls, queries, rows and seconds.
+        """
+        database = Transaction().cursor.database_name
+        with _stats_lock:
+            stats = _stats.get(database, {})
+            return dict((name, {
+                        'calls': calls,
+                        'queries': queries,
+                        'rows': rows,
+                        'seconds': seconds,
+                    }) for name, (calls, queries, rows, seconds)
+                in stats.iteritems())
+
+    @classmethod
+    def reset_stats(cls):
+        "Reset the aggregates of the current database"
+        database = Transaction().cursor.database_name
+        with _stats_lock:
+            _stats.pop(database, None)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+    Rollup
+
+    Headcount and proposed allowance totals of every department subtree,
+    maintained incrementally so that the dashboards read them directly.
+
+    The totals are rebuilt from scratch with::
+
+        python -m trytond.modules.hr.rollup -c trytond.conf -d database
+
+    :copyright: (c) 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import datetime
+from decimal import Decimal
+
+from trytond.model import ModelView, ModelSQL, fields
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.rpc import RPC
+
+from .profiling import profiled
+
+__all__ = ['DepartmentHeadcount', 'DepartmentAllowance']
+
+
+class RollupMixin(object):
+    """
+    Totals per department subtree of the records of _source grouped by the
+    _keys columns. Each row counts the records of the department and of all
+    its descendants in the _count field and sums their _source_amount
+    column in the _amount field.
+    """
+    _source = None
+    _department = None
+    _keys = []
+    _count = None
+    _amount = None
+    _source_amount = None
+
+    @classmethod
+    def __setup__(cls):
+        super(RollupMixin, cls).__setup__()
+        cls._sql_constraints += [
+            ('key_uniq', 'UNIQUE(department, %s)' % ', '.join(cls._keys),
+                'The totals of a department are unique per key'),
+        ]
+        cls.__rpc__.update({
+            'totals': RPC(),
+            'rebuild': RPC(readonly=False),
+        })
+
+    @classmethod
+    def _columns(cls):
+        return cls._keys + [cls._count] + (
+            [cls._amount] if cls._amount else [])
+
+    @classmethod
+    def collect(cls, ids):
+        """
+        Return the number and the amount of the records of _source with the
+        given ids as a dictionary keyed by (department,) + _keys
+        """
+        Source = Pool().get(cls._source)
+        cursor = Transaction().cursor
+
+        columns = [cls._department] + cls._keys + (
+            [cls._source_amount] if cls._source_amount else [])
+        result = {}
+        for i in range(0, len(ids), cursor.IN_MAX):
+            red_sql, red_ids = reduce_ids('id', ids[i:i + cursor.IN_MAX])
+            cursor.execute('SELECT '
+                    + ', '.join('"%s"' % c for c in columns) + ' '
+                'FROM "' + Source._table + '" WHERE ' + red_sql, red_ids)
+            for row in cursor.fetchall():
+                key = row[:len(cls._keys) + 1]
+                value = Decimal(str(row[-1] or 0)) if cls._source_amount \
+                    else Decimal(0)
+                if key[0] is None:
+                    continue
+                count, total = result.get(key, (0, Decimal(0)))
+                result[key] = (count + 1, total + value)
+        return result
+
+    @classmethod
+    def apply(cls, before, after):
+        """
+        Move the totals from the before to the after results of collect in
+        the rows of the departments and of all their ancestors
+        """
+        Department = Pool().get('company.department')
+        transaction = Transaction()
+        cursor = transaction.cursor
+
+        deltas = {}
+        for sign, values in ((-1, before), (1, after)):
+            for key, (count, amount) in values.iteritems():
+                delta = deltas.get(key, (0, Decimal(0)))
+                deltas[key] = (delta[0] + sign * count,
+                    delta[1] + sign * amount)
+        deltas = dict((k, v) for k, v in deltas.iteritems() if any(v))
+        if not deltas:
+            return
+
+        ancestors = {}
+        origins = list(set(key[0] for key in deltas))
+        for i in range(0, len(origins), cursor.IN_MAX):
+            red_sql, red_ids = reduce_ids('id', origins[i:i + cursor.IN_MAX])
+            cursor.execute('SELECT origin, id FROM ('
+                + Department.ancestors_query(red_sql)
+                + 'SELECT origin, id FROM ancestors) AS a', red_ids)
+            for origin, id_ in cursor.fetchall():
+                ancestors.setdefault(origin, []).append(id_)
+        totals = {}
+        for key, (count, amount) in deltas.iteritems():
+            for department in ancestors.get(key[0], [key[0]]):
+                total = totals.get((department,) + key[1:], (0, Decimal(0)))
+                totals[(department,) + key[1:]] = (total[0] + count,
+                    total[1] + amount)
+
+        where = ' AND '.join('"%s" = %%s' % c
+            for c in ['department'] + cls._keys)
+        columns = ['department'] + cls._columns()
+        insert = ('INSERT INTO "' + cls._table + '" '
+                '(create_uid, create_date, '
+                + ', '.join('"%s"' % c for c in columns) + ') '
+            'SELECT %s, %s, '
+                + ', '.join(['%s'] * (len(cls._keys) + 1)
+                    + ['0'] * (len(columns) - len(cls._keys) - 1)) + ' '
+            'WHERE NOT EXISTS (SELECT 1 FROM "' + cls._table + '" '
+                'WHERE ' + where + ')')
+        updates = ['"%s" = "%s" + %%s' % (cls._count, cls._count)]
+        if cls._amount:
+            updates.append('"%s" = "%s" + %%s' % (cls._amount, cls._amount))
+        update = ('UPDATE "' + cls._table + '" '
+            'SET ' + ', '.join(updates) + ', write_uid = %s, '
+                'write_date = %s '
+            'WHERE ' + where)
+        now = datetime.datetime.now()
+        for key, (count, amount) in totals.iteritems():
+            cursor.execute(insert, (transaction.user, now) + key + key)
+            cursor.execute(update, (count,)
+                + ((amount,) if cls._amount else ())
+                + (transaction.user, now) + key)
+
+    @classmethod
+    def own_totals(cls, departments):
+        """
+        Return the totals of the departments without those of their
+        children, keyed like the result of collect
+        """
+        Department = Pool().get('company.department')
+        cursor = Transaction().cursor
+
+        columns = ', '.join('t."%s"' % c for c in cls._keys + [cls._count]
+            + ([cls._amount] if cls._amount else []))
+        result = {}
+        for i in range(0, len(departments), cursor.IN_MAX):
+            sub_ids = departments[i:i + cursor.IN_MAX]
+            # The rows of the children are subtracted from their parent
+            for sign, department in ((1, 't.department'), (-1, 'd.parent')):
+                red_sql, red_ids = reduce_ids(department, sub_ids)
+                cursor.execute('SELECT ' + department + ', ' + columns + ' '
+                    'FROM "' + cls._table + '" AS t '
+                    'JOIN "' + Department._table + '" AS d '
+                        'ON d.id = t.department '
+                    'WHERE ' + red_sql, red_ids)
+                for row in cursor.fetchall():
+                    key = row[:len(cls._keys) + 1]
+                    count = row[len(cls._keys) + 1]
+                    amount = Decimal(str(row[-1] or 0)) if cls._amount \
+                        else Decimal(0)
+                    total = result.get(key, (0, Decimal(0)))
+                    result[key] = (total[0] + sign * count,
+                        total[1] + sign * amount)
+        return dict((k, v) for k, v in result.iteritems() if any(v))
+
+    @classmethod
+    @profiled
+    def rebuild(cls):
+        "Recompute all the totals from _source with a single aggregate"
+        pool = Pool()
+        Department = pool.get('company.department')
+        Source = pool.get(cls._source)
+        transaction = Transaction()
+        cursor = transaction.cursor
+
+        cursor.execute('DELETE FROM "' + cls._table + '"')
+        cursor.execute('INSERT INTO "' + cls._table + '" '
+                '(create_uid, create_date, department, '
+                + ', '.join('"%s"' % c for c in cls._columns()) + ') '
+            + Department.ancestors_query() +
+            'SELECT %s, %s, a.id, '
+                + ''.join('s."%s", ' % k for k in cls._keys)
+                + 'COUNT(*)'
+                + (', SUM(s."%s")' % cls._source_amount
+                    if cls._source_amount else '') + ' '
+            'FROM ancestors AS a '
+            'JOIN "' + Source._table + '" AS s '
+                'ON s."' + cls._department + '" = a.origin '
+            'GROUP BY a.id'
+                + ''.join(', s."%s"' % k for k in cls._keys),
+            (transaction.user, datetime.datetime.now()))
+
+    @classmethod
+    def totals(cls, department):
+        """
+        Return the totals of the subtree of the department as a list of
+        dictionaries with the _keys and the totals
+        """
+        cursor = Transaction().cursor
+        columns = cls._columns()
+        cursor.execute('SELECT ' + ', '.join('"%s"' % c for c in columns) + ' '
+            'FROM "' + cls._table + '" WHERE department = %s',
+            (department,))
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class DepartmentHeadcount(RollupMixin, ModelSQL, ModelView):
+    "Department Headcount"
+    __name__ = 'company.department.headcount'
+    _rec_name = 'department'
+    _source = 'company.employee'
+    _department = 'department'
+    _keys = ['state', 'type', 'sex']
+    _count = 'headcount'
+
+    department = fields.Many2One('company.department', 'Department',
+        required=True, select=True, readonly=True, ondelete='CASCADE')
+    state = fields.Selection([
+            ('current', 'Current'),
+            ('retired', 'Retired'),
+            ('closed', 'Closed'),
+        ], 'State', required=True, readonly=True)
+    type = fields.Selection([
+            ('probation', 'Probation'),
+            ('confirmed', 'Confirmed'),
+        ], 'Type', required=True, readonly=True)
+    sex = fields.Selection([
+            ('male', 'Male'),
+            ('female', 'Female'),
+        ], 'Sex', required=True, readonly=True)
+    headcount = fields.Integer('Headcount', readonly=True)
+
+
+class DepartmentAllowance(RollupMixin, ModelSQL, ModelView):
+    "Department Proposed Allowance"
+    __name__ = 'company.department.allowance'
+    _rec_name = 'department'
+    _source = 'employee.transfer.proposal'
+    _department = 'proposed_department'
+    _keys = ['state']
+    _count = 'proposals'
+    _amount = 'amount'
+    _source_amount = 'proposed_allowance'
+
+    department = fields.Many2One('company.department', 'Department',
+        required=True, select=True, readonly=True, ondelete='CASCADE')
+    state = fields.Selection([
+            ('Draft', 'Draft'),
+            ('In Review', 'In Review'),
+            ('Approved', 'Approved'),
+            ('Rejected', 'Rejected'),
+        ], 'State', required=True, readonly=True)
+    proposals = fields.Integer('Proposals', readonly=True)
+    amount = fields.Numeric('Amount', digits=(16, 2), readonly=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rebuild the department rollups')
+    parser.add_argument('-c', '--config', dest='config',
+        help='the trytond configuration file')
+    parser.add_argument('-d', '--database', dest='database', required=True)
+    options = parser.parse_args()
+
+    from trytond.config import CONFIG
+    if options.config:
+        CONFIG.update_etc(options.config)
+
+    Pool.start()
+    pool = Pool(options.database)
+    pool.init()
+    with Transaction().start(options.database, 0) as transaction:
+        for name in ('company.department.headcount',
+                'company.department.allowance'):
+            pool.get(name).rebuild()
+        transaction.cursor.commit()
+
+if __name__ == '__main__':
+    main()
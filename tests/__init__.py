@@ -12,11 +12,37 @@ import unittest
 import trytond.tests.test_tryton
 
 from .test_view_depends import TestViewDependsCase
+from .test_benchmark import TestBenchmarkCase
+from .test_approval_stress import TestApprovalStressCase
+from .test_payment import TestPaymentCase
+from .test_feed import TestFeedCase
+from .test_attendance import TestAttendanceCase
+from .test_onboarding import TestOnboardingCase
+from .test_directory import TestDirectoryCase
+from .test_document import TestDocumentCase
+from .test_payroll import TestPayrollCase
+from .test_party_history import TestPartyHistoryCase
+from .test_rollup import TestRollupCase
+from .test_leave import TestLeaveCase
+from .test_snapshot import TestSnapshotCase
 
 
 def suite():
     test_suite = trytond.tests.test_tryton.suite()
     test_suite.addTests([
-        unittest.TestLoader().loadTestsFromTestCase(TestViewDependsCase)
+        unittest.TestLoader().loadTestsFromTestCase(TestViewDependsCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestBenchmarkCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestApprovalStressCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestPaymentCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestFeedCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestAttendanceCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestOnboardingCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestDirectoryCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestDocumentCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestPayrollCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestPartyHistoryCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestRollupCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestLeaveCase),
+        unittest.TestLoader().loadTestsFromTestCase(TestSnapshotCase),
     ])
     return test_suite
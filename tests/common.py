@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    common
+
+    Records shared by the tests of the HR module
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import datetime
+
+from trytond.tests.test_tryton import POOL, USER
+
+
+def create_company():
+    '''
+    Create a company and make it the company of the test user
+    '''
+    Currency = POOL.get('currency.currency')
+    Company = POOL.get('company.company')
+    Party = POOL.get('party.party')
+    User = POOL.get('res.user')
+
+    currency = Currency.create({
+        'name': 'US Dollar',
+        'code': 'USD',
+        'symbol': '$',
+    })
+    company = Company.create({
+        'party': Party.create({'name': 'Openlabs'}).id,
+        'currency': currency.id,
+    })
+    User.write([User(USER)], {
+        'main_company': company.id,
+        'company': company.id,
+    })
+    return company
+
+
+def create_department(company, name='Department'):
+    Department = POOL.get('company.department')
+
+    return Department.create({
+        'name': name,
+        'company': company.id,
+    })
+
+
+def create_employee(company, department, name='Employee', **values):
+    '''
+    Create an employee with a party and an address
+    '''
+    Party = POOL.get('party.party')
+    Country = POOL.get('country.country')
+    Employee = POOL.get('company.employee')
+
+    countries = Country.search([('code', '=', 'IN')])
+    if countries:
+        country, = countries
+    else:
+        country = Country.create({'name': 'India', 'code': 'IN'})
+    party = Party.create({
+        'name': name,
+        'addresses': [('create', {'street': 'Street'})],
+    })
+    address = party.addresses[0]
+    employee_values = {
+        'party': party.id,
+        'company': company.id,
+        'department': department.id,
+        'first_name': name,
+        'last_name': 'Last',
+        'date_of_birth': datetime.date(1980, 1, 1),
+        'place_of_birth': 'Place',
+        'nationality': country.id,
+        'permanent_address': address.id,
+        'present_address': address.id,
+    }
+    employee_values.update(values)
+    return Employee.create(employee_values)
+
+
+def create_payroll_year(company, year, department=None):
+    '''
+    Create the payroll year with its periods
+    '''
+    PayrollYear = POOL.get('payroll.year')
+
+    payroll_year = PayrollYear.create({
+        'name': str(year),
+        'start_date': datetime.date(year, 1, 1),
+        'end_date': datetime.date(year, 12, 31),
+        'company': company.id,
+        'department': department.id if department else None,
+    })
+    PayrollYear.create_period([payroll_year])
+    return PayrollYear(payroll_year.id)
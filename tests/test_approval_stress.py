@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_approval_stress
+
+    Approve overlapping leave applications from many threads at once and
+    check that no attendance day is booked twice.
+
+    It needs a PostgreSQL test database, as SQLite serialises the writing
+    transactions. The load is set with the environment variables:
+
+        HR_STRESS_EMPLOYEES  (default 500)
+        HR_STRESS_THREADS    (default 8)
+
+    Every employee has two overlapping applications, which makes 1000
+    parallel approvals by default.
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import Queue
+import datetime
+import threading
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+from trytond.config import CONFIG
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+@unittest.skipIf(CONFIG['db_type'] != 'postgresql',
+    'The stress test needs PostgreSQL')
+class TestApprovalStressCase(unittest.TestCase):
+    '''
+    Approve leave applications concurrently
+    '''
+
+    employees = env_int('HR_STRESS_EMPLOYEES', 500)
+    threads = env_int('HR_STRESS_THREADS', 8)
+
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.created = []
+
+    def tearDown(self):
+        '''
+        Drop the committed records of the test
+        '''
+        if not self.created:
+            return
+        Attendance = POOL.get('employee.attendance')
+        Tombstone = POOL.get('hr.change.tombstone')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            employee_ids = dict(self.created)['company.employee']
+            records = [('employee.attendance', [a.id
+                        for a in Attendance.search([
+                                ('employee', 'in', employee_ids),
+                                ])])] + self.created[::-1]
+            for model_name, ids in records:
+                Model = POOL.get(model_name)
+                Model.delete(Model.browse(ids))
+                tombstones = Tombstone.search([
+                        ('model', '=', model_name),
+                        ('record', 'in', ids),
+                        ])
+                Tombstone.delete(tombstones)
+            transaction.cursor.commit()
+
+    def seed(self):
+        '''
+        Create the employees with two overlapping applications in review
+        and return the ids of the applications
+        '''
+        Currency = POOL.get('currency.currency')
+        Company = POOL.get('company.company')
+        Party = POOL.get('party.party')
+        Country = POOL.get('country.country')
+        Department = POOL.get('company.department')
+        Employee = POOL.get('company.employee')
+        LeaveType = POOL.get('employee.leave.type')
+        LeaveApplication = POOL.get('employee.leave.application')
+
+        currency = Currency.create({
+            'name': 'Indian Rupee',
+            'code': 'INR',
+            'symbol': 'Rs',
+        })
+        company = Company.create({
+            'party': Party.create({'name': 'Stress'}).id,
+            'currency': currency.id,
+        })
+        country = Country.create({'name': 'Stress', 'code': 'ST'})
+        department = Department.create({
+            'name': 'Stress',
+            'company': company.id,
+        })
+        casual, = LeaveType.search([('code', '=', 'casual')])
+
+        today = datetime.date.today()
+        parties, employees, apps = [], [], []
+        for i in range(self.employees):
+            party = Party.create({
+                'name': 'Stress %s' % i,
+                'addresses': [('create', {'street': 'Street %s' % i})],
+            })
+            parties.append(party.id)
+            address = party.addresses[0]
+            employee = Employee.create({
+                'party': party.id,
+                'company': company.id,
+                'department': department.id,
+                'first_name': 'Stress',
+                'last_name': str(i),
+                'date_of_birth': datetime.date(1980, 1, 1),
+                'place_of_birth': 'Place',
+                'nationality': country.id,
+                'permanent_address': address.id,
+                'present_address': address.id,
+            })
+            employees.append(employee.id)
+            for offset in (0, 2):
+                from_date = today + datetime.timedelta(days=offset)
+                apps.append(LeaveApplication.create({
+                    'employee': employee.id,
+                    'leave_type': casual.id,
+                    'from_date': from_date,
+                    'to_date': from_date + datetime.timedelta(days=4),
+                }))
+        LeaveApplication.review(apps)
+        self.created = [
+            ('currency.currency', [currency.id]),
+            ('party.party', [company.party.id]),
+            ('company.company', [company.id]),
+            ('country.country', [country.id]),
+            ('company.department', [department.id]),
+            ('party.party', parties),
+            ('company.employee', employees),
+            ('employee.leave.application', [a.id for a in apps]),
+        ]
+        return [a.id for a in apps]
+
+    def approve(self, queue, results):
+        '''
+        Approve the applications of the queue each in its own transaction
+        '''
+        LeaveApplication = POOL.get('employee.leave.application')
+        while True:
+            try:
+                app_id = queue.get_nowait()
+            except Queue.Empty:
+                return
+            with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                    as transaction:
+                try:
+                    LeaveApplication.approve([LeaveApplication(app_id)])
+                    transaction.cursor.commit()
+                    results.append((app_id, True))
+                except Exception:
+                    transaction.cursor.rollback()
+                    results.append((app_id, False))
+
+    def test0010concurrent_approvals(self):
+        '''
+        Approve all the applications from parallel threads
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            app_ids = self.seed()
+            transaction.cursor.commit()
+
+        queue = Queue.Queue()
+        # The applications of an employee follow each other in the queue,
+        # so different threads approve them at the same time
+        for app_id in app_ids:
+            queue.put(app_id)
+        results = []
+        threads = [threading.Thread(target=self.approve,
+                args=(queue, results))
+            for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), len(app_ids))
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            LeaveApplication = POOL.get('employee.leave.application')
+            Attendance = POOL.get('employee.attendance')
+            cursor = transaction.cursor
+
+            cursor.execute('SELECT employee, date '
+                'FROM "' + Attendance._table + '" '
+                'GROUP BY employee, date HAVING COUNT(*) > 1')
+            self.assertEqual(cursor.fetchall(), [])
+
+            # The two applications of an employee overlap, so exactly one
+            # of them is approved
+            approved = LeaveApplication.search([
+                    ('id', 'in', app_ids),
+                    ('state', '=', 'Approved'),
+                    ])
+            self.assertEqual(len(approved), self.employees)
+            self.assertEqual(len(set(a.employee.id for a in approved)),
+                self.employees)
+            self.assertEqual(sorted(a.id for a in approved),
+                sorted(i for i, success in results if success))
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestApprovalStressCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_attendance
+
+    Test the attendance
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+from decimal import Decimal
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+from trytond.exceptions import UserError
+
+from .common import create_company, create_department, create_employee, \
+    create_payroll_year
+
+
+class TestAttendanceCase(unittest.TestCase):
+    '''
+    Test the attendance
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Attendance = POOL.get('employee.attendance')
+        self.Holiday = POOL.get('payroll.holiday')
+        self.Department = POOL.get('company.department')
+
+    def test0010detect_absences(self):
+        '''
+        Mark the working days without attendance as absent
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            sunday_off = create_department(company, 'Sunday Off')
+            self.Department.write([sunday_off], {'weekly_offs': '7'})
+            year = create_payroll_year(company, 2013)
+            january = year.periods[0]
+            # 2013-01-01 is a Tuesday
+            self.Holiday.create({
+                'period': january.id,
+                'date': datetime.date(2013, 1, 2),
+            })
+            join_date = datetime.date(2012, 1, 1)
+            employee = create_employee(company, department, 'Alice',
+                join_date=join_date)
+            other = create_employee(company, sunday_off, 'Bob',
+                join_date=join_date)
+            create_employee(company, department, 'Carol',
+                join_date=datetime.date(2013, 1, 5))
+            self.Attendance.create({
+                'employee': employee.id,
+                'date': datetime.date(2013, 1, 3),
+                'in_time': datetime.datetime(2013, 1, 3, 9),
+                'out_time': datetime.datetime(2013, 1, 3, 17),
+            })
+
+            def absences(employee):
+                return [a.date for a in self.Attendance.search([
+                            ('employee', '=', employee.id),
+                            ('absent', '=', True),
+                            ], order=[('date', 'ASC')])]
+
+            for _ in range(2):
+                self.Attendance.detect_absences(january,
+                    datetime.date(2013, 1, 7))
+                self.assertEqual(absences(employee), [
+                        datetime.date(2013, 1, 1),
+                        datetime.date(2013, 1, 4),
+                        datetime.date(2013, 1, 7),
+                        ])
+                self.assertEqual(absences(other), [
+                        datetime.date(2013, 1, 1),
+                        datetime.date(2013, 1, 3),
+                        datetime.date(2013, 1, 4),
+                        datetime.date(2013, 1, 5),
+                        datetime.date(2013, 1, 7),
+                        ])
+            carol, = self.Attendance.search([
+                    ('employee.first_name', '=', 'Carol'),
+                    ])
+            self.assertEqual(carol.date, datetime.date(2013, 1, 7))
+
+    def test0015detect_due(self):
+        '''
+        Scan only the days since the last detection of the period
+        '''
+        Date = POOL.get('ir.date')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company = create_company()
+            department = create_department(company)
+            year = create_payroll_year(company, 2013)
+            employee = create_employee(company, department, 'Alice',
+                join_date=datetime.date(2012, 1, 1))
+
+            def absences():
+                return [a.date.day for a in self.Attendance.search([
+                            ('employee', '=', employee.id),
+                            ('absent', '=', True),
+                            ], order=[('date', 'ASC')])]
+
+            today = Date.__dict__['today']
+            cursor = transaction.cursor
+            cursor.commit = lambda: None
+            try:
+                Date.today = staticmethod(lambda: datetime.date(2013, 1, 4))
+                self.Attendance.detect_due()
+                self.assertEqual(absences(), [1, 2, 3])
+                self.assertEqual(year.periods[0].absences_date,
+                    datetime.date(2013, 1, 3))
+
+                # The days already scanned are not scanned again
+                self.Attendance.delete(self.Attendance.search([
+                            ('employee', '=', employee.id),
+                            ('date', '=', datetime.date(2013, 1, 2)),
+                            ]))
+                Date.today = staticmethod(lambda: datetime.date(2013, 1, 9))
+                self.Attendance.detect_due()
+                self.assertEqual(absences(), [1, 3, 4, 7, 8])
+            finally:
+                Date.today = today
+                del cursor.commit
+
+    def create_application(self, employee, from_date, to_date):
+        LeaveType = POOL.get('employee.leave.type')
+        LeaveApplication = POOL.get('employee.leave.application')
+
+        casual, = LeaveType.search([('code', '=', 'casual')])
+        app = LeaveApplication.create({
+            'employee': employee.id,
+            'leave_type': casual.id,
+            'from_date': from_date,
+            'to_date': to_date,
+        })
+        LeaveApplication.review([app])
+        return app
+
+    def test0020approve(self):
+        '''
+        Book the leave days and turn the absences into leaves
+        '''
+        LeaveApplication = POOL.get('employee.leave.application')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            employee = create_employee(company, department)
+            absence = self.Attendance.create({
+                'employee': employee.id,
+                'date': datetime.date(2013, 1, 2),
+                'absent': True,
+            })
+            app = self.create_application(employee,
+                datetime.date(2013, 1, 1), datetime.date(2013, 1, 4))
+            LeaveApplication.approve([app])
+
+            attendances = self.Attendance.search([
+                    ('employee', '=', employee.id),
+                    ], order=[('date', 'ASC')])
+            self.assertEqual([a.date for a in attendances], [
+                    datetime.date(2013, 1, 1),
+                    datetime.date(2013, 1, 2),
+                    datetime.date(2013, 1, 3),
+                    datetime.date(2013, 1, 4),
+                    ])
+            self.assertTrue(all(a.on_leave and not a.absent
+                    and a.leave_application == app for a in attendances))
+            self.assertIn(absence, attendances)
+
+            other = self.create_application(employee,
+                datetime.date(2013, 1, 4), datetime.date(2013, 1, 5))
+            self.assertRaises(Exception, LeaveApplication.approve, [other])
+
+    def test0025approve_single_day(self):
+        '''
+        Book the day of a one day leave, which is then not an absence
+        '''
+        LeaveApplication = POOL.get('employee.leave.application')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            year = create_payroll_year(company, 2013)
+            employee = create_employee(company, department,
+                join_date=datetime.date(2012, 1, 1))
+            app = self.create_application(employee,
+                datetime.date(2013, 1, 2), datetime.date(2013, 1, 2))
+            LeaveApplication.approve([app])
+
+            attendance, = self.Attendance.search([
+                    ('employee', '=', employee.id),
+                    ])
+            self.assertEqual(attendance.date, datetime.date(2013, 1, 2))
+            self.assertTrue(attendance.on_leave)
+
+            self.Attendance.detect_absences(year.periods[0],
+                datetime.date(2013, 1, 2))
+            self.assertEqual([a.date for a in self.Attendance.search([
+                            ('employee', '=', employee.id),
+                            ('absent', '=', True),
+                            ])], [datetime.date(2013, 1, 1)])
+
+    def test0030approve_concurrent(self):
+        '''
+        Report the attendance booked by a concurrent approval as a conflict
+        '''
+        LeaveApplication = POOL.get('employee.leave.application')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            # SQLite tables do not get the SQL constraints. The index is
+            # created first as the DDL commits the pending changes.
+            cursor = transaction.cursor
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS '
+                'employee_attendance_employee_date_uniq '
+                'ON "' + self.Attendance._table + '" (employee, date)')
+
+            company = create_company()
+            department = create_department(company)
+            employee = create_employee(company, department, 'Alice')
+            self.Attendance.create({
+                'employee': employee.id,
+                'date': datetime.date(2013, 1, 3),
+                'in_time': datetime.datetime(2013, 1, 3, 9),
+                'out_time': datetime.datetime(2013, 1, 3, 17),
+            })
+            app = self.create_application(employee,
+                datetime.date(2013, 1, 1), datetime.date(2013, 1, 4))
+
+            # Hide the attendance from the conflict check like the snapshot
+            # of a transaction started before a concurrent approval
+            execute = cursor.execute
+
+            def snapshot_execute(sql, *args):
+                if sql.startswith('SELECT id, date, absent '):
+                    sql += ' AND 1 = 0'
+                return execute(sql, *args)
+            cursor.execute = snapshot_execute
+            try:
+                with self.assertRaises(UserError) as context:
+                    LeaveApplication.approve([app])
+            finally:
+                del cursor.execute
+            self.assertIn('already has an attendance on 2013-01-03',
+                context.exception.args[1][0])
+
+
+    def attend(self, employee, date, in_hour, out_hour):
+        return self.Attendance.create({
+            'employee': employee.id,
+            'date': date,
+            'in_time': datetime.datetime.combine(date,
+                datetime.time(in_hour)),
+            'out_time': datetime.datetime.combine(date,
+                datetime.time(out_hour)),
+        })
+
+    def test0040worked_minutes(self):
+        '''
+        Store the worked minutes on creation, write and recomputation
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company = create_company()
+            department = create_department(company)
+            employee = create_employee(company, department)
+            attendance = self.attend(employee, datetime.date(2013, 1, 2),
+                9, 17)
+            self.assertEqual(attendance.worked_minutes, 480)
+
+            def worked(minutes):
+                return self.Attendance.search([
+                        ('worked_minutes', '=', minutes),
+                        ])
+
+            self.Attendance.write([attendance], {
+                    'out_time': datetime.datetime(2013, 1, 2, 18, 30),
+                    })
+            self.assertEqual(worked(570), [attendance])
+
+            cursor = transaction.cursor
+            cursor.execute('UPDATE "' + self.Attendance._table + '" '
+                'SET worked_minutes = NULL')
+            # Keep the recomputation within the test transaction
+            cursor.commit = lambda: None
+            try:
+                self.Attendance.recompute_worked_minutes(size=1)
+            finally:
+                del cursor.commit
+            self.assertEqual(worked(570), [attendance])
+
+    def test0050overtime(self):
+        '''
+        Sum the worked minutes beyond the standard hours over the period
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            self.Department.write([department], {
+                    'standard_hours': Decimal('7.5'),
+                    })
+            year = create_payroll_year(company, 2013)
+            alice = create_employee(company, department, 'Alice')
+            bob = create_employee(company, department, 'Bob')
+            self.attend(alice, datetime.date(2013, 1, 2), 9, 18)
+            self.attend(alice, datetime.date(2013, 1, 3), 9, 16)
+            self.attend(alice, datetime.date(2013, 2, 1), 9, 20)
+            self.attend(bob, datetime.date(2013, 1, 2), 9, 17)
+
+            self.assertEqual(self.Attendance.overtime(year.periods[0]), [{
+                        'employee': alice.id,
+                        'days': 2,
+                        'worked_minutes': 960,
+                        'overtime_minutes': 90,
+                        }, {
+                        'employee': bob.id,
+                        'days': 1,
+                        'worked_minutes': 480,
+                        'overtime_minutes': 30,
+                        }])
+            # The RPC passes the id of the period
+            self.assertEqual(self.Attendance.overtime(year.periods[0].id),
+                self.Attendance.overtime(year.periods[0]))
+
+    def test0060calendar(self):
+        '''
+        Encode the days of the employees of the department subtree in runs
+        '''
+        LeaveApplication = POOL.get('employee.leave.application')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            child = create_department(company, 'Child')
+            self.Department.write([child], {'parent': department.id})
+            year = create_payroll_year(company, 2013)
+            self.Holiday.create({
+                'period': year.periods[0].id,
+                'date': datetime.date(2013, 1, 2),
+            })
+            alice = create_employee(company, department, 'Alice')
+            bob = create_employee(company, child, 'Bob')
+            create_employee(company, department, 'Carol', state='retired')
+            self.attend(alice, datetime.date(2013, 1, 3), 9, 17)
+            self.attend(alice, datetime.date(2013, 1, 10), 9, 17)
+            app = self.create_application(alice,
+                datetime.date(2013, 1, 4), datetime.date(2013, 1, 4))
+            LeaveApplication.approve([app])
+
+            calendar = self.Attendance.calendar(department.id,
+                datetime.date(2013, 1, 1), datetime.date(2013, 1, 6))
+            self.assertEqual(calendar['employees'], [
+                    [alice.id, [['A', 1], ['H', 1], ['P', 1],
+                            ['casual', 1], ['A', 2]]],
+                    [bob.id, [['A', 1], ['H', 1], ['A', 4]]],
+                    ])
+            calendar = self.Attendance.calendar(child.id,
+                datetime.date(2013, 1, 1), datetime.date(2013, 1, 6))
+            self.assertEqual([e for e, _ in calendar['employees']],
+                [bob.id])
+
+    def test0070feed_etag(self):
+        '''
+        Change the entity tag of the feed with the rows of its events
+        '''
+        CalendarFeed = POOL.get('hr.calendar.feed')
+        LeaveApplication = POOL.get('employee.leave.application')
+        LeaveType = POOL.get('employee.leave.type')
+        Party = POOL.get('party.party')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            year = create_payroll_year(company, 2013)
+            self.Holiday.create({
+                'period': year.periods[0].id,
+                'date': datetime.date(2013, 1, 2),
+            })
+            alice = create_employee(company, department, 'Alice')
+            app = self.create_application(alice,
+                datetime.date(2013, 1, 4), datetime.date(2013, 1, 4))
+            LeaveApplication.approve([app])
+
+            etag = CalendarFeed.feed(department.id)['etag']
+            self.assertEqual(CalendarFeed.feed(department.id, etag=etag),
+                {'etag': etag, 'data': None})
+            for Model, record in (
+                    (LeaveType, app.leave_type),
+                    (Party, alice.party),
+                    (Party, company.party)):
+                Model.write([record], {'name': record.name + ' (renamed)'})
+                current = CalendarFeed.etag(department.id)
+                self.assertNotEqual(current, etag)
+                etag = current
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestAttendanceCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
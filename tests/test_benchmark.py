@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_benchmark
+
+    Benchmark the hot paths of the HR module
+
+    The data set is seeded in the test database (in memory with the default
+    SQLite backend) and every measure records the wall time and the number of
+    SQL queries executed. The size of the data set is set with the
+    environment variables:
+
+        HR_BENCHMARK_DEPARTMENTS  (default 3)
+        HR_BENCHMARK_EMPLOYEES    (default 20)
+        HR_BENCHMARK_DAYS         (default 20)
+
+    The results are written as JSON to HR_BENCHMARK_OUTPUT when it is set.
+    When HR_BENCHMARK_BASELINE points to the results of a previous run, the
+    test fails if any measure exceeds its baseline by more than the ratio
+    HR_BENCHMARK_THRESHOLD (default 1.5).
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import json
+import time
+import datetime
+import unittest
+from contextlib import contextmanager
+from itertools import chain
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+class TestBenchmarkCase(unittest.TestCase):
+    '''
+    Benchmark the hot paths
+    '''
+
+    departments = env_int('HR_BENCHMARK_DEPARTMENTS', 3)
+    employees = env_int('HR_BENCHMARK_EMPLOYEES', 20)
+    days = env_int('HR_BENCHMARK_DAYS', 20)
+    threshold = float(os.environ.get('HR_BENCHMARK_THRESHOLD', 1.5))
+
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.results = {}
+
+    @contextmanager
+    def measure(self, name):
+        '''
+        Record the wall time and the number of queries of the block
+        '''
+        cursor = Transaction().cursor
+        execute = cursor.execute
+        counter = [0]
+
+        def counting_execute(*args, **kwargs):
+            counter[0] += 1
+            return execute(*args, **kwargs)
+
+        cursor.execute = counting_execute
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            del cursor.execute
+            self.results[name] = {
+                'seconds': elapsed,
+                'queries': counter[0],
+            }
+
+    def seed(self):
+        '''
+        Create the company, departments, employees, payroll year,
+        attendance and leaves
+        '''
+        Currency = POOL.get('currency.currency')
+        Company = POOL.get('company.company')
+        Party = POOL.get('party.party')
+        Country = POOL.get('country.country')
+        User = POOL.get('res.user')
+        Department = POOL.get('company.department')
+        Employee = POOL.get('company.employee')
+        PayrollYear = POOL.get('payroll.year')
+        PayrollHoliday = POOL.get('payroll.holiday')
+        Attendance = POOL.get('employee.attendance')
+
+        currency = Currency.create({
+            'name': 'US Dollar',
+            'code': 'USD',
+            'symbol': '$',
+        })
+        company = Company.create({
+            'party': Party.create({'name': 'Openlabs'}).id,
+            'currency': currency.id,
+        })
+        User.write([User(USER)], {
+            'main_company': company.id,
+            'company': company.id,
+        })
+        country = Country.create({'name': 'India', 'code': 'IN'})
+
+        departments = [Department.create({
+                    'name': 'Department %s' % i,
+                    'company': company.id,
+                }) for i in range(self.departments)]
+
+        today = datetime.date.today()
+        year = PayrollYear.create({
+            'name': str(today.year),
+            'start_date': datetime.date(today.year, 1, 1),
+            'end_date': datetime.date(today.year, 12, 31),
+            'company': company.id,
+        })
+        with self.measure('PayrollYear.create_period'):
+            PayrollYear.create_period([year])
+        year = PayrollYear(year.id)
+        for period in year.periods:
+            PayrollHoliday.create({
+                'period': period.id,
+                'date': period.start_date,
+                'recurring': True,
+            })
+
+        employees = []
+        for i in range(self.employees):
+            party = Party.create({
+                'name': 'Employee %s' % i,
+                'addresses': [('create', {'street': 'Street %s' % i})],
+            })
+            address = party.addresses[0]
+            employees.append(Employee.create({
+                'party': party.id,
+                'company': company.id,
+                'department': departments[i % len(departments)].id,
+                'first_name': 'First %s' % i,
+                'last_name': 'Last %s' % i,
+                'date_of_birth': datetime.date(1980 + i % 20, 1, 1),
+                'place_of_birth': 'Place %s' % i,
+                'nationality': country.id,
+                'permanent_address': address.id,
+                'present_address': address.id,
+                'manager': employees[i // 10].id if i >= 10 else None,
+            }))
+
+        start = datetime.date(today.year, 1, 2)
+        for employee in employees:
+            for day in range(self.days):
+                date = start + datetime.timedelta(days=day)
+                Attendance.create({
+                    'employee': employee.id,
+                    'date': date,
+                    'in_time': datetime.datetime.combine(
+                        date, datetime.time(9)),
+                    'out_time': datetime.datetime.combine(
+                        date, datetime.time(17)),
+                })
+        return company, departments, employees
+
+    def test0010benchmark(self):
+        '''
+        Benchmark the hot paths
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company, departments, employees = self.seed()
+            with transaction.set_context(company=company.id):
+                self.run_benchmark(company, departments, employees)
+            transaction.cursor.rollback()
+        self.report()
+
+    def run_benchmark(self, company, departments, employees):
+        '''
+        Measure the hot paths on the seeded data
+        '''
+        Employee = POOL.get('company.employee')
+        EmployeeHistory = POOL.get('company.employee.history')
+        Attendance = POOL.get('employee.attendance')
+        LeaveApplication = POOL.get('employee.leave.application')
+        LeaveType = POOL.get('employee.leave.type')
+        LeaveBalance = POOL.get('employee.leave.balance')
+        LeaveAccrual = POOL.get('employee.leave.accrual')
+        CalendarFeed = POOL.get('hr.calendar.feed')
+        Onboarding = POOL.get('company.employee.onboarding')
+        Country = POOL.get('country.country')
+        PayrollYear = POOL.get('payroll.year')
+        TransferProposal = POOL.get('employee.transfer.proposal')
+
+        casual, = LeaveType.search([('code', '=', 'casual')])
+        today = datetime.date.today()
+        leave_start = datetime.date(today.year, 1, 2) + \
+            datetime.timedelta(days=self.days)
+        apps = [LeaveApplication.create({
+                    'employee': employee.id,
+                    'leave_type': casual.id,
+                    'from_date': leave_start,
+                    'to_date': leave_start + datetime.timedelta(days=2),
+                }) for employee in employees]
+        LeaveApplication.review(apps)
+        with self.measure('LeaveApplication.approve'):
+            LeaveApplication.approve(apps)
+
+        with self.measure('LeaveAccrual.accrue'):
+            for year in PayrollYear.search([]):
+                for period in year.periods:
+                    LeaveAccrual.accrue(period)
+
+        employee_ids = [e.id for e in employees]
+        with self.measure('Employee.leave_balances'):
+            balances = Employee.read(employee_ids, ['leave_balances'])
+            LeaveBalance.read(
+                list(chain.from_iterable(
+                        b['leave_balances'] for b in balances)),
+                ['leave_type', 'entitled', 'taken', 'available'])
+        with self.measure('Employee.get_addresses'):
+            Employee.read(employee_ids, ['addresses', 'contact_mechanisms'])
+
+        Party = POOL.get('party.party')
+        with self.measure('Party.compact_history'):
+            Party.compact_history()
+
+        attendance_ids = [a.id for a in Attendance.search([])]
+        with self.measure('Attendance.get_period'):
+            Attendance.read(attendance_ids, ['period'])
+        with self.measure('Attendance.get_is_holiday'):
+            Attendance.read(attendance_ids, ['is_holiday'])
+        with self.measure('Attendance.detect_absences'):
+            for period in PayrollYear.search([])[0].periods[:1]:
+                Attendance.detect_absences(period)
+        with self.measure('Attendance.overtime'):
+            for period in PayrollYear.search([])[0].periods:
+                Attendance.overtime(period)
+        with self.measure('CalendarFeed.feed'):
+            feed = CalendarFeed.feed(departments[0].id)
+        with self.measure('CalendarFeed.feed_not_modified'):
+            CalendarFeed.feed(departments[0].id, etag=feed['etag'])
+        with self.measure('Attendance.calendar'):
+            for department in departments:
+                Attendance.calendar(department.id,
+                    datetime.date(today.year, 1, 1),
+                    datetime.date(today.year, 1, 31))
+
+        proposals = [TransferProposal.create({
+                    'employee': employee.id,
+                    'proposed_company': company.id,
+                    'proposed_department': departments[-1].id,
+                    'proposed_allowance': 100,
+                    'proposed_doj': today,
+                }) for employee in employees]
+        TransferProposal.review(proposals)
+        with self.measure('TransferProposal.approve'):
+            TransferProposal.approve(proposals)
+
+        DepartmentHeadcount = POOL.get('company.department.headcount')
+        DepartmentAllowance = POOL.get('company.department.allowance')
+        with self.measure('DepartmentHeadcount.totals'):
+            for Rollup in (DepartmentHeadcount, DepartmentAllowance):
+                for department in departments:
+                    Rollup.totals(department.id)
+        with self.measure('DepartmentHeadcount.rebuild'):
+            DepartmentHeadcount.rebuild()
+            DepartmentAllowance.rebuild()
+
+        with self.measure('EmployeeHistory.read'):
+            histories = EmployeeHistory.search([])
+            EmployeeHistory.read([h.id for h in histories],
+                ['date', 'user', 'party_name', 'department_name',
+                    'manager_name'])
+
+        with self.measure('Employee.snapshot'):
+            Employee.snapshot(datetime.datetime.now())
+
+        country, = Country.search([('code', '=', 'IN')])
+        payloads = [{
+                'party': {'name': 'Onboarded %s' % i},
+                'addresses': [{'street': 'Street %s' % i}],
+                'department': departments[i % len(departments)].id,
+                'first_name': 'Onboarded',
+                'last_name': str(i),
+                'date_of_birth': datetime.date(1990, 1, 1),
+                'place_of_birth': 'Place %s' % i,
+                'nationality': country.id,
+                'payment_details': [{'payment_mode': 'cash'}],
+                } for i in range(self.employees)]
+        with self.measure('Onboarding.onboard'):
+            Onboarding.onboard(payloads)
+
+        with self.measure('PayrollYear.rollover'):
+            PayrollYear.rollover(company.id, str(today.year + 1),
+                datetime.date(today.year + 1, 1, 1),
+                datetime.date(today.year + 1, 12, 31))
+
+        with self.measure('PayrollYear.close'):
+            PayrollYear.close(PayrollYear.search([]))
+
+    def report(self):
+        '''
+        Write the results and compare them with the baseline
+        '''
+        output = os.environ.get('HR_BENCHMARK_OUTPUT')
+        if output:
+            with open(output, 'w') as fileobj:
+                json.dump({
+                        'departments': self.departments,
+                        'employees': self.employees,
+                        'days': self.days,
+                        'results': self.results,
+                    }, fileobj, indent=2, sort_keys=True)
+
+        baseline = os.environ.get('HR_BENCHMARK_BASELINE')
+        if not baseline:
+            return
+        with open(baseline) as fileobj:
+            baseline = json.load(fileobj)['results']
+        regressions = []
+        for name, result in sorted(self.results.iteritems()):
+            if name not in baseline:
+                continue
+            for key in ('queries', 'seconds'):
+                # Ignore the noise of very short timings
+                reference = max(baseline[name][key],
+                    0.01 if key == 'seconds' else 1)
+                if result[key] > reference * self.threshold:
+                    regressions.append('%s %s: %s > %s x %s' % (
+                            name, key, result[key], reference,
+                            self.threshold))
+        self.assertFalse(regressions, '\n'.join(regressions))
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestBenchmarkCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_directory
+
+    Test the search in the employee directory
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_employee
+
+
+class TestDirectoryCase(unittest.TestCase):
+    '''
+    Test the directory search
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Employee = POOL.get('company.employee')
+        self.Skill = POOL.get('company.employee.skill')
+
+    def search(self, value, operator='ilike'):
+        return [e.first_name for e in self.Employee.search([
+                    ('directory', operator, value),
+                    ], order=[('first_name', 'ASC')])]
+
+    def test0010search(self):
+        '''
+        Match the names and skills as substrings
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            alice = create_employee(company, department, 'Alice',
+                last_name='Johnson')
+            create_employee(company, department, 'Bob',
+                last_name='Marley')
+            self.Skill.create({
+                'employee': alice.id,
+                'name': 'Accounting',
+            })
+            self.Employee.update_directory([alice])
+
+            self.assertEqual(self.search('%Alice%'), ['Alice'])
+            self.assertEqual(self.search('%ohns%'), ['Alice'])
+            self.assertEqual(self.search('%COUNT%'), ['Alice'])
+            self.assertEqual(self.search('%ar%'), ['Bob'])
+            self.assertEqual(self.search('Alice%'), ['Alice'])
+            self.assertEqual(self.search('Johnson%'), [])
+            self.assertEqual(self.search('%e%', 'like'), ['Alice', 'Bob'])
+            self.assertEqual(self.search('%Nobody%'), [])
+
+    def test0020update(self):
+        '''
+        Follow the changes of the names
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            alice = create_employee(company, department, 'Alice')
+
+            self.Employee.write([alice], {'first_name': 'Alicia'})
+            self.assertEqual(self.search('%Alicia%'), ['Alicia'])
+            self.Employee.delete([alice])
+            self.assertEqual(self.search('%Alicia%'), [])
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestDirectoryCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_document
+
+    Test the document expiry scanner
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_employee
+
+
+class TestDocumentCase(unittest.TestCase):
+    '''
+    Test the document expiry scanner
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Employee = POOL.get('company.employee')
+        self.DocumentExpiry = POOL.get('employee.document.expiry')
+
+    def queue(self):
+        return sorted((e.employee.first_name, e.document, e.number,
+                e.expiry_date)
+            for e in self.DocumentExpiry.search([('state', '=', 'open')]))
+
+    def test0010scan(self):
+        '''
+        Queue the documents expiring within the window
+        '''
+        Date = POOL.get('ir.date')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            today = Date.today()
+            soon = today + datetime.timedelta(days=10)
+            later = today + datetime.timedelta(days=100)
+            alice = create_employee(company, department, 'Alice',
+                passport_number='P1', passport_validity=soon,
+                driving_license='D1', driving_license_validity=later)
+            bob = create_employee(company, department, 'Bob',
+                passport_number='P2', passport_validity=later)
+
+            self.DocumentExpiry.scan()
+            self.assertEqual(self.queue(), [
+                    ('Alice', 'passport', 'P1', soon),
+                    ])
+            # A scan without changes leaves the queue as is
+            self.DocumentExpiry.scan()
+            self.assertEqual(self.queue(), [
+                    ('Alice', 'passport', 'P1', soon),
+                    ])
+
+            # The modified employees are scanned again
+            self.Employee.write([alice], {'passport_validity': later})
+            self.Employee.write([bob], {
+                    'passport_number': 'P3',
+                    'passport_validity': soon,
+                    })
+            self.DocumentExpiry.scan()
+            self.assertEqual(self.queue(), [
+                    ('Bob', 'passport', 'P3', soon),
+                    ])
+
+            expiry, = self.DocumentExpiry.search([])
+            self.DocumentExpiry.done([expiry])
+            self.assertEqual(self.queue(), [])
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestDocumentCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
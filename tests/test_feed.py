@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_feed
+
+    Test the change feed
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_employee
+
+
+class TestFeedCase(unittest.TestCase):
+    '''
+    Test the change feed
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Employee = POOL.get('company.employee')
+        self.ChangeFeed = POOL.get('hr.change.feed')
+        self.Tombstone = POOL.get('hr.change.tombstone')
+
+    def settle(self):
+        '''
+        Move the changes of the employees out of the settle delay
+        '''
+        cursor = Transaction().cursor
+        stamp = datetime.datetime.now() - datetime.timedelta(hours=1)
+        cursor.execute('UPDATE "' + self.Employee._table + '" '
+            'SET create_date = %s, write_date = NULL', (stamp,))
+
+    def test0010changes(self):
+        '''
+        Page through the created employees
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            employees = [create_employee(company, department, name)
+                for name in ('Alice', 'Bob', 'Carol')]
+            self.settle()
+
+            result = self.ChangeFeed.changes('company.employee', limit=2,
+                fields_names=['first_name'])
+            self.assertTrue(result['more'])
+            self.assertEqual([r['first_name'] for r in result['changed']],
+                ['Alice', 'Bob'])
+            result = self.ChangeFeed.changes('company.employee',
+                token=result['token'], limit=2, fields_names=['first_name'])
+            self.assertFalse(result['more'])
+            self.assertEqual([r['id'] for r in result['changed']],
+                [employees[2].id])
+            self.assertEqual(result['deleted'], [])
+
+            result = self.ChangeFeed.changes('company.employee',
+                token=result['token'])
+            self.assertEqual(result['changed'], [])
+
+    def test0020deletions(self):
+        '''
+        Report the deleted employees through their tombstones
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            employees = [create_employee(company, department, name)
+                for name in ('Alice', 'Bob', 'Carol')]
+            self.settle()
+            token = self.ChangeFeed.changes('company.employee')['token']
+
+            ids = [e.id for e in employees[:2]]
+            self.Employee.delete(employees[:2])
+            self.assertEqual(
+                [t.record for t in self.Tombstone.search([
+                            ('model', '=', 'company.employee'),
+                            ])], ids)
+
+            result = self.ChangeFeed.changes('company.employee', token=token)
+            self.assertEqual(result['changed'], [])
+            self.assertEqual(result['deleted'], ids)
+
+    def test0025attendance_deletions(self):
+        '''
+        Report the deleted attendances through their tombstones
+        '''
+        Attendance = POOL.get('employee.attendance')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            employee = create_employee(company, department)
+            attendances = [Attendance.create({
+                        'employee': employee.id,
+                        'date': datetime.date(2013, 1, day),
+                        }) for day in (2, 3)]
+            token = self.ChangeFeed.changes('employee.attendance')['token']
+
+            Attendance.delete(attendances[:1])
+            result = self.ChangeFeed.changes('employee.attendance',
+                token=token)
+            self.assertEqual(result['deleted'], [attendances[0].id])
+
+    def test0030invalid(self):
+        '''
+        Reject the models out of the feed and the invalid tokens
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.assertRaises(Exception, self.ChangeFeed.changes,
+                'party.party')
+            self.assertRaises(Exception, self.ChangeFeed.changes,
+                'company.employee', token='invalid')
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestFeedCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
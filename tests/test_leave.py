@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_leave
+
+    Test the accrual of the leaves
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+from decimal import Decimal
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_employee, \
+    create_payroll_year
+
+
+class TestLeaveCase(unittest.TestCase):
+    '''
+    Test the accrual of the leaves
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.LeaveType = POOL.get('employee.leave.type')
+        self.LeaveAccrual = POOL.get('employee.leave.accrual')
+
+    def monthly_type(self):
+        earned, = self.LeaveType.search([('code', '=', 'earned')])
+        self.LeaveType.write([earned], {
+                'accrual': 'monthly',
+                'probation_days': 6,
+                'confirmed_days': 12,
+                'carry_forward_cap': 5,
+                })
+        return earned
+
+    def accruals(self, period, kind='accrual'):
+        return sorted((a.employee.first_name, a.days)
+            for a in self.LeaveAccrual.search([
+                    ('period', '=', period.id),
+                    ('kind', '=', kind),
+                    ]))
+
+    def test0010accrue(self):
+        '''
+        Earn a twelfth of the entitlement prorated by the days worked
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            self.monthly_type()
+            year = create_payroll_year(company, 2013)
+            january = year.periods[0]
+            join_date = datetime.date(2012, 1, 1)
+            create_employee(company, department, 'Alice',
+                join_date=join_date)
+            create_employee(company, department, 'Bob',
+                join_date=join_date, type='probation')
+            create_employee(company, department, 'Carol',
+                join_date=datetime.date(2013, 1, 17))
+            create_employee(company, department, 'Dave',
+                join_date=datetime.date(2013, 2, 1))
+            create_employee(company, department, 'Eve',
+                join_date=join_date, state='retired')
+
+            for _ in range(2):
+                self.LeaveAccrual.accrue(january)
+                self.assertEqual(self.accruals(january), [
+                        ('Alice', Decimal('1.00')),
+                        ('Bob', Decimal('0.50')),
+                        # 15 of the 31 days of January
+                        ('Carol', Decimal('0.48')),
+                        ])
+
+    def test0020carry_forward(self):
+        '''
+        Carry the balance of the previous year forward up to the cap
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            department = create_department(company)
+            self.monthly_type()
+            previous = create_payroll_year(company, 2012)
+            year = create_payroll_year(company, 2013)
+            join_date = datetime.date(2011, 1, 1)
+            create_employee(company, department, 'Alice',
+                join_date=join_date)
+            create_employee(company, department, 'Bob',
+                join_date=datetime.date(2012, 10, 1))
+
+            for period in previous.periods:
+                self.LeaveAccrual.accrue(period)
+            self.LeaveAccrual.accrue(year.periods[0])
+            self.assertEqual(self.accruals(year.periods[0],
+                    'carry_forward'), [
+                    ('Alice', Decimal('5.00')),
+                    ('Bob', Decimal('3.00')),
+                    ])
+            self.assertEqual(self.accruals(year.periods[1],
+                    'carry_forward'), [])
+
+    def test0030accrue_due(self):
+        '''
+        Accrue the periods which are over and not yet accrued
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company = create_company()
+            department = create_department(company)
+            self.monthly_type()
+            year = create_payroll_year(company, 2013)
+            create_employee(company, department, 'Alice',
+                join_date=datetime.date(2012, 1, 1))
+            self.LeaveAccrual.accrue(year.periods[0])
+
+            Date = POOL.get('ir.date')
+            accrued = []
+            accrue = self.LeaveAccrual.__dict__['accrue']
+            today = Date.__dict__['today']
+            self.LeaveAccrual.accrue = staticmethod(
+                lambda period: accrued.append(period.start_date.month))
+            # The last period ends today
+            Date.today = staticmethod(lambda: datetime.date(2013, 12, 31))
+            cursor = transaction.cursor
+            cursor.commit = lambda: None
+            try:
+                self.LeaveAccrual.accrue_due()
+            finally:
+                self.LeaveAccrual.accrue = accrue
+                Date.today = today
+                del cursor.commit
+            self.assertEqual(accrued, range(2, 12))
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLeaveCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
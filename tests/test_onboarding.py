@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_onboarding
+
+    Test the bulk onboarding of employees
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department
+
+
+class TestOnboardingCase(unittest.TestCase):
+    '''
+    Test the bulk onboarding
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Onboarding = POOL.get('company.employee.onboarding')
+        self.Employee = POOL.get('company.employee')
+
+    def payloads(self, department, count):
+        Country = POOL.get('country.country')
+
+        countries = Country.search([('code', '=', 'IN')])
+        if countries:
+            country, = countries
+        else:
+            country = Country.create({'name': 'India', 'code': 'IN'})
+        return [{
+                'party': {'name': 'Employee %s' % i},
+                'addresses': [
+                    {'street': 'Home %s' % i},
+                    {'street': 'Office %s' % i},
+                    ],
+                'present_address': 1,
+                'department': department.id,
+                'first_name': 'Employee',
+                'last_name': str(i),
+                'date_of_birth': datetime.date(1990, 1, 1),
+                'place_of_birth': 'Place',
+                'nationality': country.id,
+                'skills': [{'name': 'Skill %s' % i}],
+                'payment_details': [{'payment_mode': 'cash'}],
+                } for i in range(count)]
+
+    def count_queries(self, function, *args):
+        '''
+        Return the result of the function and the number of queries it
+        executed
+        '''
+        cursor = Transaction().cursor
+        execute = cursor.execute
+        counter = [0]
+
+        def counting_execute(*args, **kwargs):
+            counter[0] += 1
+            return execute(*args, **kwargs)
+        cursor.execute = counting_execute
+        try:
+            return function(*args), counter[0]
+        finally:
+            del cursor.execute
+
+    def test0010onboard(self):
+        '''
+        Create the employees with their party, addresses and children
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company = create_company()
+            department = create_department(company)
+            payloads = self.payloads(department, 3)
+            payloads[1]['sex'] = 'unknown'
+            payloads[2]['department'] = -1
+
+            with transaction.set_context(company=company.id):
+                result = self.Onboarding.onboard(payloads)
+            self.assertEqual([e[0] for e in result['employees']], [0])
+            self.assertEqual([e[0] for e in result['errors']], [1, 2])
+
+            employee = self.Employee(result['employees'][0][1])
+            self.assertEqual(employee.party.name, 'Employee 0')
+            self.assertTrue(employee.party.code)
+            self.assertTrue(employee.employee_id)
+            self.assertEqual(employee.permanent_address.street, 'Home 0')
+            self.assertEqual(employee.present_address.street, 'Office 0')
+            self.assertEqual([s.name for s in employee.skills], ['Skill 0'])
+            self.assertEqual(len(employee.payment_details), 1)
+            self.assertEqual(self.Employee.search([
+                        ('directory', 'ilike', '%Skill 0%'),
+                        ]), [employee])
+
+    def test0015validation(self):
+        '''
+        Refuse alone the payloads which create would refuse
+        '''
+        Party = POOL.get('party.party')
+        Country = POOL.get('country.country')
+        Subdivision = POOL.get('country.subdivision')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company = create_company()
+            department = create_department(company)
+            Party.create({'name': 'Existing', 'code': 'EXISTING'})
+            country = Country.create({'name': 'Nepal', 'code': 'NP'})
+            state = Subdivision.create({
+                    'name': 'Bagmati',
+                    'code': 'NP-BA',
+                    'type': 'state',
+                    'country': country.id,
+                    })
+            payloads = self.payloads(department, 7)
+            payloads[1]['marital_status'] = 'married'
+            payloads[2]['passport_number'] = 'P123'
+            payloads[3]['native_state'] = state.id
+            payloads[4]['party']['code'] = 'NEW'
+            payloads[5]['party']['code'] = 'NEW'
+            payloads[6]['party']['code'] = 'EXISTING'
+
+            with transaction.set_context(company=company.id):
+                result = self.Onboarding.onboard(payloads)
+            self.assertEqual([e[0] for e in result['employees']], [0, 4])
+            errors = dict(result['errors'])
+            self.assertEqual(sorted(errors), [1, 2, 3, 5, 6])
+            self.assertTrue('wedding_date' in errors[1])
+            self.assertTrue('passport_validity' in errors[2])
+            self.assertTrue('native_state' in errors[3])
+            self.assertEqual(Party.search([('code', '=', 'NEW')],
+                    count=True), 1)
+
+    def test0020sequences(self):
+        '''
+        Number the parties and the employees like one by one creations
+        '''
+        Party = POOL.get('party.party')
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company = create_company()
+            department = create_department(company)
+
+            with transaction.set_context(company=company.id):
+                first = self.Onboarding.onboard(
+                    self.payloads(department, 1))['employees']
+                party = Party.create({'name': 'Between'})
+                result = self.Onboarding.onboard(
+                    self.payloads(department, 3))['employees']
+            employees = self.Employee.browse(
+                [id_ for _, id_ in first + result])
+            codes = [int(e.party.code) for e in employees]
+            self.assertEqual(codes[1:], range(int(party.code) + 1,
+                    int(party.code) + 4))
+            self.assertEqual(len(set(e.employee_id for e in employees)), 4)
+
+    def test0030queries(self):
+        '''
+        Onboard with a number of queries which does not grow with the batch
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            company = create_company()
+            department = create_department(company)
+
+            with transaction.set_context(company=company.id):
+                self.Onboarding.onboard(self.payloads(department, 1))
+                _, small = self.count_queries(self.Onboarding.onboard,
+                    self.payloads(department, 5))
+                _, large = self.count_queries(self.Onboarding.onboard,
+                    self.payloads(department, 20))
+            self.assertTrue(large <= small, (small, large))
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestOnboardingCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_party_history
+
+    Test the compaction of the party history
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+
+class TestPartyHistoryCase(unittest.TestCase):
+    '''
+    Test the compaction of the party history
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Party = POOL.get('party.party')
+        self.Configuration = POOL.get('company.employee.configuration')
+
+    def create_revisions(self, names, dates):
+        '''
+        Create a party and rename it, dating each revision in turn
+        '''
+        cursor = Transaction().cursor
+        table = '%s__history' % self.Party._table
+
+        party = self.Party.create({'name': names[0]})
+        for name in names[1:]:
+            self.Party.write([party], {'name': name})
+        cursor.execute('SELECT __id FROM "' + table + '" '
+            'WHERE id = %s ORDER BY __id', (party.id,))
+        history_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('UPDATE "' + table + '" SET create_date = %s '
+            'WHERE id = %s', (dates[0], party.id))
+        for history_id, date in zip(history_ids[1:], dates[1:]):
+            cursor.execute('UPDATE "' + table + '" SET write_date = %s '
+                'WHERE __id = %s', (date, history_id))
+        return party
+
+    def compact(self, **values):
+        self.Configuration.write([self.Configuration(1)], values)
+        cursor = Transaction().cursor
+        # Keep the compaction within the test transaction
+        cursor.commit = lambda: None
+        try:
+            self.Party.compact_history()
+        finally:
+            del cursor.commit
+
+    def name_at(self, party, date):
+        with Transaction().set_context(_datetime=date):
+            party, = self.Party.read([party.id], ['name'])
+        return party['name']
+
+    def revisions(self, party):
+        cursor = Transaction().cursor
+        cursor.execute('SELECT COUNT(*) FROM "%s__history" WHERE id = %%s'
+            % self.Party._table, (party.id,))
+        return cursor.fetchone()[0]
+
+    def test0010retention(self):
+        '''
+        Keep the creation and the last revision older than the retention
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            now = datetime.datetime.now().replace(microsecond=0)
+            days = lambda d: now - datetime.timedelta(days=d)
+            party = self.create_revisions(['A', 'B', 'C', 'D'],
+                [days(100), days(90), days(80), days(1)])
+
+            self.compact(party_history_retention=30)
+            self.assertEqual(self.revisions(party), 3)
+            self.assertEqual(self.name_at(party, days(95)), 'A')
+            self.assertEqual(self.name_at(party, days(85)), 'A')
+            self.assertEqual(self.name_at(party, days(50)), 'C')
+            self.assertEqual(self.name_at(party, now), 'D')
+
+    def test0020window(self):
+        '''
+        Keep the creation and the last revision within the window
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            now = datetime.datetime.now().replace(microsecond=0)
+            minutes = lambda m: now - datetime.timedelta(minutes=m)
+            party = self.create_revisions(['A', 'B', 'C', 'D'],
+                [minutes(120), minutes(119), minutes(118), minutes(60)])
+
+            self.compact(party_history_window=10)
+            self.assertEqual(self.revisions(party), 3)
+            self.assertEqual(self.name_at(party, minutes(119.5)), 'A')
+            self.assertEqual(self.name_at(party, minutes(90)), 'C')
+            self.assertEqual(self.name_at(party, now), 'D')
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestPartyHistoryCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
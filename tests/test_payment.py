@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_payment
+
+    Test the payment batches
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import csv
+import datetime
+import unittest
+from StringIO import StringIO
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_employee, \
+    create_payroll_year
+
+
+class TestPaymentCase(unittest.TestCase):
+    '''
+    Test the payment batches
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Batch = POOL.get('company.employee.payment_batch')
+        self.PaymentDetail = POOL.get('company.employee.payment_detail')
+
+    def create_batch(self, layout='csv'):
+        '''
+        Create a batch paying two employees by bank and one by cash
+        '''
+        company = create_company()
+        department = create_department(company)
+        year = create_payroll_year(company, 2013)
+        self.codes = {}
+        for name, bank_code in (('Bob', 'BANK2'), ('Alice', 'BANK1'),
+                ('Carol', None)):
+            employee = create_employee(company, department, name)
+            self.codes[name] = employee.employee_id
+            self.PaymentDetail.create({
+                'employee': employee.id,
+                'payment_mode': 'bank' if bank_code else 'cash',
+                'bank_code': bank_code,
+                'bank_branch_code': 'BR',
+                'bank_account_name': name,
+            })
+        return self.Batch.create({
+            'name': 'January',
+            'company': company.id,
+            'period': year.periods[0].id,
+            'payment_date': datetime.date(2013, 1, 31),
+            'layout': layout,
+        })
+
+    def references(self, batch):
+        '''
+        Return the references of the lines of the batch by account name
+        '''
+        Line = POOL.get('company.employee.payment_batch.line')
+        cursor = Transaction().cursor
+        cursor.execute('SELECT bank_account_name, id '
+            'FROM "' + Line._table + '" WHERE batch = %s', (batch.id,))
+        return dict((name, str(id_)) for name, id_ in cursor.fetchall())
+
+    def test0010generate_csv(self):
+        '''
+        Generate the bank file with one group per bank
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            batch = self.create_batch()
+            self.Batch.generate([batch])
+            batch = self.Batch(batch.id)
+
+            self.assertEqual(batch.state, 'generated')
+            self.assertEqual(len(batch.lines), 2)
+            references = self.references(batch)
+            rows = list(csv.reader(StringIO(str(batch.file))))
+            self.assertEqual(rows, [
+                    ['H', 'BANK1', 'BR', 'January'],
+                    ['D', 'BANK1', 'BR', self.codes['Alice'], 'Alice',
+                        '20130131', references['Alice']],
+                    ['T', 'BANK1', 'BR', '1'],
+                    ['H', 'BANK2', 'BR', 'January'],
+                    ['D', 'BANK2', 'BR', self.codes['Bob'], 'Bob',
+                        '20130131', references['Bob']],
+                    ['T', 'BANK2', 'BR', '1'],
+                    ])
+
+    def test0020generate_fixed(self):
+        '''
+        Generate the fixed width bank file
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            batch = self.create_batch(layout='fixed')
+            self.Batch.generate([batch])
+            batch = self.Batch(batch.id)
+
+            lines = str(batch.file).split('\r\n')
+            self.assertEqual(lines[-1], '')
+            self.assertEqual([l[0] for l in lines[:-1]],
+                ['H', 'D', 'T', 'H', 'D', 'T'])
+            self.assertEqual(lines[1],
+                'D' + 'BANK1'.ljust(11) + 'BR'.ljust(11)
+                + self.codes['Alice'].ljust(16) + 'Alice'.ljust(35)
+                + '20130131' + self.references(batch)['Alice'].ljust(16))
+
+    def test0030import_returns(self):
+        '''
+        Import the returns into the lines and the payment details
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            batch = self.create_batch()
+            self.Batch.generate([batch])
+            references = self.references(batch)
+
+            # The lines of other batches are ignored
+            count = self.Batch.import_returns(batch,
+                '%s,2013-02-02,Account closed\n'
+                '%s,2013-02-02,Unknown\n' % (
+                    references['Alice'], max(map(int, references.values()))
+                    + 1))
+            self.assertEqual(count, 1)
+            batch = self.Batch(batch.id)
+            returned, = [l for l in batch.lines if l.state == 'returned']
+            self.assertEqual(returned.employee.first_name, 'Alice')
+            self.assertEqual(returned.return_date, datetime.date(2013, 2, 2))
+            self.assertEqual(returned.return_reason, 'Account closed')
+            self.assertEqual(returned.write_uid.id, USER)
+            self.assertTrue(returned.write_date)
+            detail = returned.payment_detail
+            self.assertEqual(detail.return_date, datetime.date(2013, 2, 2))
+            self.assertEqual(detail.return_reason, 'Account closed')
+            self.assertEqual(detail.write_uid.id, USER)
+            self.assertTrue(detail.write_date)
+
+    def test0040import_invalid_returns(self):
+        '''
+        Reject a return file with an invalid date
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            batch = self.create_batch()
+            self.Batch.generate([batch])
+
+            self.assertRaises(Exception, self.Batch.import_returns, batch,
+                '%s,02/02/2013,Account closed\n'
+                % self.references(batch)['Alice'])
+            self.assertRaises(Exception, self.Batch.import_returns, batch,
+                'Alice,2013-02-02,Account closed\n')
+
+    def test0050import_returns_per_line(self):
+        '''
+        Return only the quoted line of an employee paid to two accounts
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            batch = self.create_batch()
+            alice, = [d for d in self.PaymentDetail.search([
+                        ('bank_account_name', '=', 'Alice'),
+                        ])]
+            self.PaymentDetail.create({
+                'employee': alice.employee.id,
+                'payment_mode': 'bank',
+                'bank_code': 'BANK3',
+                'bank_branch_code': 'BR',
+                'bank_account_name': 'Alice Savings',
+            })
+            self.Batch.generate([batch])
+
+            self.Batch.import_returns(batch, '%s,2013-02-02,Closed\n'
+                % self.references(batch)['Alice Savings'])
+            returned = self.PaymentDetail.search([
+                    ('return_reason', '=', 'Closed'),
+                    ])
+            self.assertEqual([d.bank_account_name for d in returned],
+                ['Alice Savings'])
+            Line = POOL.get('company.employee.payment_batch.line')
+            self.assertEqual([l.bank_account_name for l in Line.search([
+                            ('batch', '=', batch.id),
+                            ('state', '=', 'returned'),
+                            ])], ['Alice Savings'])
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestPaymentCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_payroll
+
+    Test the payroll calendars
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_payroll_year
+
+
+class TestPayrollCase(unittest.TestCase):
+    '''
+    Test the payroll calendars
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.PayrollYear = POOL.get('payroll.year')
+        self.Period = POOL.get('payroll.period')
+        self.Holiday = POOL.get('payroll.holiday')
+
+    def add_holiday(self, year, date, recurring=True):
+        period, = [p for p in year.periods
+            if p.start_date <= date <= p.end_date]
+        return self.Holiday.create({
+            'period': period.id,
+            'date': date,
+            'recurring': recurring,
+        })
+
+    def holidays(self, year):
+        return sorted(h.date for h in self.Holiday.search([
+                    ('period.payroll_year', '=', year.id),
+                    ]))
+
+    def test0010rollover(self):
+        '''
+        Create the next years with their periods and recurring holidays
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            own = create_department(company, 'Own Calendar')
+            create_department(company, 'Company Calendar')
+            company_year = create_payroll_year(company, 2012)
+            own_year = create_payroll_year(company, 2012, own)
+            self.add_holiday(company_year, datetime.date(2012, 2, 29))
+            self.add_holiday(company_year, datetime.date(2012, 3, 1),
+                recurring=False)
+            self.add_holiday(own_year, datetime.date(2012, 1, 26))
+
+            start, end = datetime.date(2013, 1, 1), datetime.date(2013, 12, 31)
+            count = self.PayrollYear.rollover(company.id, '2013', start, end)
+            self.assertEqual(count, 2)
+
+            self.assertEqual(self.PayrollYear.search([
+                        ('state', '=', 'close'),
+                        ], order=[('id', 'ASC')]), [company_year, own_year])
+            new_company, = self.PayrollYear.search([
+                    ('start_date', '=', start),
+                    ('department', '=', None),
+                    ])
+            new_own, = self.PayrollYear.search([
+                    ('start_date', '=', start),
+                    ('department', '=', own.id),
+                    ])
+            self.assertEqual(len(new_company.periods), 12)
+            self.assertEqual(len(new_own.periods), 12)
+            self.assertTrue(all(p.department == own for p in new_own.periods))
+            # The 29th of February is kept in February
+            self.assertEqual(self.holidays(new_company),
+                [datetime.date(2013, 2, 28)])
+            self.assertEqual(self.holidays(new_own),
+                [datetime.date(2013, 1, 26)])
+
+            # A second run creates nothing
+            self.assertEqual(
+                self.PayrollYear.rollover(company.id, '2013', start, end), 0)
+            self.assertEqual(len(self.Period.search([
+                            ('payroll_year', '=', new_company.id),
+                            ])), 12)
+            self.assertEqual(self.holidays(new_company),
+                [datetime.date(2013, 2, 28)])
+
+    def test0020rollover_existing(self):
+        '''
+        Leave the calendars which already have the year untouched
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            own = create_department(company, 'Own Calendar')
+            company_year = create_payroll_year(company, 2012)
+            own_year = create_payroll_year(company, 2012, own)
+            self.add_holiday(company_year, datetime.date(2012, 5, 1))
+            self.add_holiday(own_year, datetime.date(2012, 5, 1))
+            existing = create_payroll_year(company, 2013, own)
+
+            count = self.PayrollYear.rollover(company.id, '2013',
+                datetime.date(2013, 1, 1), datetime.date(2013, 12, 31))
+            self.assertEqual(count, 1)
+            existing = self.PayrollYear(existing.id)
+            self.assertEqual(len(existing.periods), 12)
+            self.assertEqual(self.holidays(existing), [])
+            new_company, = self.PayrollYear.search([
+                    ('start_date', '=', datetime.date(2013, 1, 1)),
+                    ('department', '=', None),
+                    ])
+            self.assertEqual(self.holidays(new_company),
+                [datetime.date(2013, 5, 1)])
+
+    def test0030rollover_overlap(self):
+        '''
+        Refuse a year overlapping an existing one
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            create_payroll_year(company, 2012)
+
+            self.assertRaises(Exception, self.PayrollYear.rollover,
+                company.id, '2012-2013', datetime.date(2012, 7, 1),
+                datetime.date(2013, 6, 30))
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestPayrollCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
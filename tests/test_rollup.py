@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_rollup
+
+    Test the department rollups
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+from decimal import Decimal
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_employee
+
+
+class TestRollupCase(unittest.TestCase):
+    '''
+    Test the department rollups
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Department = POOL.get('company.department')
+        self.Employee = POOL.get('company.employee')
+        self.Proposal = POOL.get('employee.transfer.proposal')
+        self.Headcount = POOL.get('company.department.headcount')
+        self.Allowance = POOL.get('company.department.allowance')
+
+    def create_departments(self, company):
+        parent = create_department(company, 'Parent')
+        child = create_department(company, 'Child')
+        self.Department.write([child], {'parent': parent.id})
+        return parent, child
+
+    def totals(self, Rollup, department, count):
+        "Return the non empty totals of the department"
+        return sorted(t for t in Rollup.totals(department.id) if t[count])
+
+    def test0010headcount(self):
+        '''
+        Count the employees in their department and its ancestors
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            parent, child = self.create_departments(company)
+            alice = create_employee(company, child, 'Alice')
+            create_employee(company, child, 'Bob', sex='female')
+            carol = create_employee(company, parent, 'Carol')
+
+            def headcount(department):
+                return [(t['state'], t['type'], t['sex'], t['headcount'])
+                    for t in self.totals(self.Headcount, department,
+                        'headcount')]
+
+            self.assertEqual(headcount(parent), [
+                    ('current', 'confirmed', 'female', 1),
+                    ('current', 'confirmed', 'male', 2),
+                    ])
+            self.assertEqual(headcount(child), [
+                    ('current', 'confirmed', 'female', 1),
+                    ('current', 'confirmed', 'male', 1),
+                    ])
+
+            self.Employee.write([alice], {'state': 'retired'})
+            self.Employee.write([carol], {'department': child.id})
+            self.assertEqual(headcount(parent), [
+                    ('current', 'confirmed', 'female', 1),
+                    ('current', 'confirmed', 'male', 1),
+                    ('retired', 'confirmed', 'male', 1),
+                    ])
+            self.assertEqual(headcount(child), headcount(parent))
+
+            self.Employee.delete([alice])
+            self.assertEqual(headcount(child), [
+                    ('current', 'confirmed', 'female', 1),
+                    ('current', 'confirmed', 'male', 1),
+                    ])
+
+            incremental = headcount(parent), headcount(child)
+            self.Headcount.rebuild()
+            self.assertEqual((headcount(parent), headcount(child)),
+                incremental)
+
+    def test0015move(self):
+        '''
+        Move the totals of the subtrees to their new ancestors
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            parent, child = self.create_departments(company)
+            grandchild = create_department(company, 'Grandchild')
+            other = create_department(company, 'Other')
+            self.Department.write([grandchild], {'parent': child.id})
+            create_employee(company, parent, 'Alice')
+            create_employee(company, child, 'Bob')
+            create_employee(company, grandchild, 'Carol', sex='female')
+
+            def headcounts():
+                return dict((d.name, sorted((t['sex'], t['headcount'])
+                            for t in self.totals(self.Headcount, d,
+                                'headcount')))
+                    for d in (parent, child, grandchild, other))
+
+            self.Department.write([child], {'parent': other.id})
+            self.assertEqual(headcounts(), {
+                    'Parent': [('male', 1)],
+                    'Child': [('female', 1), ('male', 1)],
+                    'Grandchild': [('female', 1)],
+                    'Other': [('female', 1), ('male', 1)],
+                    })
+
+            # A subtree moved along with one of its departments
+            self.Department.write([child, grandchild], {'parent': parent.id})
+            self.assertEqual(headcounts(), {
+                    'Parent': [('female', 1), ('male', 2)],
+                    'Child': [('male', 1)],
+                    'Grandchild': [('female', 1)],
+                    'Other': [],
+                    })
+
+            self.Department.write([child], {'parent': None})
+            incremental = headcounts()
+            self.assertEqual(incremental['Parent'],
+                [('female', 1), ('male', 1)])
+            self.Headcount.rebuild()
+            self.assertEqual(headcounts(), incremental)
+
+    def test0020allowance(self):
+        '''
+        Sum the proposed allowances per state in the proposed department and
+        its ancestors
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            parent, child = self.create_departments(company)
+            employee = create_employee(company, parent)
+
+            def propose(department, allowance):
+                return self.Proposal.create({
+                    'employee': employee.id,
+                    'proposed_company': company.id,
+                    'proposed_department': department.id,
+                    'proposed_allowance': Decimal(allowance),
+                    'proposed_doj': datetime.date(2013, 1, 1),
+                })
+
+            def allowance(department):
+                return [(t['state'], t['proposals'], t['amount'])
+                    for t in self.totals(self.Allowance, department,
+                        'proposals')]
+
+            first = propose(child, 100)
+            propose(child, 50)
+            propose(parent, 25)
+            self.assertEqual(allowance(parent), [('Draft', 3, 175)])
+            self.assertEqual(allowance(child), [('Draft', 2, 150)])
+
+            self.Proposal.review([first])
+            self.Proposal.write([first], {'proposed_allowance': Decimal(80)})
+            self.assertEqual(allowance(parent), [
+                    ('Draft', 2, 75),
+                    ('In Review', 1, 80),
+                    ])
+            self.assertEqual(allowance(child), [
+                    ('Draft', 1, 50),
+                    ('In Review', 1, 80),
+                    ])
+
+            incremental = allowance(parent), allowance(child)
+            self.Allowance.rebuild()
+            self.assertEqual((allowance(parent), allowance(child)),
+                incremental)
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestRollupCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
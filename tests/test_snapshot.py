@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    test_snapshot
+
+    Test the point in time snapshot of the employees
+
+    :copyright: © 2013 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(__file__,
+    '..', '..', '..', '..', '..', 'trytond')))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+
+import datetime
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from .common import create_company, create_department, create_employee
+
+
+class TestSnapshotCase(unittest.TestCase):
+    '''
+    Test the snapshot of the employees
+    '''
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('hr')
+        self.Employee = POOL.get('company.employee')
+
+    def backdate(self, employee, dates):
+        '''
+        Date the revisions of the employee in turn
+        '''
+        cursor = Transaction().cursor
+        table = '%s__history' % self.Employee._table
+
+        cursor.execute('SELECT __id FROM "' + table + '" '
+            'WHERE id = %s ORDER BY __id', (employee.id,))
+        history_ids = [row[0] for row in cursor.fetchall()]
+        self.assertEqual(len(history_ids), len(dates))
+        cursor.execute('UPDATE "' + table + '" SET create_date = %s '
+            'WHERE id = %s', (dates[0], employee.id))
+        for history_id, date in zip(history_ids[1:], dates[1:]):
+            cursor.execute('UPDATE "' + table + '" SET write_date = %s '
+                'WHERE __id = %s', (date, history_id))
+
+    def test0010domain(self):
+        '''
+        Filter the employees on their revision at the date
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            company = create_company()
+            sales = create_department(company, 'Sales')
+            support = create_department(company, 'Support')
+            alice = create_employee(company, sales, 'Alice')
+            bob = create_employee(company, sales, 'Bob')
+            carol = create_employee(company, support, 'Carol')
+            self.Employee.write([alice], {'department': support.id})
+            self.Employee.write([carol], {'department': sales.id})
+
+            now = datetime.datetime.now().replace(microsecond=0)
+            days = lambda d: now - datetime.timedelta(days=d)
+            self.backdate(alice, [days(30), days(10)])
+            self.backdate(bob, [days(30)])
+            self.backdate(carol, [days(30), days(10)])
+
+            def snapshot(date, domain):
+                return [e['first_name']
+                    for e in self.Employee.snapshot(date, domain)]
+
+            domain = [('department', '=', sales.id)]
+            self.assertEqual(snapshot(days(20), domain), ['Alice', 'Bob'])
+            self.assertEqual(snapshot(now, domain), ['Bob', 'Carol'])
+            self.assertEqual(snapshot(days(40), domain), [])
+
+            # The employees deleted since the date are in the snapshot
+            self.Employee.delete([bob])
+            self.assertEqual(snapshot(days(20), domain), ['Alice', 'Bob'])
+            self.assertEqual(snapshot(datetime.datetime.now(), domain),
+                ['Carol'])
+            self.assertEqual(snapshot(days(20), None),
+                ['Alice', 'Bob', 'Carol'])
+
+
+def suite():
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestSnapshotCase)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())